@@ -1,16 +1,24 @@
 import os
+import hmac
+import json
+import time
 import logging
 import uuid
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import Flask, Response, g, render_template, request, jsonify, redirect, url_for, session, stream_with_context
 from flask_login import LoginManager, login_required, current_user, login_user, logout_user
 from werkzeug.utils import secure_filename
-from utils.openai_helper import process_message, process_document
+import click
+from utils.openai_helper import process_message, stream_message, remove_document, rebuild_index, restore_index, get_cache_stats, get_rerank_stats
 from datetime import datetime, timedelta
-from utils.text_processor import TextProcessor
+from sqlalchemy import tuple_
 from extensions import db
+from utils.metrics import REQUEST_SECONDS, render as render_metrics, timed
+from utils.profiling import request_profiler
+from utils.logging_config import configure_logging
+from utils.uploads import BulkUpload, UploadLimitError
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Structured logging through a background queue, configured once per process
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Initialize Flask
@@ -64,12 +72,28 @@ UPLOAD_FOLDER = '/tmp'
 ALLOWED_EXTENSIONS = {'txt', 'pdf'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Initialize TextProcessor
-text_processor = TextProcessor()
+# Bearer token required to scrape /metrics; the endpoint is disabled while it is unset
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Chat history page sizes
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
 
 # Import models after db initialization
 from models import User, ChatMessage, File
-from google_auth import google_auth
+from google_auth import google_auth, get_login_stats
+from ingestion import ingestion_queue
+from schema import create_schema
+from conversation import conversation_summarizer
+from chunk_store import chunk_store
+from user_cache import user_cache
+
+# Ingest uploads in a background worker pool
+ingestion_queue.init_app(app)
+conversation_summarizer.init_app(app)
+chunk_store.init_app(app)
+user_cache.init_app(app)
+request_profiler.init_app(app)
 
 # Register Google Auth blueprint
 app.register_blueprint(google_auth)
@@ -77,10 +101,9 @@ app.register_blueprint(google_auth)
 @login_manager.user_loader
 def load_user(user_id):
     try:
-        logger.debug(f"Loading user with ID: {user_id}")
-        return User.query.get(int(user_id))
+        return user_cache.get(int(user_id))
     except Exception as e:
-        logger.error(f"Error loading user: {str(e)}")
+        logger.error("Error loading user: %s", e)
         return None
 
 @login_manager.unauthorized_handler
@@ -89,13 +112,26 @@ def unauthorized():
     session['next'] = request.url  # Save the requested URL
     return redirect(url_for('login'))
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    start = g.pop('request_start', None)
+    if start is not None and request.endpoint != 'metrics':
+        # Route templates rather than paths keep the label set bounded
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.labels(endpoint, request.method, str(response.status_code)).observe(time.perf_counter() - start)
+    return response
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @app.route('/login')
 def login():
     if current_user.is_authenticated:
-        logger.debug(f"Already authenticated user {current_user.id} accessing login page")
+        logger.debug("Already authenticated user %s accessing login page", current_user.id)
         return redirect(url_for('index'))
     logger.debug("Rendering login page for unauthenticated user")
     return render_template('login.html')
@@ -103,7 +139,7 @@ def login():
 @app.route('/')
 @login_required
 def index():
-    logger.debug(f"User {current_user.id} accessing index page")
+    logger.debug("User %s accessing index page", current_user.id)
     return render_template('index.html')
 
 @app.route('/upload', methods=['POST'])
@@ -123,7 +159,7 @@ def upload_file():
             return jsonify({'error': 'No selected file'}), 400
 
         if not file or not allowed_file(file.filename):
-            logger.error(f"Invalid file type: {file.filename if file else 'None'}")
+            logger.error("Invalid file type: %s", file.filename if file else 'None')
             return jsonify({'error': 'Invalid file type'}), 400
 
         try:
@@ -131,59 +167,152 @@ def upload_file():
             original_filename = secure_filename(file.filename)
             unique_filename = f"{uuid.uuid4()}_{original_filename}"
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            logger.debug(f"Saving file to: {filepath}")
+            logger.debug("Saving file to: %s", filepath)
 
-            file.save(filepath)
+            with timed('upload_save'):
+                file.save(filepath)
             logger.debug("File saved successfully")
 
-            # Create file record in database
+            # Create file record in database; the ingestion pool picks it up from here
             file_record = File(
                 filename=unique_filename,
                 original_filename=original_filename,
-                user_id=current_user.id
+                user_id=current_user.id,
+                job_id=str(uuid.uuid4()),
+                status='pending',
+                progress=0
             )
             db.session.add(file_record)
-            db.session.commit()
+            with timed('db_commit'):
+                db.session.commit()
 
-            # Process based on file type
-            if original_filename.lower().endswith('.pdf'):
-                content = text_processor.extract_text_from_pdf(filepath)
-            else:  # .txt files
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    content = f.read()
-
-            logger.debug(f"File content read, length: {len(content)} characters")
-
-            # Process the document content
-            num_chunks = process_document(content)
-            logger.debug(f"Document processed into {num_chunks} chunks")
+            ingestion_queue.submit(file_record.id)
 
             return jsonify({
-                'message': 'File processed successfully',
+                'message': 'File queued for processing',
+                'job_id': file_record.job_id,
                 'file': file_record.to_dict()
-            })
+            }), 202
 
         except Exception as e:
-            logger.error(f"Error processing file: {str(e)}")
+            logger.error("Error processing file: %s", e)
             db.session.rollback()
             if filepath and os.path.exists(filepath):
                 os.remove(filepath)
             return jsonify({'error': f'Error processing file: {str(e)}'}), 500
 
     except Exception as e:
-        logger.error(f"Unexpected error in upload: {str(e)}")
+        logger.error("Unexpected error in upload: %s", e)
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+@app.route('/upload/bulk', methods=['POST'])
+@login_required
+def upload_bulk():
+    """
+    Queue many documents at once: any number of 'files' parts, each a .txt
+    or .pdf file or a .zip archive of them. Unsupported files and archive
+    members are listed under 'skipped'; the rest become one batch whose
+    progress is reported by /batches/<batch_id>.
+    """
+    uploads = [upload for upload in request.files.getlist('files') if upload.filename]
+    if not uploads:
+        logger.error("No files in bulk upload request")
+        return jsonify({'error': 'No files'}), 400
+
+    bulk_upload = BulkUpload(app.config['UPLOAD_FOLDER'], ALLOWED_EXTENSIONS)
+    try:
+        with timed('upload_save'):
+            for upload in uploads:
+                bulk_upload.add(upload)
+        if not bulk_upload.saved:
+            return jsonify({'error': 'No supported files', 'skipped': bulk_upload.skipped}), 400
+
+        # One multi-row INSERT for the whole batch; the ingestion pool picks it up from here
+        batch_id = str(uuid.uuid4())
+        file_records = [
+            File(
+                filename=stored_filename,
+                original_filename=original_filename,
+                user_id=current_user.id,
+                job_id=str(uuid.uuid4()),
+                batch_id=batch_id,
+                status='pending',
+                progress=0
+            )
+            for stored_filename, original_filename in bulk_upload.saved
+        ]
+        db.session.add_all(file_records)
+        with timed('db_commit'):
+            db.session.flush()
+            files = [file_record.to_dict() for file_record in file_records]
+            db.session.commit()
+
+        ingestion_queue.submit_batch(current_user.id, [file['id'] for file in files])
+        logger.info("Queued bulk upload of %s files, %s skipped", len(files), len(bulk_upload.skipped))
+
+        return jsonify({
+            'message': 'Files queued for processing',
+            'batch_id': batch_id,
+            'files': files,
+            'skipped': bulk_upload.skipped
+        }), 202
+
+    except UploadLimitError as e:
+        logger.error("Bulk upload rejected: %s", e)
+        bulk_upload.discard()
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        logger.error("Error processing bulk upload: %s", e)
+        db.session.rollback()
+        bulk_upload.discard()
+        return jsonify({'error': f'Error processing files: {str(e)}'}), 500
+
 @app.route('/files', methods=['GET'])
 @login_required
 def get_files():
     try:
         files = File.query.filter_by(user_id=current_user.id).order_by(File.uploaded_at.desc()).all()
-        return jsonify({'files': [file.to_dict() for file in files]})
+        counts = chunk_store.counts(current_user.id)
+        empty = {'chunks': 0, 'tokens': 0}
+        return jsonify({'files': [
+            {**file.to_dict(), 'chunk_count': counts.get(file.id, empty)['chunks'],
+             'token_count': counts.get(file.id, empty)['tokens']}
+            for file in files
+        ]})
     except Exception as e:
-        logger.error(f"Error retrieving files: {str(e)}")
+        logger.error("Error retrieving files: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job_status(job_id):
+    file = File.query.filter_by(job_id=job_id, user_id=current_user.id).first()
+    if not file:
+        return jsonify({'error': 'Job not found or unauthorized'}), 404
+    return jsonify({'job': file.to_dict()})
+
+@app.route('/batches/<batch_id>', methods=['GET'])
+@login_required
+def get_batch_status(batch_id):
+    files = File.query.filter_by(batch_id=batch_id, user_id=current_user.id).order_by(File.id).all()
+    if not files:
+        return jsonify({'error': 'Batch not found or unauthorized'}), 404
+    counts = {status: 0 for status in ('pending', 'indexing', 'ready', 'failed')}
+    for file in files:
+        counts[file.status] = counts.get(file.status, 0) + 1
+    if counts['pending'] or counts['indexing']:
+        status = 'indexing'
+    else:
+        status = 'failed' if counts['failed'] == len(files) else 'ready'
+    return jsonify({'batch': {
+        'id': batch_id,
+        'status': status,
+        # Failed files are done as far as the batch is concerned
+        'progress': sum(100 if file.status == 'failed' else file.progress for file in files) // len(files),
+        'counts': counts,
+        'files': [file.to_dict() for file in files]
+    }})
+
 @app.route('/files/<int:file_id>', methods=['DELETE'])
 @login_required
 def delete_file(file_id):
@@ -193,19 +322,35 @@ def delete_file(file_id):
         if not file:
             return jsonify({'error': 'File not found or unauthorized'}), 404
 
+        # Only marks the chunks deleted; merging them away is left to the ingestion workers
+        remove_document(current_user.id, file.id)
+        ingestion_queue.submit_compaction(current_user.id)
+
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
         if os.path.exists(filepath):
             os.remove(filepath)
 
+        chunk_store.delete(file.id)
         db.session.delete(file)
         db.session.commit()
 
         return jsonify({'message': 'File deleted successfully'})
     except Exception as e:
-        logger.error(f"Error deleting file: {str(e)}")
+        logger.error("Error deleting file: %s", e)
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def parse_file_ids(data):
+    """
+    Optional 'file_ids' list from a chat request, restricting retrieval to those of the user's files.
+    """
+    file_ids = data.get('file_ids')
+    if file_ids is None:
+        return None
+    if not isinstance(file_ids, list) or not all(isinstance(file_id, int) for file_id in file_ids):
+        raise ValueError('file_ids must be a list of file ids')
+    return file_ids
+
 @app.route('/chat', methods=['POST'])
 @login_required
 def chat():
@@ -216,47 +361,177 @@ def chat():
         if not message:
             logger.error("No message provided")
             return jsonify({'error': 'No message provided'}), 400
+        try:
+            file_ids = parse_file_ids(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
         # Create and save user message with user_id
         user_message = ChatMessage(role='user', content=message, user_id=current_user.id)
         db.session.add(user_message)
-        db.session.commit()
+        with timed('db_commit'):
+            db.session.commit()
 
         try:
-            # Get recent chat history from database for current user
-            chat_history = [msg.to_dict() for msg in 
-                          ChatMessage.query.filter_by(user_id=current_user.id)
-                          .order_by(ChatMessage.timestamp.desc()).limit(10).all()]
-            chat_history.reverse()  # Most recent last
+            # Conversation summary and the recent turns it doesn't cover yet
+            with timed('db_history'):
+                summary, chat_history = conversation_summarizer.load_history(current_user.id, before_id=user_message.id)
+            user_message_dict = user_message.to_dict()
+
+            # Return the connection to the pool rather than holding it for the whole completion
+            db.session.close()
 
-            response = process_message(message, chat_history)
+            response = process_message(message, chat_history, current_user.id, summary, file_ids)
 
             # Save assistant's response with user_id
             assistant_message = ChatMessage(role='assistant', content=response, user_id=current_user.id)
             db.session.add(assistant_message)
-            db.session.commit()
+            with timed('db_commit'):
+                db.session.commit()
+            conversation_summarizer.submit(current_user.id)
 
+            # Only the messages created by this request; clients append them
             return jsonify({
                 'response': response,
-                'history': [msg.to_dict() for msg in 
-                           ChatMessage.query.filter_by(user_id=current_user.id)
-                           .order_by(ChatMessage.timestamp).all()]
+                'messages': [user_message_dict, assistant_message.to_dict()]
             })
 
         except Exception as e:
-            logger.error(f"OpenAI processing error: {str(e)}")
+            logger.error("OpenAI processing error: %s", e)
             db.session.rollback()
             return jsonify({'error': str(e)}), 500
 
     except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}")
+        logger.error("Error in chat endpoint: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    data = request.json
+    message = data.get('message') if data else None
+
+    if not message:
+        logger.error("No message provided")
+        return jsonify({'error': 'No message provided'}), 400
+    try:
+        file_ids = parse_file_ids(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    user_id = current_user.id
+    try:
+        # Create and save user message with user_id
+        user_message = ChatMessage(role='user', content=message, user_id=user_id)
+        db.session.add(user_message)
+        with timed('db_commit'):
+            db.session.commit()
+
+        # Conversation summary and the recent turns it doesn't cover yet
+        with timed('db_history'):
+            summary, chat_history = conversation_summarizer.load_history(user_id, before_id=user_message.id)
+    except Exception as e:
+        logger.error("Error in chat stream endpoint: %s", e)
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Don't hold a pooled connection while the completion streams
+        db.session.close()
+
+    def generate():
+        tokens = []
+        try:
+            for token in stream_message(message, chat_history, user_id, summary, file_ids):
+                tokens.append(token)
+                yield f"data: {json.dumps({'token': token})}\n\n"
+
+            # Save assistant's response once the stream has finished
+            assistant_message = ChatMessage(role='assistant', content=''.join(tokens), user_id=user_id)
+            db.session.add(assistant_message)
+            with timed('db_commit'):
+                db.session.commit()
+            conversation_summarizer.submit(user_id)
+
+            yield f"event: done\ndata: {json.dumps({'message': assistant_message.to_dict()})}\n\n"
+
+        except Exception as e:
+            logger.error("OpenAI streaming error: %s", e)
+            db.session.rollback()
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/history', methods=['GET'])
 @login_required
 def get_history():
-    messages = ChatMessage.query.filter_by(user_id=current_user.id).order_by(ChatMessage.timestamp).all()
-    return jsonify({'history': [msg.to_dict() for msg in messages]})
+    """
+    Cursor-paginated chat history, oldest first within the page.
+
+    ?before=<message id> returns the page of messages preceding that message,
+    ?after=<message id> the page following it, and neither the latest page.
+    """
+    try:
+        limit = min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), HISTORY_MAX_PAGE_SIZE)
+        before_id = request.args.get('before', type=int)
+        after_id = request.args.get('after', type=int)
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+
+        query = ChatMessage.query.filter_by(user_id=current_user.id)
+        position = tuple_(ChatMessage.timestamp, ChatMessage.id)
+        cursor_id = after_id if after_id is not None else before_id
+
+        if cursor_id is not None:
+            cursor = ChatMessage.query.filter_by(id=cursor_id, user_id=current_user.id).first()
+            if not cursor:
+                return jsonify({'error': 'Cursor message not found'}), 404
+            cursor_position = (cursor.timestamp, cursor.id)
+
+        # Fetch one extra row to know whether another page exists
+        if after_id is not None:
+            messages = (query.filter(position > cursor_position)
+                        .order_by(ChatMessage.timestamp, ChatMessage.id)
+                        .limit(limit + 1).all())
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+        else:
+            if before_id is not None:
+                query = query.filter(position < cursor_position)
+            messages = (query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+                        .limit(limit + 1).all())
+            has_more = len(messages) > limit
+            messages = messages[:limit][::-1]
+
+        return jsonify({
+            'history': [msg.to_dict() for msg in messages],
+            'has_more': has_more
+        })
+    except Exception as e:
+        logger.error("Error retrieving history: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/stats', methods=['GET'])
+@login_required
+def get_stats():
+    return jsonify({**get_cache_stats(), 'rerank': get_rerank_stats(), 'login': get_login_stats(),
+                    'users': user_cache.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus scrape endpoint, aggregated across gunicorn workers.
+    Requires METRICS_TOKEN as a bearer token and is not served without one.
+    """
+    if not METRICS_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        return jsonify({'error': 'Unauthorized'}), 401
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
 
 @app.route('/reset', methods=['POST'])
 @login_required
@@ -264,6 +539,7 @@ def reset_chat():
     try:
         # Clear chat messages for current user only
         ChatMessage.query.filter_by(user_id=current_user.id).delete()
+        conversation_summarizer.clear(current_user.id)
         db.session.commit()
         logger.debug("Chat history cleared successfully")
 
@@ -272,10 +548,28 @@ def reset_chat():
             'history': []
         }), 200
     except Exception as e:
-        logger.error(f"Error resetting chat: {str(e)}")
+        logger.error("Error resetting chat: %s", e)
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-# Create database tables
+@app.cli.command('rebuild-index')
+@click.option('--user-id', type=int, help='Only rebuild this user\'s index')
+@click.option('--type', 'index_type', type=click.Choice(['auto', 'flat', 'ivfpq', 'hnsw']),
+              help='Index type to train (defaults to INDEX_TYPE)')
+@click.option('--from-db', is_flag=True,
+              help='Rebuild the whole index from the chunks stored in the database')
+def rebuild_index_command(user_id, index_type, from_db):
+    """Retrain vector indexes, e.g. after changing INDEX_TYPE or index parameters."""
+    user_ids = [user_id] if user_id else [user.id for user in User.query.all()]
+    for uid in user_ids:
+        if from_db:
+            num_chunks = restore_index(uid, chunk_store.load(uid))
+            click.echo(f"user {uid}: restored {num_chunks} chunks")
+            if not num_chunks or not index_type:
+                continue
+        result = rebuild_index(uid, index_type)
+        click.echo(f"user {uid}: {result or 'no index'}")
+
+# Create database tables; every worker does this, one at a time
 with app.app_context():
-    db.create_all()
\ No newline at end of file
+    create_schema()
\ No newline at end of file
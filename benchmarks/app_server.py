@@ -0,0 +1,149 @@
+"""
+Boot the app under gunicorn against SQLite, the local fake OpenAI server and
+optionally the stub OpenID provider, for load tests.
+"""
+import http.client
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+from flask_login.utils import _create_identifier
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = 'benchmark-secret'
+METRICS_TOKEN = 'benchmark-metrics'
+USER_AGENT = 'knowledge-base-benchmark'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def session_cookie(user_id, remote_addr='127.0.0.1', user_agent=USER_AGENT):
+    """
+    A signed Flask-Login session for user_id, valid under 'strong' session
+    protection for requests from remote_addr with user_agent.
+    """
+    app = Flask(__name__)
+    app.secret_key = SECRET_KEY
+    with app.test_request_context(headers={'User-Agent': user_agent}, environ_base={'REMOTE_ADDR': remote_addr}):
+        identifier = _create_identifier()
+    serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+    return serializer.dumps({'_user_id': str(user_id), '_fresh': True, '_id': identifier})
+
+
+class AppServer:
+    """
+    gunicorn running main:app in a scratch directory, logged in as one user.
+
+    Extra environment (e.g. GUNICORN_WORKER_CLASS) is passed through `env`.
+    """
+
+    def __init__(self, openai_base_url, env=None, workers=1, directory=None, oidc_discovery_url=None):
+        self.directory = directory or tempfile.mkdtemp(prefix='kb-bench-')
+        self.port = free_port()
+        self.env = {
+            **os.environ,
+            'OPENAI_API_KEY': 'fake',
+            'OPENAI_BASE_URL': openai_base_url,
+            'FLASK_SECRET_KEY': SECRET_KEY,
+            'METRICS_TOKEN': METRICS_TOKEN,
+            'GOOGLE_OAUTH_CLIENT_ID': 'fake',
+            'GOOGLE_OAUTH_CLIENT_SECRET': 'fake',
+            'DATABASE_URL': f"sqlite:///{os.path.join(self.directory, 'app.db')}",
+            'INDEX_STORE_DIR': os.path.join(self.directory, 'indexes'),
+            'EMBEDDING_CACHE_PATH': os.path.join(self.directory, 'embedding_cache.sqlite3'),
+            'GUNICORN_BIND': f"127.0.0.1:{self.port}",
+            'GUNICORN_WORKERS': str(workers),
+            # The stub OpenID provider speaks plain HTTP
+            'OAUTHLIB_INSECURE_TRANSPORT': '1',
+            **({'GOOGLE_DISCOVERY_URL': oidc_discovery_url} if oidc_discovery_url else {}),
+            **(env or {}),
+        }
+        self.process = None
+        self.log_path = os.path.join(self.directory, 'gunicorn.log')
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout=60):
+        with open(self.log_path, 'ab') as log:
+            # Create the schema once up front, so the workers find it in place
+            subprocess.run([sys.executable, '-c', 'import app'], cwd=REPO_ROOT, env=self.env,
+                           stdout=log, stderr=subprocess.STDOUT, check=True)
+            self.process = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'main:app'],
+                cwd=REPO_ROOT, env=self.env, stdout=log, stderr=subprocess.STDOUT,
+            )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {self.process.returncode}, see {self.log_path}")
+            # Any HTTP response means a worker has imported the app
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+                conn.request('GET', '/login')
+                conn.getresponse().read()
+                conn.close()
+                break
+            except OSError:
+                time.sleep(0.2)
+        else:
+            self.stop()
+            raise RuntimeError(f"gunicorn did not start within {timeout}s, see {self.log_path}")
+        return self
+
+    def create_user(self, user_id=1):
+        """Insert a user directly into the app's database and return its session cookie."""
+        with sqlite3.connect(os.path.join(self.directory, 'app.db')) as conn:
+            conn.execute('INSERT OR IGNORE INTO user (id, username, email) VALUES (?, ?, ?)',
+                         (user_id, f"bench{user_id}", f"bench{user_id}@example.com"))
+        return session_cookie(user_id)
+
+    def login(self, login_hint):
+        """
+        Sign in through /google_login and the stub OpenID provider, returning
+        the logged-in requests.Session.
+        """
+        session = requests.Session()
+        session.headers['User-Agent'] = USER_AGENT
+
+        def allow_insecure_cookies():
+            # The app marks its cookies Secure, but the benchmark talks plain HTTP
+            for cookie in session.cookies:
+                cookie.secure = False
+
+        response = session.get(f"{self.base_url}/google_login", allow_redirects=False)
+        allow_insecure_cookies()
+        authorize_url = f"{response.headers['Location']}&login_hint={login_hint}"
+        response = requests.get(authorize_url, allow_redirects=False)
+        callback_url = response.headers['Location'].replace('https://', 'http://', 1)
+        response = session.get(callback_url, allow_redirects=False)
+        allow_insecure_cookies()
+        if response.status_code != 302 or '/login' in response.headers.get('Location', ''):
+            raise RuntimeError(f"Sign-in failed for {login_hint}, see {self.log_path}")
+        return session
+
+    def metrics(self):
+        """The Prometheus text from /metrics."""
+        response = requests.get(f"{self.base_url}/metrics", headers={'Authorization': f"Bearer {self.env['METRICS_TOKEN']}"})
+        response.raise_for_status()
+        return response.text
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
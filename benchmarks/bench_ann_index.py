@@ -0,0 +1,96 @@
+"""
+Latency, memory and recall of the ANN index types against exact (flat) search.
+
+    python -m benchmarks.bench_ann_index --vectors 20000 --dimensions 128 --queries 200
+
+Vectors are drawn around random cluster centres, which is closer to real
+embedding distributions than uniform noise. Recall@k is measured against the
+flat index's exact neighbours; memory is the serialized index size.
+"""
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+
+from utils import ann_index
+
+
+def clustered_vectors(num_vectors, dimensions, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dimensions)).astype(np.float32)
+    assignments = rng.integers(0, clusters, size=num_vectors)
+    noise = rng.normal(scale=0.35, size=(num_vectors, dimensions)).astype(np.float32)
+    return centres[assignments] + noise
+
+
+def recall_at_k(found, expected):
+    k = expected.shape[1]
+    hits = sum(len(set(row_found) & set(row_expected)) for row_found, row_expected in zip(found, expected))
+    return hits / (len(expected) * k)
+
+
+def measure(index, queries, k):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, labels = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        results.append(labels[0])
+    return np.array(results), np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vectors', type=int, default=20000)
+    parser.add_argument('--dimensions', type=int, default=128)
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    data = clustered_vectors(args.vectors + args.queries, args.dimensions, args.clusters, args.seed)
+    vectors, queries = data[:args.vectors], data[args.vectors:]
+
+    flat = faiss.IndexFlatL2(args.dimensions)
+    flat.add(vectors)
+    expected, flat_latencies = measure(flat, queries, args.k)
+
+    configurations = [
+        ('flat', None, flat, 0.0),
+    ]
+    for label, index_type, storage in [
+        ('ivfpq', 'ivfpq', None),
+        ('hnsw-flat', 'hnsw', 'flat'),
+        ('hnsw-fp16', 'hnsw', 'fp16'),
+        ('hnsw-pq', 'hnsw', 'pq'),
+    ]:
+        if storage:
+            ann_index.INDEX_HNSW_STORAGE = storage
+        start = time.perf_counter()
+        index = ann_index.build_ann_index(index_type, vectors)
+        configurations.append((label, ann_index.factory_string(index_type, args.vectors, args.dimensions),
+                               index, time.perf_counter() - start))
+
+    print(f"{args.vectors} vectors, d={args.dimensions}, {args.queries} queries, "
+          f"nprobe={ann_index.INDEX_NPROBE}, efSearch={ann_index.INDEX_EF_SEARCH}")
+    print(f"{'index':>10} {'factory':>16} {'build s':>8} {'p50 ms':>7} {'p95 ms':>7} "
+          f"{'size MB':>8} {f'recall@{args.k}':>10}")
+    for label, description, index, build_seconds in configurations:
+        if index is flat:
+            found, latencies = expected, flat_latencies
+        else:
+            found, latencies = measure(index, queries, args.k)
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+        print(f"{label:>10} {description or 'Flat':>16} {build_seconds:>8.2f} "
+              f"{np.percentile(latencies, 50):>7.3f} {np.percentile(latencies, 95):>7.3f} "
+              f"{size_mb:>8.2f} {recall_at_k(found, expected):>10.3f}")
+
+
+if __name__ == '__main__':
+    # Single-threaded search gives comparable per-query latencies
+    faiss.omp_set_num_threads(int(os.environ.get('OMP_NUM_THREADS', 1)))
+    main()
@@ -0,0 +1,118 @@
+"""
+Onboarding a folder of documents: one /upload request per file against a
+single zip archive sent to /upload/bulk.
+
+    python -m benchmarks.bench_bulk_upload --files 100 --pages 5 --latency 0.05
+
+Each mode gets a fresh gunicorn server backed by SQLite and the local fake
+OpenAI server, whose embedding requests take --latency seconds. Vectors
+default to 256 dimensions so that encoding them in the fake server does not
+crowd the app off the CPU. The clock runs from the first request until
+every file is ready.
+
+  upload s   time spent sending the upload requests
+  ready s    time until every file was ready, uploads included
+  commits    index versions written, from the index_add stage count on /metrics
+  requests   HTTP requests made, polling excluded
+"""
+import argparse
+import os
+import re
+import tempfile
+import time
+import zipfile
+
+import requests
+
+from benchmarks.app_server import USER_AGENT, AppServer
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.synthetic import write_synthetic_pdf
+
+POLL_INTERVAL = 0.2
+
+
+def index_commits(server):
+    metrics = server.metrics()
+    match = re.search(r'^kb_stage_duration_seconds_count\{stage="index_add"\} (\S+)$', metrics, re.MULTILINE)
+    return int(float(match.group(1))) if match else 0
+
+
+def wait_until_ready(session, url, timeout, files_of):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        files = files_of(session.get(url).json())
+        if all(file['status'] in ('ready', 'failed') for file in files):
+            return files
+        time.sleep(POLL_INTERVAL)
+    raise RuntimeError(f"Files not ready within {timeout}s")
+
+
+def upload_one_by_one(session, base_url, paths, timeout):
+    for path in paths:
+        with open(path, 'rb') as f:
+            response = session.post(f"{base_url}/upload", files={'file': (os.path.basename(path), f)})
+        response.raise_for_status()
+    uploaded = time.perf_counter()
+    files = wait_until_ready(session, f"{base_url}/files", timeout, lambda body: body['files'])
+    return uploaded, files, len(paths)
+
+
+def upload_archive(session, base_url, paths, timeout):
+    with tempfile.NamedTemporaryFile(suffix='.zip') as archive_file:
+        with zipfile.ZipFile(archive_file, 'w') as archive:
+            for path in paths:
+                archive.write(path, os.path.join('documents', os.path.basename(path)))
+        archive_file.seek(0)
+        response = session.post(f"{base_url}/upload/bulk", files={'files': ('documents.zip', archive_file)})
+    response.raise_for_status()
+    uploaded = time.perf_counter()
+    batch_url = f"{base_url}/batches/{response.json()['batch_id']}"
+    files = wait_until_ready(session, batch_url, timeout, lambda body: body['batch']['files'])
+    return uploaded, files, 1
+
+
+MODES = {'single': upload_one_by_one, 'bulk': upload_archive}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--pages', type=int, default=5, help='pages per PDF')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per embedding request')
+    parser.add_argument('--dimensions', type=int, default=256, help='embedding dimensions')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    openai_server = FakeOpenAIServer(latency=args.latency, dimensions=args.dimensions).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for i in range(args.files):
+                path = os.path.join(directory, f"document-{i:04d}.pdf")
+                write_synthetic_pdf(path, args.pages, seed=i)
+                paths.append(path)
+            print(f"{args.files} PDFs of {args.pages} pages, {args.latency * 1000:.0f} ms per embedding request, "
+                  f"{args.workers} workers")
+            print(f"{'mode':>7} {'upload s':>9} {'ready s':>8} {'commits':>8} {'requests':>9} {'failed':>7}")
+            for mode in args.modes:
+                server = AppServer(openai_server.base_url, workers=args.workers).start()
+                try:
+                    session = requests.Session()
+                    session.headers['User-Agent'] = USER_AGENT
+                    session.cookies.set('session', server.create_user())
+                    start = time.perf_counter()
+                    uploaded, files, num_requests = MODES[mode](session, server.base_url, paths, args.timeout)
+                    ready = time.perf_counter()
+                    failed = sum(1 for file in files if file['status'] == 'failed')
+                    print(f"{mode:>7} {uploaded - start:>9.2f} {ready - start:>8.2f} "
+                          f"{index_commits(server):>8} {num_requests:>9} {failed:>7}")
+                finally:
+                    server.stop()
+    finally:
+        openai_server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Concurrent /chat load test: sync gunicorn workers against gevent workers.
+
+    python -m benchmarks.bench_chat_concurrency --concurrency 200 --requests 400 --chat-latency 2
+
+Each worker class serves the app with the same number of processes, backed
+by SQLite and the local fake OpenAI server, whose completions take
+--chat-latency seconds. Sync workers can only have `workers` completions in
+flight; gevent workers keep waiting on OpenAI while serving more requests.
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.app_server import USER_AGENT, AppServer
+from benchmarks.fake_openai import FakeOpenAIServer
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_load(base_url, cookie, concurrency, total_requests, timeout):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def send(i):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+            session.headers['User-Agent'] = USER_AGENT
+            session.cookies.set('session', cookie)
+        start = time.perf_counter()
+        try:
+            # Distinct questions so the response cache never answers
+            response = session.post(f"{base_url}/chat", timeout=timeout,
+                                    json={'message': f"load test question number {i} about the documents"})
+            ok = response.status_code == 200 and 'response' in response.json()
+            error = None if ok else f"HTTP {response.status_code}"
+        except (requests.RequestException, ValueError) as e:
+            error = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            if error:
+                errors.append(error)
+            else:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, range(total_requests)))
+    return time.perf_counter() - start, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker-classes', nargs='+', default=['sync', 'gevent'])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--chat-latency', type=float, default=2.0, help='fake completion seconds')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    openai_server = FakeOpenAIServer(latency=0.01, chat_latency=args.chat_latency).start()
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.workers} workers, "
+          f"{args.chat_latency}s completions")
+    print(f"{'worker':>8} {'seconds':>8} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'errors':>7} {'peak in flight':>15}")
+    try:
+        for worker_class in args.worker_classes:
+            openai_server.counters['max_in_flight'] = 0
+            app_server = AppServer(openai_server.base_url, workers=args.workers,
+                                   env={'GUNICORN_WORKER_CLASS': worker_class,
+                                        'GUNICORN_TIMEOUT': str(int(args.timeout))}).start()
+            try:
+                cookie = app_server.create_user()
+                elapsed, latencies, errors = run_load(app_server.base_url, cookie, args.concurrency,
+                                                      args.requests, args.timeout)
+            finally:
+                app_server.stop()
+            p50 = statistics.median(latencies) if latencies else float('nan')
+            p95 = percentile(latencies, 0.95) if latencies else float('nan')
+            print(f"{worker_class:>8} {elapsed:>8.2f} {len(latencies) / elapsed:>7.1f} {p50:>7.2f} {p95:>7.2f} "
+                  f"{len(errors):>7} {openai_server.counters['max_in_flight']:>15}")
+            if errors:
+                print(f"{'':>8} errors: {sorted(set(errors))}, log: {app_server.log_path}")
+    finally:
+        openai_server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Embedding throughput of EmbeddingScheduler against the local fake OpenAI server.
+
+    python -m benchmarks.bench_embedding_throughput --chunks 2000 --latency 0.2 --tokens-per-minute 2000000
+
+Compares one batch at a time (concurrency 1) with concurrent batches, and
+reports how many requests were rate limited and retried.
+"""
+import argparse
+import time
+
+from openai import OpenAI
+
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.synthetic import synthetic_text
+from utils.embedding_scheduler import EmbeddingScheduler
+
+
+def run(server, texts, concurrency, batch_tokens):
+    client = OpenAI(api_key='fake', base_url=server.base_url, max_retries=0)
+    scheduler = EmbeddingScheduler(client=client, max_batch_tokens=batch_tokens, concurrency=concurrency)
+    start = time.perf_counter()
+    vectors = scheduler.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+    assert len(vectors) == len(texts) and all(vectors)
+    return elapsed, scheduler.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--words-per-chunk', type=int, default=180)
+    parser.add_argument('--latency', type=float, default=0.2, help='fake server seconds per request')
+    parser.add_argument('--latency-per-input', type=float, default=0.001)
+    parser.add_argument('--tokens-per-minute', type=int, default=None)
+    parser.add_argument('--batch-tokens', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    texts = [synthetic_text(args.words_per_chunk, seed=i) for i in range(args.chunks)]
+
+    print(f"{'concurrency':>11} {'seconds':>8} {'chunks/s':>9} {'batches':>8} {'429s':>5} {'retries':>8}")
+    for concurrency in args.concurrency:
+        # Fresh server per run so each starts with a full rate-limit bucket
+        server = FakeOpenAIServer(
+            latency=args.latency, latency_per_input=args.latency_per_input,
+            dimensions=256, tokens_per_minute=args.tokens_per_minute,
+        ).start()
+        try:
+            elapsed, stats = run(server, texts, concurrency, args.batch_tokens)
+        finally:
+            server.stop()
+        print(f"{concurrency:>11} {elapsed:>8.2f} {len(texts) / elapsed:>9.1f} {stats['batches']:>8} "
+              f"{stats['rate_limited']:>5} {stats['retries']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Latency and recall of file-scoped retrieval: the filter applied inside the
+faiss search versus over-fetching and discarding other files' chunks.
+
+    python -m benchmarks.bench_filtered_search --files 5000 --chunks-per-file 20
+    python -m benchmarks.bench_filtered_search --files 20000 --chunks-per-file 50 --select 1 100 10000
+
+One user's index holds files * chunks-per-file chunks, with an ANN companion
+index as a large tenant's would have. Each query is restricted to a random
+selection of files; "full" is the share of queries that still got k results
+and recall@k is measured against exact search over the selected chunks only.
+The in-index filter includes the cost of building its file mask and selector bitmap.
+"""
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+
+from benchmarks.bench_ann_index import clustered_vectors, recall_at_k
+from utils import ann_index
+
+
+def exact_neighbours(vectors, query, positions, k):
+    _, labels = faiss.knn(query, vectors[positions], min(k, len(positions)))
+    return positions[labels[0]]
+
+
+def in_index(flat, ann, query, k, position_files, file_ids):
+    # As TextProcessor.file_mask builds it
+    selected_files = np.zeros(int(position_files.max()) + 2, dtype=bool)
+    selected_files[file_ids] = True
+    _, labels = ann_index.filtered_search(flat, ann, query, k, selected_files[position_files])
+    return labels[0]
+
+
+def post_filter(ann, query, k, chunks_per_file, file_ids, overfetch):
+    allowed = set(file_ids.tolist())
+    _, labels = ann.search(query, k * overfetch)
+    return np.array([label for label in labels[0] if label // chunks_per_file in allowed][:k], dtype=np.int64)
+
+
+def run(strategy, queries, selections, expected, k):
+    latencies, found, full = [], [], 0
+    for query, file_ids, row in zip(queries, selections, expected):
+        start = time.perf_counter()
+        labels = strategy(query[None, :], file_ids)
+        latencies.append((time.perf_counter() - start) * 1000)
+        labels = labels[labels != -1]
+        full += len(labels) >= len(row)
+        found.append(np.pad(labels, (0, len(row) - len(labels)), constant_values=-1))
+    return np.array(latencies), full / len(queries), recall_at_k(found, expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--chunks-per-file', type=int, default=20)
+    parser.add_argument('--select', type=int, nargs='+', default=[1, 10, 100, 1000],
+                        help='number of files each query is restricted to')
+    parser.add_argument('--dimensions', type=int, default=128)
+    parser.add_argument('--index-type', choices=['ivfpq', 'hnsw'], default=ann_index.INDEX_ANN_TYPE)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--overfetch', type=int, default=10, help='post-filter fetches k times this')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    num_vectors = args.files * args.chunks_per_file
+    rng = np.random.default_rng(args.seed)
+    data = clustered_vectors(num_vectors + args.queries, args.dimensions, 200, args.seed)
+    vectors, queries = data[:num_vectors], data[num_vectors:]
+    # Chunks of a file are contiguous, as ingestion appends them
+    position_files = np.repeat(np.arange(args.files, dtype=np.int64), args.chunks_per_file)
+
+    flat = faiss.IndexFlatL2(args.dimensions)
+    flat.add(vectors)
+    start = time.perf_counter()
+    ann = ann_index.build_ann_index(args.index_type, vectors)
+    print(f"{args.files} files x {args.chunks_per_file} chunks = {num_vectors} vectors, d={args.dimensions}, "
+          f"{args.index_type} built in {time.perf_counter() - start:.1f} s, k={args.k}, "
+          f"exact below {ann_index.INDEX_FILTER_EXACT_MAX} selected chunks")
+    print(f"{'files':>6} {'chunks':>8} {'strategy':>12} {'p50 ms':>7} {'p95 ms':>7} {'full':>6} {f'recall@{args.k}':>10}")
+
+    for selected in args.select:
+        selections = [rng.choice(args.files, size=min(selected, args.files), replace=False)
+                      for _ in range(args.queries)]
+        expected = []
+        for query, file_ids in zip(queries, selections):
+            positions = np.flatnonzero(np.isin(position_files, file_ids))
+            expected.append(exact_neighbours(vectors, query[None, :], positions, args.k))
+        expected = np.array(expected)
+
+        strategies = [
+            ('in-index', lambda query, file_ids: in_index(flat, ann, query, args.k, position_files, file_ids)),
+            (f'post x{args.overfetch}', lambda query, file_ids: post_filter(
+                ann, query, args.k, args.chunks_per_file, file_ids, args.overfetch)),
+        ]
+        for label, strategy in strategies:
+            latencies, full, recall = run(strategy, queries, selections, expected, args.k)
+            print(f"{selected:>6} {selected * args.chunks_per_file:>8} {label:>12} "
+                  f"{np.percentile(latencies, 50):>7.2f} {np.percentile(latencies, 95):>7.2f} "
+                  f"{full:>6.0%} {recall:>10.3f}")
+
+
+if __name__ == '__main__':
+    # Single-threaded search gives comparable per-query latencies
+    faiss.omp_set_num_threads(int(os.environ.get('OMP_NUM_THREADS', 1)))
+    main()
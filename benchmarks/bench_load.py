@@ -0,0 +1,293 @@
+"""
+Mixed-traffic load test of /upload, /chat, /history and /files.
+
+    python -m benchmarks.bench_load --users 10 --concurrency 20 --duration 30 --output load.json
+    python -m benchmarks.bench_load --compare before.json after.json
+
+Boots the app under gunicorn against SQLite, with the local fake OpenAI
+server (embeddings and chat) and the stub OpenID provider standing in for
+Google, each with configurable latency. Every user signs in through the
+real /google_login flow and uploads one seed document, then --concurrency
+clients send requests drawn from --mix for --duration seconds, or until
+--requests have been sent.
+
+Reported per endpoint: requests, errors, throughput over the run and
+p50/p95/p99 latency; sign-ins are reported as /google_login. Results, the
+configuration and the commit they were measured at are written as JSON to
+--output, and --compare prints the latency and throughput change between
+two such files.
+"""
+import argparse
+import itertools
+import json
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+
+from benchmarks.app_server import REPO_ROOT, USER_AGENT, AppServer
+from benchmarks.fake_oidc import FakeOIDCProvider
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.synthetic import synthetic_text
+
+ENDPOINTS = ['/upload', '/chat', '/history', '/files']
+POLL_INTERVAL = 0.2
+
+
+def parse_mix(spec):
+    """Parse "chat=4,history=3" into {'/chat': 4.0, '/history': 3.0}."""
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.strip().partition('=')
+        endpoint = '/' + name.strip().lstrip('/')
+        if endpoint not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}, expected one of {ENDPOINTS}")
+        mix[endpoint] = float(weight or 1)
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(latencies, errors, elapsed):
+    """Counts, throughput and latency percentiles (ms) for one endpoint."""
+    summary = {
+        'requests': len(latencies) + len(errors),
+        'errors': len(errors),
+        'error_kinds': sorted(set(errors)),
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+    }
+    if latencies:
+        milliseconds = np.asarray(latencies) * 1000
+        summary.update({
+            'mean_ms': float(milliseconds.mean()),
+            'p50_ms': float(np.percentile(milliseconds, 50)),
+            'p95_ms': float(np.percentile(milliseconds, 95)),
+            'p99_ms': float(np.percentile(milliseconds, 99)),
+            'max_ms': float(milliseconds.max()),
+        })
+    return summary
+
+
+class LoadClient:
+    """One benchmark user's signed-in session, copied per client thread."""
+
+    def __init__(self, base_url, cookies, user_number, timeout):
+        self.base_url = base_url
+        self.cookies = cookies
+        self.user_number = user_number
+        self.timeout = timeout
+        self._local = threading.local()
+        self._sequence = itertools.count()
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers['User-Agent'] = USER_AGENT
+            session.cookies.update(self.cookies)
+        return session
+
+    def upload(self, words=300):
+        number = next(self._sequence)
+        text = synthetic_text(words, seed=self.user_number * 100003 + number)
+        response = self.session.post(f"{self.base_url}/upload", timeout=self.timeout, files={
+            'file': (f"load-{self.user_number}-{number}.txt", text.encode('utf-8'), 'text/plain')})
+        return response.status_code == 202, response
+
+    def chat(self):
+        # Distinct questions so the response cache never answers
+        number = next(self._sequence)
+        response = self.session.post(f"{self.base_url}/chat", timeout=self.timeout, json={
+            'message': f"question {number} from user {self.user_number} about the uploaded documents"})
+        return response.status_code == 200 and 'response' in response.json(), response
+
+    def history(self):
+        response = self.session.get(f"{self.base_url}/history", timeout=self.timeout)
+        return response.status_code == 200, response
+
+    def files(self):
+        response = self.session.get(f"{self.base_url}/files", timeout=self.timeout)
+        return response.status_code == 200, response
+
+    def wait_until_indexed(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            files = self.session.get(f"{self.base_url}/files", timeout=self.timeout).json()['files']
+            unfinished = [file for file in files if file['status'] not in ('ready', 'failed')]
+            if not unfinished:
+                return
+            time.sleep(POLL_INTERVAL)
+        stuck = ', '.join(f"{file['original_filename']} {file['status']} at {file['progress']}%" for file in unfinished)
+        raise RuntimeError(f"Seed documents not indexed within {timeout}s: {stuck}")
+
+
+def run_load(clients, mix, concurrency, duration, total_requests, seed):
+    """Send requests drawn from mix; returns (elapsed, {endpoint: (latencies, errors)})."""
+    senders = {'/upload': LoadClient.upload, '/chat': LoadClient.chat,
+               '/history': LoadClient.history, '/files': LoadClient.files}
+    endpoints = list(mix)
+    weights = [mix[endpoint] for endpoint in endpoints]
+    results = {endpoint: ([], []) for endpoint in endpoints}
+    lock = threading.Lock()
+    sent = itertools.count()
+    deadline = time.monotonic() + duration if duration else None
+
+    def worker(number):
+        rng = random.Random(seed * 1000 + number)
+        client = clients[number % len(clients)]
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            if total_requests and next(sent) >= total_requests:
+                return
+            endpoint = rng.choices(endpoints, weights)[0]
+            start = time.perf_counter()
+            try:
+                ok, response = senders[endpoint](client)
+                error = None if ok else f"HTTP {response.status_code}"
+            except (requests.RequestException, ValueError) as e:
+                error = type(e).__name__
+            elapsed = time.perf_counter() - start
+            latencies, errors = results[endpoint]
+            with lock:
+                if error:
+                    errors.append(error)
+                else:
+                    latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return time.perf_counter() - start, results
+
+
+def print_report(report):
+    config = report['config']
+    print(f"{config['users']} users, concurrency {config['concurrency']}, {config['workers']} workers "
+          f"({config['worker_class'] or 'default'}), OpenAI {config['openai_latency'] * 1000:.0f} ms embeddings / "
+          f"{config['chat_latency'] * 1000:.0f} ms completions, OIDC {config['oidc_latency'] * 1000:.0f} ms, "
+          f"{report['elapsed_s']:.1f}s at {report['commit'] or 'unknown commit'}")
+    print(f"{'endpoint':>14} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, summary in report['endpoints'].items():
+        print(f"{endpoint:>14} {summary['requests']:>9} {summary['errors']:>7} {summary['throughput_rps']:>8.1f} "
+              f"{summary.get('p50_ms', float('nan')):>8.1f} {summary.get('p95_ms', float('nan')):>8.1f} "
+              f"{summary.get('p99_ms', float('nan')):>8.1f}")
+        if summary['error_kinds']:
+            print(f"{'':>14} errors: {', '.join(summary['error_kinds'])}")
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before_path} ({before['commit']}) -> {after_path} ({after['commit']})")
+    print(f"{'endpoint':>14} {'req/s':>22} {'p50 ms':>22} {'p95 ms':>22} {'p99 ms':>22}")
+
+    def change(old, new):
+        if old is None or new is None:
+            return f"{'n/a':>22}"
+        percent = (new - old) / old * 100 if old else float('nan')
+        return f"{old:>8.1f} -> {new:<8.1f}{percent:>+4.0f}%"
+
+    for endpoint in after['endpoints']:
+        if endpoint not in before['endpoints']:
+            continue
+        old, new = before['endpoints'][endpoint], after['endpoints'][endpoint]
+        print(f"{endpoint:>14} {change(old['throughput_rps'], new['throughput_rps'])} "
+              + ' '.join(change(old.get(key), new.get(key)) for key in ('p50_ms', 'p95_ms', 'p99_ms')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10, help='users signed in through the OIDC flow')
+    parser.add_argument('--concurrency', type=int, default=20, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load; 0 runs until --requests')
+    parser.add_argument('--requests', type=int, default=0, help='stop after this many requests; 0 for no limit')
+    parser.add_argument('--mix', type=parse_mix, default='chat=4,history=3,files=2,upload=1',
+                        help='endpoint weights, e.g. chat=4,history=3,files=2,upload=1')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--worker-class', help='gunicorn worker class, default from gunicorn.conf.py')
+    parser.add_argument('--openai-latency', type=float, default=0.05, help='seconds per embedding request')
+    parser.add_argument('--chat-latency', type=float, default=1.0, help='seconds per chat completion')
+    parser.add_argument('--oidc-latency', type=float, default=0.05, help='seconds per OIDC provider request')
+    parser.add_argument('--dimensions', type=int, default=256, help='fake embedding dimensions')
+    parser.add_argument('--timeout', type=float, default=120, help='per-request timeout')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if not args.duration and not args.requests:
+        parser.error('set --duration or --requests')
+
+    openai_server = FakeOpenAIServer(latency=args.openai_latency, chat_latency=args.chat_latency,
+                                     dimensions=args.dimensions).start()
+    provider = FakeOIDCProvider(latency=args.oidc_latency).start()
+    env = {'GUNICORN_TIMEOUT': str(int(args.timeout))}
+    if args.worker_class:
+        env['GUNICORN_WORKER_CLASS'] = args.worker_class
+    app_server = AppServer(openai_server.base_url, env=env, workers=args.workers,
+                           oidc_discovery_url=provider.discovery_url)
+    try:
+        app_server.start()
+        logins = []
+        clients = []
+        for user_number in range(args.users):
+            start = time.perf_counter()
+            session = app_server.login(f"load{user_number}")
+            logins.append(time.perf_counter() - start)
+            clients.append(LoadClient(app_server.base_url, session.cookies, user_number, args.timeout))
+        for client in clients:
+            ok, response = client.upload(words=2000)
+            if not ok:
+                raise RuntimeError(f"Seed upload failed with HTTP {response.status_code}, see {app_server.log_path}")
+        for client in clients:
+            client.wait_until_indexed(args.timeout)
+
+        elapsed, results = run_load(clients, args.mix, args.concurrency, args.duration, args.requests, args.seed)
+        endpoints = {'/google_login': summarize(logins, [], sum(logins))}
+        for endpoint, (latencies, errors) in results.items():
+            endpoints[endpoint] = summarize(latencies, errors, elapsed)
+        all_latencies = [latency for latencies, _ in results.values() for latency in latencies]
+        all_errors = [error for _, errors in results.values() for error in errors]
+        report = {
+            'benchmark': 'bench_load',
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'elapsed_s': elapsed,
+            'endpoints': endpoints,
+            'total': summarize(all_latencies, all_errors, elapsed),
+            'openai': dict(openai_server.counters),
+            'oidc': dict(provider.counters),
+        }
+    finally:
+        app_server.stop()
+        provider.stop()
+        openai_server.stop()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Per-request logging overhead on /history and /chat.
+
+    python -m benchmarks.bench_logging --requests 300
+
+Each configuration runs in its own process against SQLite and the local
+fake OpenAI server (no added latency), through Flask's test client so only
+the app's own work is timed. Log output goes to a file, as it would to a
+container's log pipe; --write-latency-ms adds a delay to every write to
+stand in for a slow or back-pressured pipe.
+
+  legacy      root logger at DEBUG with a synchronous StreamHandler, as
+              every module's logging.basicConfig(level=logging.DEBUG) set up
+  queued      the same DEBUG output written by utils.logging_config's
+              background listener
+  structured  utils.logging_config defaults: INFO, JSON, background listener
+  silent      logging disabled, the floor the others are measured against
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.fake_openai import FakeOpenAIServer
+
+MODES = ['legacy', 'queued', 'structured', 'silent']
+HISTORY_MESSAGES = 200
+
+
+class SlowStream:
+    """File wrapper whose writes take at least latency seconds."""
+
+    def __init__(self, stream, latency):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def run_worker(mode, num_requests, log_path, write_latency):
+    from benchmarks.app_server import USER_AGENT, session_cookie
+    from app import app
+    from extensions import db
+    from models import ChatMessage, User
+    from utils.logging_config import configure_logging, stop_logging
+
+    stop_logging()
+    log_file = open(log_path, 'w')
+    stream = SlowStream(log_file, write_latency)
+    if mode == 'legacy':
+        logging.basicConfig(level=logging.DEBUG, stream=stream, force=True)
+    elif mode == 'silent':
+        logging.disable(logging.CRITICAL)
+    else:
+        logging.getLogger().handlers.clear()
+        configure_logging(level='DEBUG' if mode == 'queued' else 'INFO', stream=stream)
+
+    with app.app_context():
+        db.session.add(User(id=1, username='bench', email='bench@example.com'))
+        db.session.add_all(ChatMessage(role='user' if i % 2 == 0 else 'assistant', content=f"message {i}", user_id=1)
+                           for i in range(HISTORY_MESSAGES))
+        db.session.commit()
+
+    client = app.test_client()
+    client.environ_base['HTTP_USER_AGENT'] = USER_AGENT
+    client.set_cookie('session', session_cookie(1))
+
+    def history(i):
+        return client.get('/history')
+
+    def chat(i):
+        # Distinct questions so the response cache never answers
+        return client.post('/chat', json={'message': f"logging benchmark question {i}"})
+
+    results = {}
+    for name, send in [('/history', history), ('/chat', chat)]:
+        for i in range(10):
+            send(-i - 1)
+        latencies = []
+        for i in range(num_requests):
+            start = time.perf_counter()
+            response = send(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.get_data(as_text=True)
+        results[name] = latencies
+
+    stop_logging()
+    log_file.close()
+    results['log_bytes'] = os.path.getsize(log_path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=300, help='requests per endpoint')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--write-latency-ms', type=float, default=0.0, help='added delay per log write')
+    parser.add_argument('--worker', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--log-path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.requests, args.log_path, args.write_latency_ms / 1000)))
+        return
+
+    server = FakeOpenAIServer(latency=0, chat_latency=0).start()
+    try:
+        print(f"{args.requests} requests per endpoint, {HISTORY_MESSAGES} messages of history, "
+              f"{args.write_latency_ms} ms per log write")
+        print(f"{'mode':>11} {'endpoint':>9} {'mean ms':>8} {'p50 ms':>7} {'p95 ms':>7} {'log KB':>8}")
+        for mode in args.modes:
+            with tempfile.TemporaryDirectory() as directory:
+                env = {
+                    **os.environ,
+                    'OPENAI_API_KEY': 'fake',
+                    'OPENAI_BASE_URL': server.base_url,
+                    'FLASK_SECRET_KEY': 'benchmark-secret',
+                    'GOOGLE_OAUTH_CLIENT_ID': 'fake',
+                    'GOOGLE_OAUTH_CLIENT_SECRET': 'fake',
+                    'DATABASE_URL': f"sqlite:///{os.path.join(directory, 'app.db')}",
+                    'INDEX_STORE_DIR': os.path.join(directory, 'indexes'),
+                    'EMBEDDING_CACHE_PATH': os.path.join(directory, 'embedding_cache.sqlite3'),
+                    'WARM_SERVICES': '0',
+                }
+                output = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.bench_logging', '--worker', mode,
+                     '--requests', str(args.requests), '--write-latency-ms', str(args.write_latency_ms),
+                     '--log-path', os.path.join(directory, 'app.log')],
+                    env=env, check=True, capture_output=True, text=True,
+                ).stdout
+                results = json.loads(output.strip().splitlines()[-1])
+            for endpoint in ('/history', '/chat'):
+                latencies = results[endpoint]
+                print(f"{mode:>11} {endpoint:>9} {np.mean(latencies):>8.2f} {np.percentile(latencies, 50):>7.2f} "
+                      f"{np.percentile(latencies, 95):>7.2f} {results['log_bytes'] / 1024:>8.0f}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Sign-in latency against the stub OpenID provider.
+
+    python -m benchmarks.bench_login --logins 50 --latency 0.05
+
+Runs full /google_login -> /authorize -> /google_login/callback flows
+through a gunicorn-served app and reports client-side latency, the app's
+mean callback time from the app's /metrics, and how many discovery fetches and TCP
+connections reached the provider. --max-age 0 makes the provider forbid
+caching, which reproduces a discovery fetch on every login.
+"""
+import argparse
+import re
+import statistics
+import time
+
+from benchmarks.app_server import AppServer
+from benchmarks.fake_oidc import FakeOIDCProvider
+from benchmarks.fake_openai import FakeOpenAIServer
+
+
+def stage_mean_seconds(metrics, stage):
+    values = {}
+    for kind in ('sum', 'count'):
+        match = re.search(rf'^kb_stage_duration_seconds_{kind}\{{stage="{stage}"\}} (\S+)$', metrics, re.MULTILINE)
+        values[kind] = float(match.group(1)) if match else 0.0
+    return values['sum'] / values['count'] if values['count'] else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub provider seconds per request')
+    parser.add_argument('--max-age', type=int, nargs='+', default=[0, 3600],
+                        help='discovery Cache-Control max-age values to compare')
+    args = parser.parse_args()
+
+    openai_server = FakeOpenAIServer().start()
+    print(f"{args.logins} logins, provider latency {args.latency * 1000:.0f} ms")
+    print(f"{'max-age':>8} {'p50 ms':>7} {'p95 ms':>7} {'callback avg':>13} {'discovery':>10} {'connections':>12}")
+    try:
+        for max_age in args.max_age:
+            provider = FakeOIDCProvider(latency=args.latency, max_age=max_age).start()
+            app_server = AppServer(openai_server.base_url, oidc_discovery_url=provider.discovery_url).start()
+            try:
+                durations = []
+                for i in range(args.logins):
+                    start = time.perf_counter()
+                    session = app_server.login(f"bench{i}")
+                    durations.append(time.perf_counter() - start)
+                metrics = app_server.metrics()
+            finally:
+                app_server.stop()
+                provider.stop()
+            durations.sort()
+            callback_ms = stage_mean_seconds(metrics, 'login_callback') * 1000
+            print(f"{max_age:>8} {statistics.median(durations) * 1000:>7.1f} "
+                  f"{durations[int(0.95 * (len(durations) - 1))] * 1000:>7.1f} {callback_ms:>13.1f} "
+                  f"{provider.counters['discovery']:>10} {provider.counters['connections']:>12}")
+    finally:
+        openai_server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Compare PDF text extraction strategies on synthetic multi-hundred-page PDFs.
+
+    python -m benchmarks.bench_pdf_extraction --pages 100 300 600
+
+legacy      the original `text += page.extract_text()` loop
+streaming   utils.pdf_extractor.iter_pdf_pages in-process
+parallel    utils.pdf_extractor.iter_pdf_pages across the process pool
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from PyPDF2 import PdfReader
+
+from benchmarks.synthetic import write_synthetic_pdf
+from utils import pdf_extractor
+
+
+def legacy_extract(path):
+    reader = PdfReader(path)
+    text = ""
+    for page in reader.pages:
+        text += page.extract_text() + "\n"
+    return text.strip()
+
+
+def streaming_extract(path, parallel):
+    characters = 0
+    for _, page_text in pdf_extractor.iter_pdf_pages(path, parallel=parallel):
+        characters += len(page_text)
+    return characters
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, nargs='+', default=[100, 300, 600])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # Start the pool up front so worker spawn time is not charged to the first run
+    list(pdf_extractor.iter_pdf_pages(_warmup_pdf(), parallel=True))
+
+    print(f"{'pages':>6} {'legacy s':>10} {'streaming s':>12} {'parallel s':>11} {'speedup':>8}"
+          f"   ({pdf_extractor.MAX_PROCESSES} processes)")
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_pages in args.pages:
+            path = os.path.join(tmp, f"synthetic_{num_pages}.pdf")
+            write_synthetic_pdf(path, num_pages)
+
+            legacy = timed(lambda: legacy_extract(path), args.repeat)
+            streaming = timed(lambda: streaming_extract(path, parallel=False), args.repeat)
+            parallel = timed(lambda: streaming_extract(path, parallel=True), args.repeat)
+            print(f"{num_pages:>6} {legacy:>10.3f} {streaming:>12.3f} {parallel:>11.3f} {legacy / parallel:>7.2f}x")
+
+
+def _warmup_pdf():
+    path = os.path.join(tempfile.gettempdir(), 'bench_pdf_warmup.pdf')
+    write_synthetic_pdf(path, pdf_extractor.PAGES_PER_TASK * 2)
+    return path
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Prompt tokens per chat request: the fixed top-3 chunks + last 5 messages
+assembly against the token-budgeted PromptBuilder with a rolling summary.
+
+    python -m benchmarks.bench_prompt_tokens --turns 40 --budget 3000
+
+Replays a synthetic conversation over the product catalogue (short chunks)
+plus a few long manuals (full-size chunks), with local hashing embeddings.
+The summarizer is simulated by a SUMMARY_MAX_TOKENS-sized text, since the
+benchmark only measures what is sent, not what the model writes.
+"""
+import argparse
+import statistics
+import tempfile
+
+from benchmarks.eval_retrieval import build_processor
+from benchmarks.synthetic import HashingEmbeddings, catalogue_corpus, synthetic_text
+from utils.prompt_builder import (PROMPT_HISTORY_TOKENS, PROMPT_MAX_CHUNKS, REPLY_PRIMING_TOKENS, SUMMARY_MAX_TOKENS,
+                                  SYSTEM_PROMPT, PromptBuilder, fit_history, message_tokens)
+
+
+def legacy_messages(processor, message, history, user_id):
+    """The assembly used before prompt budgeting: top 3 chunks and the last 5 messages."""
+    context = "\n".join(doc.page_content for doc in processor.retrieve(message, user_id, k=3))
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if context:
+        messages.append({"role": "system",
+                         "content": f"Here is relevant context from the uploaded documents:\n{context}"})
+    # History was read after saving the new message, so it appeared twice
+    messages.extend({"role": entry["role"], "content": entry["content"]}
+                    for entry in (history + [{"role": "user", "content": message}])[-5:])
+    messages.append({"role": "user", "content": message})
+    return messages
+
+
+def prompt_tokens(messages):
+    return REPLY_PRIMING_TOKENS + sum(message_tokens(message) for message in messages)
+
+
+def describe(label, values, budget):
+    over = sum(value > budget for value in values)
+    print(f"{label:>9} {statistics.mean(values):>7.0f} {statistics.median(values):>7.0f} "
+          f"{sorted(values)[int(0.95 * (len(values) - 1))]:>7} {min(values):>6} {max(values):>6} {over:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--manuals', type=int, default=5)
+    parser.add_argument('--turns', type=int, default=40)
+    parser.add_argument('--reply-words', type=int, default=150)
+    parser.add_argument('--budget', type=int, default=None)
+    args = parser.parse_args()
+
+    documents, queries = catalogue_corpus(args.products)
+    documents += [synthetic_text(3000, seed=1000 + i) for i in range(args.manuals)]
+    builder = PromptBuilder(budget=args.budget)
+    summary_text = synthetic_text(int(SUMMARY_MAX_TOKENS * 0.7), seed=-1)
+
+    before, after, chunks_before, chunks_after = [], [], [], []
+    with tempfile.TemporaryDirectory() as index_dir:
+        processor = build_processor(documents, HashingEmbeddings(), index_dir)
+        history = []  # every message so far
+        summarized = 0  # messages folded into the simulated summary
+        for turn in range(args.turns):
+            message = queries[turn % len(queries)][0]
+
+            old = legacy_messages(processor, message, history, user_id=1)
+            before.append(prompt_tokens(old))
+            chunks_before.append(3)
+
+            documents_found = processor.retrieve(message, 1, k=PROMPT_MAX_CHUNKS)
+            new, stats = builder.build(message, [doc.page_content for doc in documents_found],
+                                       history[summarized:], summary_text if summarized else None)
+            after.append(stats['prompt_tokens'])
+            chunks_after.append(stats['context_chunks'])
+
+            history += [{"role": "user", "content": message},
+                        {"role": "assistant", "content": synthetic_text(args.reply_words, seed=turn)}]
+            # Same trigger as ConversationSummarizer
+            overflow, _ = fit_history(history[summarized:], PROMPT_HISTORY_TOKENS)
+            if overflow:
+                older, _ = fit_history(history[summarized:], PROMPT_HISTORY_TOKENS // 2)
+                summarized += len(older)
+
+    print(f"{args.turns} turns, budget {builder.budget} tokens, history {PROMPT_HISTORY_TOKENS} tokens")
+    print(f"{'assembly':>9} {'mean':>7} {'p50':>7} {'p95':>7} {'min':>6} {'max':>6} {'over budget':>12}")
+    describe('before', before, builder.budget)
+    describe('after', after, builder.budget)
+    print(f"context chunks per request: before {statistics.mean(chunks_before):.1f}, "
+          f"after {statistics.mean(chunks_after):.1f}")
+
+
+if __name__ == '__main__':
+    main()
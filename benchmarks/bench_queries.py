@@ -0,0 +1,119 @@
+"""
+Database round-trips per request, with and without the user cache.
+
+    python -m benchmarks.bench_queries --requests 200
+
+Runs the app in-process against SQLite and the local fake OpenAI server
+(no added latency) through Flask's test client, with the engine and pool
+options the app configures. SQL statements are counted with SQLAlchemy's
+cursor events and connection checkouts with pool events; with
+pool_pre_ping every checkout also costs a ping, so
+
+  round trips = statements + checkouts
+
+is what each request would cost against a networked database such as
+Postgres.
+
+  uncached    USER_CACHE_TTL=0: Flask-Login's loader queries the user table
+              on every request
+  cached      the default: one load per TTL, then served from memory
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import event
+
+from benchmarks.fake_openai import FakeOpenAIServer
+
+HISTORY_MESSAGES = 200
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and mode')
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=0, chat_latency=0, dimensions=256).start()
+    directory = tempfile.mkdtemp(prefix='kb-bench-')
+    os.environ.update({
+        'OPENAI_API_KEY': 'fake',
+        'OPENAI_BASE_URL': server.base_url,
+        'FLASK_SECRET_KEY': 'benchmark-secret',
+        'GOOGLE_OAUTH_CLIENT_ID': 'fake',
+        'GOOGLE_OAUTH_CLIENT_SECRET': 'fake',
+        'DATABASE_URL': f"sqlite:///{os.path.join(directory, 'app.db')}",
+        'INDEX_STORE_DIR': os.path.join(directory, 'indexes'),
+        'EMBEDDING_CACHE_PATH': os.path.join(directory, 'embedding_cache.sqlite3'),
+        'WARM_SERVICES': '0',
+        'LOG_LEVEL': 'WARNING',
+    })
+    from app import app
+    from benchmarks.app_server import USER_AGENT, session_cookie
+    from extensions import db
+    from models import ChatMessage, User
+    from user_cache import user_cache
+
+    try:
+        with app.app_context():
+            db.session.add(User(id=1, username='bench', email='bench@example.com'))
+            db.session.add_all(ChatMessage(role='user' if i % 2 == 0 else 'assistant', content=f"message {i}",
+                                           user_id=1)
+                               for i in range(HISTORY_MESSAGES))
+            db.session.commit()
+            engine = db.engine
+
+        client = app.test_client()
+        client.environ_base['HTTP_USER_AGENT'] = USER_AGENT
+        client.set_cookie('session', session_cookie(1))
+        response = client.post('/upload', content_type='multipart/form-data',
+                               data={'file': (io.BytesIO(b"Grout comes in grey and white. " * 200), 'grout.txt')})
+        job_url = f"/jobs/{response.json['job_id']}"
+        while client.get(job_url).json['job']['status'] not in ('ready', 'failed'):
+            time.sleep(0.1)
+
+        counts = {'statements': 0, 'checkouts': 0}
+
+        def count(name):
+            def listener(*args, **kwargs):
+                counts[name] += 1
+            return listener
+
+        event.listen(engine, 'before_cursor_execute', count('statements'))
+        event.listen(engine.pool, 'checkout', count('checkouts'))
+
+        endpoints = [
+            ('/history', lambda i: client.get('/history')),
+            ('/files', lambda i: client.get('/files')),
+            ('/jobs', lambda i: client.get(job_url)),
+            # Distinct questions so the response cache never answers
+            ('/chat', lambda i: client.post('/chat', json={'message': f"query benchmark question {i}"})),
+        ]
+        print(f"{args.requests} requests per endpoint, SQLite, pool_pre_ping="
+              f"{app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('pool_pre_ping', False)}")
+        print(f"{'mode':>9} {'endpoint':>9} {'statements':>11} {'checkouts':>10} {'round trips':>12} {'p50 ms':>7}")
+        for mode, ttl in [('uncached', 0), ('cached', 60)]:
+            user_cache.ttl = ttl
+            user_cache.invalidate(1)
+            for endpoint, send in endpoints:
+                send(-1)
+                counts.update(statements=0, checkouts=0)
+                latencies = []
+                for i in range(args.requests):
+                    start = time.perf_counter()
+                    response = send(i)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    assert response.status_code == 200, response.get_data(as_text=True)
+                statements = counts['statements'] / args.requests
+                checkouts = counts['checkouts'] / args.requests
+                print(f"{mode:>9} {endpoint:>9} {statements:>11.2f} {checkouts:>10.2f} "
+                      f"{statements + checkouts:>12.2f} {np.percentile(latencies, 50):>7.2f}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Retrieval latency for repeated questions and follow-ups, with the query
+embedding and retrieval caches against without them.
+
+    python -m benchmarks.bench_query_cache --products 300 --latency 0.05
+
+The catalogue from benchmarks.synthetic is indexed for one user through the
+local fake OpenAI server, whose embedding requests take --latency seconds.
+Each phase times what /chat does before the prompt is built: pick the
+retrieval query, embed it and retrieve PROMPT_MAX_CHUNKS chunks.
+
+  first ask     every question for the first time
+  repeat        the same questions again
+  reworded      the same questions in other case and punctuation
+  follow-up     "tell me more?" after each question
+  new upload    the questions again after another file bumped the index
+                version: vectors are cached, the search runs again
+  no caches     the questions again with both caches disabled
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from openai import OpenAI
+
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.synthetic import catalogue_corpus
+
+USER_ID = 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=300)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per embedding request')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=args.latency, dimensions=256).start()
+    os.environ.setdefault('OPENAI_API_KEY', 'fake')
+    from utils.embedding_cache import CachedEmbeddings, EmbeddingCache
+    from utils.embedding_scheduler import EmbeddingScheduler
+    from utils.openai_helper import retrieval_query
+    from utils.prompt_builder import PROMPT_MAX_CHUNKS
+    from utils.text_processor import TextProcessor
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            client = OpenAI(api_key='fake', base_url=server.base_url, max_retries=0)
+            embeddings = CachedEmbeddings(EmbeddingScheduler(client=client),
+                                          cache=EmbeddingCache(os.path.join(directory, 'embeddings.sqlite3')))
+            processor = TextProcessor(embeddings=embeddings, index_dir=os.path.join(directory, 'indexes'))
+            documents, catalogue_queries = catalogue_corpus(args.products, seed=args.seed)
+            processor.process_document('\n\n'.join(documents), USER_ID, 1)
+            questions = [query for query, _, _ in catalogue_queries[:args.queries]]
+
+            def ask(message, history=()):
+                start = time.perf_counter()
+                query = retrieval_query(message, list(history))
+                vector = processor.embed_query(query)
+                processor.retrieve(query, USER_ID, k=PROMPT_MAX_CHUNKS, query_vector=vector)
+                return (time.perf_counter() - start) * 1000
+
+            def follow_up(question):
+                history = [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': 'An answer.'}]
+                return ask('tell me more?', history)
+
+            def new_upload():
+                processor.process_document(documents[0], USER_ID, 2)
+
+            def disable_caches():
+                for cache in (embeddings.query_cache, processor.retrieval_cache):
+                    cache.max_entries = 0
+                    cache.clear()
+
+            phases = [
+                ('first ask', None, ask),
+                ('repeat', None, ask),
+                ('reworded', None, lambda question: ask(question.upper().rstrip('?') + ' ?')),
+                ('follow-up', None, follow_up),
+                ('new upload', new_upload, ask),
+                ('no caches', disable_caches, ask),
+            ]
+            print(f"{len(questions)} questions, {processor.index_store.snapshot(USER_ID).ntotal} chunks, "
+                  f"{args.latency * 1000:.0f} ms per embedding request, k={PROMPT_MAX_CHUNKS}")
+            print(f"{'phase':>11} {'p50 ms':>8} {'p95 ms':>8} {'embed calls':>12}")
+            for name, setup, run in phases:
+                if setup:
+                    setup()
+                calls = server.counters['requests']
+                latencies = [run(question) for question in questions]
+                print(f"{name:>11} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f} "
+                      f"{server.counters['requests'] - calls:>12}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
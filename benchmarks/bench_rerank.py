@@ -0,0 +1,105 @@
+"""
+Two-stage retrieval: hit rate, redundancy and latency with and without the
+re-ranking stage.
+
+    python -m benchmarks.bench_rerank --products 300 --duplicates 0.3 --k 3 5
+
+Each product from benchmarks.synthetic becomes a multi-chunk brochure (the
+splitter's overlap makes neighbouring chunks share text) and a share of the
+brochures is uploaded twice, as users do. "redundant" counts
+result pairs per query sharing a passage of 100+ characters; "hit" is the
+share of queries whose product appears in the results. Latency is the
+whole retrieval call with the query embedding excluded.
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from itertools import combinations
+
+import numpy as np
+from prometheus_client import REGISTRY
+
+from benchmarks.synthetic import HashingEmbeddings, catalogue_corpus
+from utils.text_processor import TextProcessor
+
+OVERLAP_CHARS = 100
+
+
+def brochure_text(description, num_words, seed):
+    """Product description followed by filler prose with a wide vocabulary."""
+    rng = random.Random(seed)
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'do', 'gu']
+    words = [''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(num_words)]
+    sentences = [' '.join(words[i:i + 12]).capitalize() + '.' for i in range(0, len(words), 12)]
+    return f"{description} {' '.join(sentences)}"
+
+
+def redundant_pairs(texts):
+    windows = [{text[i:i + OVERLAP_CHARS] for i in range(len(text) - OVERLAP_CHARS + 1)} for text in texts]
+    return sum(not first.isdisjoint(second) for first, second in combinations(windows, 2))
+
+
+def evaluate(processor, queries, product_files, k, rerank, user_id=1):
+    latencies, hits, redundant = [], [], []
+    for query, product, query_vector in queries:
+        start = time.perf_counter()
+        documents = processor.retrieve(query, user_id, k=k, query_vector=query_vector, rerank=rerank)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits.append(any(doc.metadata['file_id'] in product_files[product] for doc in documents))
+        redundant.append(redundant_pairs([doc.page_content for doc in documents]))
+    return latencies, hits, redundant
+
+
+def stage_mean_seconds(stage):
+    total = REGISTRY.get_sample_value('kb_stage_duration_seconds_sum', {'stage': stage})
+    count = REGISTRY.get_sample_value('kb_stage_duration_seconds_count', {'stage': stage})
+    return total / count if count else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=300)
+    parser.add_argument('--words', type=int, default=450, help='filler words per brochure')
+    parser.add_argument('--duplicates', type=float, default=0.3, help='share of brochures uploaded twice')
+    parser.add_argument('--k', type=int, nargs='+', default=[3, 5, 12])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    descriptions, catalogue_queries = catalogue_corpus(args.products, seed=args.seed)
+    embeddings = HashingEmbeddings()
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        processor = TextProcessor(embeddings=embeddings, index_dir=index_dir)
+        product_files = {}
+        file_id = 0
+        for product, description in enumerate(descriptions):
+            text = brochure_text(description, args.words, seed=product)
+            copies = 2 if rng.random() < args.duplicates else 1
+            for _ in range(copies):
+                processor.process_document(text, 1, file_id)
+                product_files.setdefault(product, set()).add(file_id)
+                file_id += 1
+        num_chunks = processor.index_store.snapshot(1).ntotal
+        queries = [(query, product, embeddings.embed_query(query)) for query, product, _ in catalogue_queries]
+
+        print(f"{file_id} files ({len(descriptions)} products), {num_chunks} chunks, {len(queries)} queries")
+        print(f"{'k':>3} {'rerank':>7} {'hit':>6} {'redundant':>10} {'p50 ms':>7} {'p95 ms':>7}")
+        for k in args.k:
+            for rerank in (False, True):
+                latencies, hits, redundant = evaluate(processor, queries, product_files, k, rerank)
+                print(f"{k:>3} {'on' if rerank else 'off':>7} {sum(hits) / len(hits):>6.3f} "
+                      f"{statistics.mean(redundant):>10.2f} {np.percentile(latencies, 50):>7.2f} "
+                      f"{np.percentile(latencies, 95):>7.2f}")
+
+        stats = processor.reranker.stats()
+        rerank_ms = stage_mean_seconds('rerank') * 1000
+        print(f"\nre-rank stage alone: mean {rerank_ms:.2f} ms, "
+              f"{stats['over_budget']} of {stats['calls']} calls over the {processor.reranker.budget_ms:.0f} ms budget, "
+              f"{stats['duplicates_dropped']} near-duplicates dropped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Chunking cost and quality: the character splitter ingestion used before
+against utils.text_splitter.StructuredSplitter.
+
+    python -m benchmarks.bench_splitter --pages 2000
+    python -m benchmarks.bench_splitter --pdf catalogue.pdf
+
+Pages come from benchmarks.synthetic.structured_pages (headings, wrapped
+prose and price tables, as PDF extraction returns them) or from PDFs given
+with --pdf. Both splitters work page by page, as process_pages feeds them.
+
+  tokens    total tokens across chunks, i.e. what gets embedded, and the
+            share of it that repeats text already in another chunk
+  tables    tables small enough for one chunk that were cut across chunks
+  orphans   chunks ending in a heading whose section starts in the next chunk
+  MB/s      page text split per second, including the per-chunk token
+            counts ingestion stores (the character splitter needs a separate
+            count per chunk); peak MB is the largest tracemalloc peak while
+            splitting a page, measured in a separate pass
+
+Without the tiktoken BPE files (e.g. offline) token counts are estimated
+from characters, for the splitter and the report alike.
+"""
+import argparse
+import time
+import tracemalloc
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.synthetic import structured_pages
+from utils.text_splitter import HEADING, TABLE, StructuredSplitter, classify_line
+from utils.tokens import count_tokens, count_tokens_batch, get_encoding
+
+
+def chunk_offsets(text, chunks):
+    """(start, end) of each chunk in text; chunks are in order and may overlap."""
+    offsets = []
+    position = 0
+    for chunk in chunks:
+        start = text.find(chunk, position)
+        offsets.append((start, start + len(chunk)))
+        position = start + 1
+    return offsets
+
+
+def structure_errors(text, offsets, splitter):
+    """Count tables cut although they fit one chunk, and chunks ending in a heading."""
+    blocks = splitter._blocks(text)
+    tables = [(start, end) for start, end, kind in blocks if kind == TABLE]
+    table_tokens = count_tokens_batch([text[start:end] for start, end in tables]) if tables else []
+    cut_tables = 0
+    for (start, end), tokens in zip(tables, table_tokens):
+        touching = sum(1 for a, b in offsets if a < end and b > start)
+        covered = any(a <= start and b >= end for a, b in offsets)
+        cut_tables += tokens <= splitter.chunk_tokens and touching > 1 and not covered
+    orphans = 0
+    for start, end in offsets:
+        lines = [line.strip() for line in text[start:end].splitlines() if line.strip()]
+        orphans += len(lines) > 1 and classify_line(lines[-1]) == HEADING
+    return cut_tables, orphans
+
+
+def character_split(splitter):
+    def split(text):
+        chunks = splitter.split_text(text)
+        return chunks, [count_tokens(chunk) for chunk in chunks]
+    return split
+
+
+def structured_split(splitter):
+    def split(text):
+        offsets = splitter.split_offsets(text)
+        return [text[start:end] for start, end, _ in offsets], [tokens for _, _, tokens in offsets]
+    return split
+
+
+def run(name, split, pages, splitter):
+    start = time.perf_counter()
+    results = [split(text)[0] for text in pages]
+    elapsed = time.perf_counter() - start
+
+    peak = 0
+    tracemalloc.start()
+    for text in pages[:200]:
+        tracemalloc.reset_peak()
+        split(text)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    chunks = [chunk for page_chunks in results for chunk in page_chunks]
+    chunk_tokens = sum(count_tokens_batch(chunks))
+    source_tokens = sum(count_tokens_batch(pages))
+    cut_tables = orphans = 0
+    for text, page_chunks in zip(pages, results):
+        cut, orphaned = structure_errors(text, chunk_offsets(text, page_chunks), splitter)
+        cut_tables += cut
+        orphans += orphaned
+    megabytes = sum(len(text.encode('utf-8')) for text in pages) / 1e6
+    print(f"{name:>11} {len(chunks):>7} {chunk_tokens:>9} {(chunk_tokens - source_tokens) / chunk_tokens:>7.1%} "
+          f"{chunk_tokens / len(chunks):>6.0f} {cut_tables:>6} {orphans:>7} "
+          f"{megabytes / elapsed:>6.2f} {peak / 1e6:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--pdf', nargs='*', default=[], help='split these PDFs instead of synthetic pages')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.pdf:
+        from utils.pdf_extractor import iter_pdf_pages
+        pages = [text for path in args.pdf for _, text in iter_pdf_pages(path)]
+    else:
+        pages = structured_pages(args.pages, seed=args.seed)
+
+    structured = StructuredSplitter()
+    legacy = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+    tokenizer = 'tiktoken' if get_encoding('gpt-4') is not None else 'estimated'
+    print(f"{len(pages)} pages, {sum(len(text) for text in pages) / 1e6:.1f} M characters, "
+          f"{tokenizer} token counts, {structured.chunk_tokens}-token chunks")
+    print(f"{'splitter':>11} {'chunks':>7} {'tokens':>9} {'repeat':>7} {'avg':>6} {'tables':>6} {'orphans':>7} "
+          f"{'MB/s':>6} {'peak MB':>7}")
+    run('character', character_split(legacy), pages, structured)
+    run('structured', structured_split(structured), pages, structured)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Offline retrieval evaluation: recall@k for dense, lexical and hybrid retrieval.
+
+    python -m benchmarks.eval_retrieval --products 300
+
+Indexes the synthetic product catalogue from benchmarks.synthetic (one file
+per product) with local hashing embeddings, then asks two kinds of question
+per product: one naming its product code and one describing it. Pass
+--openai to embed with the configured OpenAI model instead.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+from benchmarks.synthetic import HashingEmbeddings, catalogue_corpus
+from utils.text_processor import TextProcessor
+
+MODES = ('dense', 'lexical', 'hybrid')
+
+
+def build_processor(documents, embeddings, index_dir, user_id=1):
+    processor = TextProcessor(embeddings=embeddings, index_dir=index_dir)
+    for file_id, text in enumerate(documents):
+        processor.process_document(text, user_id, file_id)
+    return processor
+
+
+def evaluate(processor, queries, ks, user_id=1):
+    """Return {(mode, kind): {k: recall}} and per-mode mean latency in ms."""
+    max_k = max(ks)
+    recall = {}
+    latency = {mode: [] for mode in MODES}
+    query_vectors = {query: processor.embed_query(query) for query, _, _ in queries}
+
+    for mode in MODES:
+        for kind in sorted({kind for _, _, kind in queries}) + ['all']:
+            recall[(mode, kind)] = {k: [] for k in ks}
+        for query, relevant_file, kind in queries:
+            start = time.perf_counter()
+            documents = processor.retrieve(query, user_id, k=max_k,
+                                           query_vector=query_vectors[query], mode=mode)
+            latency[mode].append((time.perf_counter() - start) * 1000)
+            ranked_files = [doc.metadata['file_id'] for doc in documents]
+            for k in ks:
+                hit = relevant_file in ranked_files[:k]
+                recall[(mode, kind)][k].append(hit)
+                recall[(mode, 'all')][k].append(hit)
+
+    recall = {key: {k: sum(hits) / len(hits) for k, hits in by_k.items()} for key, by_k in recall.items()}
+    latency = {mode: statistics.mean(values) for mode, values in latency.items()}
+    return recall, latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=300)
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 3, 5, 10])
+    parser.add_argument('--openai', action='store_true', help='use the real embedding model')
+    args = parser.parse_args()
+
+    documents, queries = catalogue_corpus(args.products)
+    embeddings = None if args.openai else HashingEmbeddings()
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        processor = build_processor(documents, embeddings, index_dir)
+        recall, latency = evaluate(processor, queries, args.k)
+
+    header = f"{'mode':<8} {'queries':<12}" + ''.join(f"{'R@' + str(k):>8}" for k in args.k)
+    print(header)
+    for (mode, kind), by_k in sorted(recall.items()):
+        print(f"{mode:<8} {kind:<12}" + ''.join(f"{by_k[k]:>8.3f}" for k in args.k))
+    print()
+    for mode in MODES:
+        print(f"{mode:<8} mean retrieval latency {latency[mode]:.2f} ms (query embedding excluded)")
+
+
+if __name__ == '__main__':
+    main()
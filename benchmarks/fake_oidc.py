@@ -0,0 +1,159 @@
+"""
+Local stub OpenID Connect provider standing in for Google sign-in.
+
+    python -m benchmarks.fake_oidc --port 8200 --latency 0.05 --max-age 3600
+
+Point the app at it with GOOGLE_DISCOVERY_URL=http://127.0.0.1:8200/.well-known/openid-configuration
+and OAUTHLIB_INSECURE_TRANSPORT=1 (the stub speaks plain HTTP). /authorize
+approves immediately and redirects back with a code; every code maps to a
+verified user whose email is derived from the login_hint parameter.
+"""
+import argparse
+import itertools
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeOIDCProvider:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, max_age=3600):
+        # Per-request delay, roughly a round trip to the real provider
+        self.latency = latency
+        self.max_age = max_age
+        self.counters = {'connections': 0, 'discovery': 0, 'authorize': 0, 'token': 0, 'userinfo': 0}
+        self._codes = {}  # authorization code -> login hint
+        self._tokens = {}  # access token -> login hint
+        self._user_numbers = itertools.count(1)
+        self._lock = threading.Lock()
+        self.httpd = _HTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def discovery_url(self):
+        return f"{self.base_url}/.well-known/openid-configuration"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _handler_class(self):
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                # One handler per TCP connection, however many keep-alive requests it carries
+                provider.count('connections')
+
+            def _send(self, status, payload=None, headers=None):
+                body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+                self.send_response(status)
+                if payload is not None:
+                    self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                time.sleep(provider.latency)
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path == '/.well-known/openid-configuration':
+                    provider.count('discovery')
+                    base = provider.base_url
+                    return self._send(200, {
+                        'issuer': base,
+                        'authorization_endpoint': f"{base}/authorize",
+                        'token_endpoint': f"{base}/token",
+                        'userinfo_endpoint': f"{base}/userinfo",
+                    }, headers={'Cache-Control': f"public, max-age={provider.max_age}"})
+                if url.path == '/authorize':
+                    provider.count('authorize')
+                    code = secrets.token_urlsafe(16)
+                    hint = query.get('login_hint') or f"user{next(provider._user_numbers)}"
+                    with provider._lock:
+                        provider._codes[code] = hint
+                    location = f"{query['redirect_uri']}?{urlencode({'code': code, 'state': query.get('state', '')})}"
+                    return self._send(302, headers={'Location': location})
+                if url.path == '/userinfo':
+                    provider.count('userinfo')
+                    token = (self.headers.get('Authorization') or '').removeprefix('Bearer ')
+                    with provider._lock:
+                        hint = provider._tokens.get(token)
+                    if hint is None:
+                        return self._send(401, {'error': 'invalid_token'})
+                    return self._send(200, {
+                        'sub': hint, 'email': f"{hint}@example.com", 'email_verified': True,
+                        'given_name': hint, 'name': hint,
+                    })
+                self._send(404, {'error': 'not_found'})
+
+            def do_POST(self):
+                time.sleep(provider.latency)
+                length = int(self.headers.get('Content-Length') or 0)
+                form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+                if urlparse(self.path).path == '/token':
+                    provider.count('token')
+                    with provider._lock:
+                        hint = provider._codes.pop(form.get('code'), None)
+                        if hint is None:
+                            return self._send(400, {'error': 'invalid_grant'})
+                        token = secrets.token_urlsafe(24)
+                        provider._tokens[token] = hint
+                    return self._send(200, {
+                        'access_token': token, 'token_type': 'Bearer', 'expires_in': 3600,
+                        'scope': 'openid email profile',
+                    })
+                self._send(404, {'error': 'not_found'})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8200)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--max-age', type=int, default=3600, help='Cache-Control max-age of the discovery document')
+    args = parser.parse_args()
+
+    provider = FakeOIDCProvider(args.host, args.port, latency=args.latency, max_age=args.max_age)
+    print(f"Fake OpenID provider listening on {provider.base_url}")
+    print(f"GOOGLE_DISCOVERY_URL={provider.discovery_url}")
+    try:
+        provider.httpd.serve_forever()
+    except KeyboardInterrupt:
+        provider.stop()
+
+
+if __name__ == '__main__':
+    main()
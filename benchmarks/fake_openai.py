@@ -0,0 +1,246 @@
+"""
+Local stand-in for the OpenAI embeddings and chat completions APIs with
+configurable latency and rate limits.
+
+    python -m benchmarks.fake_openai --port 8100 --latency 0.05 --chat-latency 2 --tokens-per-minute 200000
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8100/v1.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def fake_embedding(text, dimensions):
+    """Deterministic unit vector for a text, so identical chunks embed identically."""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class TokenBucket:
+    """Per-minute budget that refills continuously, like OpenAI's TPM/RPM limits."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, amount):
+        """Consume amount if available; otherwise return the seconds until it would be."""
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+            self.updated = now
+            if amount <= self.available:
+                self.available -= amount
+                return 0.0
+            return (amount - self.available) / self.rate
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for hundreds of simultaneous connections from a load test
+    request_queue_size = 1024
+
+
+class FakeOpenAIServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, latency_per_input=0.0,
+                 dimensions=1536, tokens_per_minute=None, requests_per_minute=None,
+                 chat_latency=1.0, completion_tokens=50):
+        self.latency = latency
+        self.latency_per_input = latency_per_input
+        # A completion takes chat_latency seconds in total; streamed tokens are spread over it
+        self.chat_latency = chat_latency
+        self.completion_tokens = completion_tokens
+        self.dimensions = dimensions
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.counters = {'requests': 0, 'rate_limited': 0, 'inputs': 0, 'completions': 0, 'in_flight': 0,
+                         'max_in_flight': 0}
+        self._counter_lock = threading.Lock()
+        self.completion_ids = itertools.count(1)
+        self.httpd = _HTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, name, amount=1):
+        with self._counter_lock:
+            self.counters[name] += amount
+            if name == 'in_flight':
+                self.counters['max_in_flight'] = max(self.counters['max_in_flight'], self.counters['in_flight'])
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def _rate_limited(self, tokens):
+                waits = []
+                if server.request_bucket:
+                    waits.append(server.request_bucket.take(1))
+                if server.token_bucket:
+                    waits.append(server.token_bucket.take(tokens))
+                wait = max(waits, default=0.0)
+                if wait <= 0:
+                    return False
+                server.count('rate_limited')
+                self._send_json(429, {'error': {
+                    'message': 'Rate limit reached (fake server)',
+                    'type': 'requests', 'code': 'rate_limit_exceeded',
+                }}, headers={
+                    'retry-after-ms': str(int(wait * 1000)),
+                    'x-ratelimit-reset-tokens': f"{int(wait * 1000)}ms",
+                })
+                return True
+
+            def do_POST(self):
+                payload = self._read_json()
+                server.count('requests')
+                if self.path.rstrip('/').endswith('/embeddings'):
+                    return self._embeddings(payload)
+                if self.path.rstrip('/').endswith('/chat/completions'):
+                    server.count('in_flight')
+                    try:
+                        return self._chat_completion(payload)
+                    finally:
+                        server.count('in_flight', -1)
+                self._send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+
+            def _embeddings(self, payload):
+                inputs = payload.get('input') or []
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                tokens = sum(max(1, len(text) // 4) for text in inputs)
+                if self._rate_limited(tokens):
+                    return
+
+                time.sleep(server.latency + server.latency_per_input * len(inputs))
+                server.count('inputs', len(inputs))
+                self._send_json(200, {
+                    'object': 'list',
+                    'model': payload.get('model'),
+                    'data': [
+                        {'object': 'embedding', 'index': i,
+                         'embedding': fake_embedding(text, server.dimensions).tolist()}
+                        for i, text in enumerate(inputs)
+                    ],
+                    'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+                })
+
+            def _chat_completion(self, payload):
+                prompt_tokens = sum(max(1, len(message.get('content') or '') // 4)
+                                    for message in payload.get('messages') or [])
+                if self._rate_limited(prompt_tokens):
+                    return
+
+                server.count('completions')
+                words = [f"word{i}" for i in range(server.completion_tokens)]
+                base = {
+                    'id': f"chatcmpl-fake-{next(server.completion_ids)}",
+                    'created': int(time.time()),
+                    'model': payload.get('model'),
+                }
+                if not payload.get('stream'):
+                    time.sleep(server.chat_latency)
+                    return self._send_json(200, {
+                        **base,
+                        'object': 'chat.completion',
+                        'choices': [{
+                            'index': 0, 'finish_reason': 'stop',
+                            'message': {'role': 'assistant', 'content': ' '.join(words)},
+                        }],
+                        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(words),
+                                  'total_tokens': prompt_tokens + len(words)},
+                    })
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                delay = server.chat_latency / (len(words) + 1)
+                for i, word in enumerate(words):
+                    time.sleep(delay)
+                    chunk = {**base, 'object': 'chat.completion.chunk', 'choices': [{
+                        'index': 0, 'finish_reason': None,
+                        'delta': {'content': word if i == 0 else f" {word}"},
+                    }]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                time.sleep(delay)
+                final = {**base, 'object': 'chat.completion.chunk',
+                         'choices': [{'index': 0, 'finish_reason': 'stop', 'delta': {}}]}
+                self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--latency-per-input', type=float, default=0.0, help='extra seconds per embedded input')
+    parser.add_argument('--dimensions', type=int, default=1536)
+    parser.add_argument('--tokens-per-minute', type=int)
+    parser.add_argument('--requests-per-minute', type=int)
+    parser.add_argument('--chat-latency', type=float, default=1.0, help='seconds per chat completion')
+    parser.add_argument('--completion-tokens', type=int, default=50)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(
+        args.host, args.port, latency=args.latency, latency_per_input=args.latency_per_input,
+        dimensions=args.dimensions, tokens_per_minute=args.tokens_per_minute,
+        requests_per_minute=args.requests_per_minute, chat_latency=args.chat_latency,
+        completion_tokens=args.completion_tokens,
+    )
+    print(f"Fake OpenAI API listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Startup timing report: import time per module, and gunicorn worker boot time.
+
+    python -m benchmarks.startup_report --top 25 --boot
+
+Imports the app in a fresh interpreter under `python -X importtime` and
+lists the modules with the largest cumulative import time (a package's time
+includes everything it imports). With --boot it also starts gunicorn
+against the local fake OpenAI server and times how long the worker takes to
+serve its first request, and then the first /chat, which pays for whatever
+was deferred to first use.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.app_server import REPO_ROOT, USER_AGENT, AppServer
+from benchmarks.fake_openai import FakeOpenAIServer
+
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+FIRST_PARTY = ('app', 'main', 'models', 'extensions', 'google_auth', 'ingestion', 'conversation', 'utils')
+
+
+def import_times(module='main'):
+    """Return [(cumulative_us, self_us, module)] for one cold import of module."""
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            'OPENAI_API_KEY': 'fake',
+            'GOOGLE_OAUTH_CLIENT_ID': 'fake',
+            'GOOGLE_OAUTH_CLIENT_SECRET': 'fake',
+            'DATABASE_URL': f"sqlite:///{os.path.join(directory, 'app.db')}",
+            'INDEX_STORE_DIR': os.path.join(directory, 'indexes'),
+            'EMBEDDING_CACHE_PATH': os.path.join(directory, 'embedding_cache.sqlite3'),
+        }
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+            cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True,
+        )
+    times = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            times.append((int(match[2]), int(match[1]), match[4]))
+    return times
+
+
+def print_import_report(times, top):
+    total = max(cumulative for cumulative, _, name in times if name == 'main')
+    print(f"Importing the app took {total / 1e6:.2f} s across {len(times)} modules\n")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    # First-party modules and top-level third-party packages; submodules are already included
+    shown = [entry for entry in times if entry[2].split('.')[0] in FIRST_PARTY or '.' not in entry[2]]
+    for cumulative, own, name in sorted(shown, reverse=True)[:top]:
+        print(f"{cumulative / 1000:>14.1f} {own / 1000:>8.1f}  {name}")
+
+
+def boot_times(repeat):
+    """Seconds from spawning gunicorn to its first response, and for the first /chat after that."""
+    openai_server = FakeOpenAIServer(latency=0.0, chat_latency=0.0).start()
+    boots, first_chats = [], []
+    try:
+        for _ in range(repeat):
+            app_server = AppServer(openai_server.base_url, env={'GUNICORN_WORKER_CLASS': 'sync'})
+            start = time.perf_counter()
+            app_server.start()
+            boots.append(time.perf_counter() - start)
+            try:
+                session = requests.Session()
+                session.headers['User-Agent'] = USER_AGENT
+                session.cookies.set('session', app_server.create_user())
+                start = time.perf_counter()
+                response = session.post(f"{app_server.base_url}/chat", json={'message': 'first question of the day'})
+                response.raise_for_status()
+                first_chats.append(time.perf_counter() - start)
+            finally:
+                app_server.stop()
+    finally:
+        openai_server.stop()
+    return boots, first_chats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--boot', action='store_true', help='also time gunicorn worker boot and the first /chat')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print_import_report(import_times(), args.top)
+
+    if args.boot:
+        boots, first_chats = boot_times(args.repeat)
+        print(f"\ngunicorn worker ready in {statistics.median(boots):.2f} s "
+              f"(median of {args.repeat}), first /chat took {statistics.median(first_chats):.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import hashlib
+import random
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+WORDS = (
+    "ceramic tile glaze porcelain warranty floor wall matte gloss polished rectified "
+    "slip resistance installation grout adhesive catalogue price delivery stock "
+    "showroom sample colour finish thickness size order invoice customer policy"
+).split()
+
+
+def synthetic_text(num_words, seed=0):
+    """Deterministic pseudo-prose built from a small catalogue vocabulary."""
+    rng = random.Random(seed)
+    sentences = []
+    while num_words > 0:
+        length = min(num_words, rng.randint(8, 20))
+        words = [rng.choice(WORDS) for _ in range(length)]
+        sentences.append(' '.join(words).capitalize() + '.')
+        num_words -= length
+    return ' '.join(sentences)
+
+
+def _escape_pdf_text(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_synthetic_pdf(path, num_pages, lines_per_page=45, seed=0):
+    """
+    Write a text-only PDF with num_pages pages of synthetic prose.
+
+    Hand-assembled so benchmarks do not need a PDF authoring library.
+    """
+    rng = random.Random(seed)
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog_id = add(None)
+    pages_id = add(None)
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for _ in range(num_pages):
+        lines = [synthetic_text(14, seed=rng.random()) for _ in range(lines_per_page)]
+        stream = "BT /F1 10 Tf 40 800 Td 14 TL " + " ".join(
+            f"({_escape_pdf_text(line)}) '" for line in lines
+        ) + " ET"
+        stream = stream.encode('latin-1')
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font_id, content_id)
+        ))
+
+    objects[catalog_id - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref_offset = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                % (len(objects) + 1, catalog_id, xref_offset))
+
+
+def structured_pages(num_pages, seed=0, line_width=90):
+    """
+    Page texts shaped like PDF extraction output: numbered and upper-case
+    headings, prose wrapped at line_width characters, and price tables whose
+    columns are separated by runs of spaces.
+    """
+    rng = random.Random(seed)
+    pages = []
+    section = 0
+    for _ in range(num_pages):
+        lines = []
+        while len(lines) < 50:
+            roll = rng.random()
+            if roll < 0.15:
+                section += 1
+                lines.append(f"{section}. {synthetic_text(rng.randint(2, 5), seed=rng.random()).rstrip('.').title()}"
+                             if rng.random() < 0.6 else synthetic_text(3, seed=rng.random()).rstrip('.').upper())
+            elif roll < 0.3:
+                lines.append(f"{'Code':<12}{'Finish':<12}{'Size':<10}{'Price':>10}")
+                for _ in range(rng.randint(3, 12)):
+                    lines.append(f"{'LIK-' + str(rng.randint(1000, 9999)):<12}{rng.choice(FINISHES):<12}"
+                                 f"{rng.choice(SIZES):<10}{rng.randint(80, 900) * 1000:>10}")
+            else:
+                paragraph = synthetic_text(rng.randint(30, 160), seed=rng.random())
+                while paragraph:
+                    cut = paragraph.rfind(' ', 0, line_width) if len(paragraph) > line_width else len(paragraph)
+                    lines.append(paragraph[:cut])
+                    paragraph = paragraph[cut + 1:]
+            if rng.random() < 0.5:
+                lines.append('')
+        pages.append('\n'.join(lines))
+    return pages
+
+
+FINISHES = ['matte', 'glossy', 'polished', 'textured']
+MATERIALS = ['porcelain', 'ceramic', 'granite']
+COLOURS = ['white', 'grey', 'beige', 'black', 'cream', 'brown', 'blue', 'green']
+SIZES = ['30x30', '40x40', '60x60', '60x120']
+ROOMS = ['bathroom', 'kitchen', 'living room', 'terrace', 'bedroom']
+
+
+def catalogue_corpus(num_products=300, seed=0):
+    """
+    Fixture corpus of product descriptions plus two query sets.
+
+    Returns (documents, queries) where documents is a list of texts and queries
+    is a list of (query, index of the relevant document, kind) with kind either
+    'code' (the query names the product code) or 'descriptive'.
+    """
+    rng = random.Random(seed)
+    combos = [(f, m, c, s, r) for f in FINISHES for m in MATERIALS for c in COLOURS
+              for s in SIZES for r in ROOMS]
+    rng.shuffle(combos)
+
+    documents = []
+    queries = []
+    codes = set()
+    for index, (finish, material, colour, size, room) in enumerate(combos[:num_products]):
+        code = f"LIK-{rng.randint(1000, 9999)}{rng.choice('ABCDEFGH')}"
+        while code in codes:
+            code = f"LIK-{rng.randint(1000, 9999)}{rng.choice('ABCDEFGH')}"
+        codes.add(code)
+        price = rng.randint(80, 900) * 1000
+        documents.append(
+            f"Product {code}: {finish} {colour} {material} tile, {size} cm. "
+            f"Recommended for the {room}. Price Rp {price} per box. "
+            f"Warranty {rng.randint(1, 10)} years. {synthetic_text(30, seed=index)}"
+        )
+        queries.append((f"What is the price of {code}?", index, 'code'))
+        queries.append((f"{colour} {finish} {material} tiles {size} for my {room}", index, 'descriptive'))
+    return documents, queries
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Dependency-free bag-of-words embeddings for benchmarks (feature hashing).
+
+    Only shared words make texts similar, so it stands in for a real model
+    well enough to exercise ranking without any network calls.
+    """
+
+    model = 'hashing'
+
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in text.lower().replace(',', ' ').replace('.', ' ').split():
+            digest = hashlib.md5(word.encode('utf-8')).digest()
+            vector[int.from_bytes(digest[:4], 'little') % self.dimensions] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
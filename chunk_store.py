@@ -0,0 +1,93 @@
+import os
+import hashlib
+import logging
+from sqlalchemy import func
+from extensions import db
+from models import DocumentChunk
+from utils.openai_helper import set_chunk_loader
+from utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT statement when storing a document's chunks
+CHUNK_INSERT_BATCH = int(os.environ.get('CHUNK_INSERT_BATCH', 500))
+
+
+class ChunkStore:
+    """
+    Database copy of every indexed chunk.
+
+    Ingestion writes a file's chunks here next to its vectors, so a user's
+    index can be rebuilt from the database (and the embedding cache) when the
+    index directory is lost, without the uploaded file or re-extraction.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        set_chunk_loader(self._load_in_app_context)
+
+    def save(self, file_id, user_id, records):
+        """
+        Replace a file's stored chunks with the records returned by ingestion,
+        in batched multi-row inserts. The caller commits.
+        """
+        self.delete(file_id)
+        rows = [
+            {
+                'file_id': file_id,
+                'user_id': user_id,
+                'ordinal': record['ordinal'],
+                'page': record['page'],
+                'text': record['text'],
+                # The splitter's count; records from elsewhere are counted here
+                'token_count': record.get('token_count') or count_tokens(record['text']),
+                'content_hash': hashlib.sha256(record['text'].encode('utf-8')).hexdigest(),
+                'vector_id': record['vector_id'],
+            }
+            for record in records
+        ]
+        for start in range(0, len(rows), CHUNK_INSERT_BATCH):
+            db.session.execute(db.insert(DocumentChunk), rows[start:start + CHUNK_INSERT_BATCH])
+        logger.debug("Stored %s chunks for file %s", len(rows), file_id)
+        return len(rows)
+
+    def delete(self, file_id):
+        """Delete a file's stored chunks. The caller commits."""
+        return DocumentChunk.query.filter_by(file_id=file_id).delete(synchronize_session=False)
+
+    def load(self, user_id):
+        """
+        Return a user's chunk records (file_id, ordinal, page, text, vector_id)
+        in index order.
+        """
+        rows = (db.session.query(DocumentChunk.file_id, DocumentChunk.ordinal, DocumentChunk.page,
+                                 DocumentChunk.text, DocumentChunk.vector_id)
+                .filter(DocumentChunk.user_id == user_id)
+                .order_by(DocumentChunk.file_id, DocumentChunk.ordinal)
+                .all())
+        return [row._asdict() for row in rows]
+
+    def counts(self, user_id):
+        """
+        Return {file_id: {'chunks': n, 'tokens': n}} for a user's files,
+        aggregated in the database so no chunk text is loaded.
+        """
+        rows = (db.session.query(DocumentChunk.file_id, func.count(DocumentChunk.id),
+                                 func.sum(DocumentChunk.token_count))
+                .filter(DocumentChunk.user_id == user_id)
+                .group_by(DocumentChunk.file_id)
+                .all())
+        return {file_id: {'chunks': chunks, 'tokens': int(tokens or 0)} for file_id, chunks, tokens in rows}
+
+    def _load_in_app_context(self, user_id):
+        # Retrieval runs on worker threads outside the request's app context
+        with self.app.app_context():
+            return self.load(user_id)
+
+
+chunk_store = ChunkStore()
@@ -0,0 +1,142 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import ChatMessage, ConversationSummary
+from utils.openai_helper import summarize_conversation
+from utils.prompt_builder import PROMPT_HISTORY_TOKENS, SUMMARY_INPUT_TOKENS, fit_history, take_oldest
+
+logger = logging.getLogger(__name__)
+
+# Unsummarized messages loaded per chat request; the prompt builder keeps what fits
+HISTORY_FETCH_LIMIT = int(os.environ.get('HISTORY_FETCH_LIMIT', 50))
+
+
+class ConversationSummarizer:
+    """
+    Keeps a rolling per-user summary of older chat turns.
+
+    Prompts carry the summary plus the most recent messages verbatim. Once
+    the unsummarized messages outgrow the prompt's history budget, the oldest
+    are folded into the summary in the background, leaving half the budget
+    of recent turns so the summary isn't rewritten on every message. Each
+    summarization call takes at most SUMMARY_INPUT_TOKENS of messages.
+    """
+
+    def __init__(self, app=None, max_workers=None):
+        self.app = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(max_workers or os.environ.get('SUMMARY_WORKERS', 2)),
+            thread_name_prefix='summary',
+        )
+        self._pending = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+
+    def load_history(self, user_id, before_id=None):
+        """
+        Return (summary or None, recent messages as dicts, oldest first) for a
+        user's prompt. Messages already in the summary are left out.
+        """
+        summary = db.session.get(ConversationSummary, user_id)
+        query = ChatMessage.query.filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.id > (summary.summarized_until if summary else 0),
+        )
+        if before_id is not None:
+            query = query.filter(ChatMessage.id < before_id)
+        messages = query.order_by(ChatMessage.id.desc()).limit(HISTORY_FETCH_LIMIT).all()
+        history = [msg.to_dict() for msg in reversed(messages)]
+        return (summary.content if summary and summary.content else None), history
+
+    def submit(self, user_id):
+        """Queue a summary update for a user after a new exchange."""
+        with self._lock:
+            if user_id in self._pending:
+                return None
+            self._pending.add(user_id)
+        return self.executor.submit(self._run, user_id)
+
+    def clear(self, user_id):
+        """Delete a user's summary. The caller commits."""
+        ConversationSummary.query.filter_by(user_id=user_id).delete()
+
+    def _run(self, user_id):
+        with self.app.app_context():
+            try:
+                self._summarize(user_id)
+            except Exception as e:
+                logger.error("Error updating conversation summary for user %s: %s", user_id, e)
+                db.session.rollback()
+            finally:
+                with self._lock:
+                    self._pending.discard(user_id)
+
+    def _unsummarized(self, user_id, after_id, before_id=None, newest=False):
+        query = ChatMessage.query.filter(ChatMessage.user_id == user_id, ChatMessage.id > after_id)
+        if before_id is not None:
+            query = query.filter(ChatMessage.id < before_id)
+        order = ChatMessage.id.desc() if newest else ChatMessage.id
+        messages = [msg.to_dict() for msg in query.order_by(order).limit(HISTORY_FETCH_LIMIT)]
+        return messages[::-1] if newest else messages
+
+    def _summarize(self, user_id):
+        summary = db.session.get(ConversationSummary, user_id)
+        exists = summary is not None
+        summarized_until = summary.summarized_until if summary else 0
+        previous = summary.content if summary else ''
+
+        recent = self._unsummarized(user_id, summarized_until, newest=True)
+        overflow, _ = fit_history(recent, PROMPT_HISTORY_TOKENS)
+        if not overflow and len(recent) < HISTORY_FETCH_LIMIT:
+            return
+        # Everything older than the newest half budget of turns is folded in
+        _, kept = fit_history(recent, PROMPT_HISTORY_TOKENS // 2)
+        keep_from = kept[0]['id'] if kept else recent[-1]['id'] + 1
+
+        # A long backlog (e.g. history from before summaries existed) is folded
+        # SUMMARY_INPUT_TOKENS at a time, saving the summary after every call so
+        # no request grows with the backlog and progress survives a failure
+        folded = 0
+        while True:
+            step = take_oldest(self._unsummarized(user_id, summarized_until, keep_from), SUMMARY_INPUT_TOKENS)
+            if not step:
+                break
+
+            # Don't hold a connection while the model writes the summary
+            db.session.close()
+            content = summarize_conversation(previous, step)
+            last_id = step[-1]['id']
+
+            if not exists:
+                db.session.add(ConversationSummary(user_id=user_id, content=content, summarized_until=last_id))
+            else:
+                # Only advance from the state this summary was built on; another worker may have got there first
+                updated = (ConversationSummary.query
+                           .filter_by(user_id=user_id, summarized_until=summarized_until)
+                           .update({'content': content, 'summarized_until': last_id}, synchronize_session=False))
+                if not updated:
+                    logger.debug("Summary for user %s was updated concurrently, discarding", user_id)
+                    db.session.rollback()
+                    return
+            try:
+                db.session.commit()
+            except IntegrityError:
+                logger.debug("Summary for user %s was created concurrently, discarding", user_id)
+                db.session.rollback()
+                return
+            exists = True
+            previous, summarized_until = content, last_id
+            folded += len(step)
+
+        if folded:
+            logger.info("Folded %s messages into the conversation summary for user %s", folded, user_id)
+
+
+conversation_summarizer = ConversationSummarizer()
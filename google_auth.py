@@ -1,21 +1,31 @@
 import json
 import os
 import logging
-import requests
 import secrets
 from extensions import db
 from flask import Blueprint, redirect, request, url_for, session, flash
 from flask_login import login_required, login_user, logout_user
 from models import User
 from oauthlib.oauth2 import WebApplicationClient
+from utils.metrics import LOGINS, timed
+from utils.oidc import OIDC_HTTP_TIMEOUT, ProviderConfigCache, make_session
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 GOOGLE_CLIENT_ID = os.environ["GOOGLE_OAUTH_CLIENT_ID"]
 GOOGLE_CLIENT_SECRET = os.environ["GOOGLE_OAUTH_CLIENT_SECRET"]
-GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+GOOGLE_DISCOVERY_URL = os.environ.get(
+    "GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration"
+)
+
+# Keep-alive connections to Google for discovery, token and userinfo calls
+http_session = make_session()
+provider_config = ProviderConfigCache(GOOGLE_DISCOVERY_URL, http_session)
+
+
+def get_login_stats():
+    """Discovery cache counters for this worker; sign-in latency is on /metrics."""
+    return {'discovery_cache': provider_config.stats()}
 
 # Get the domain from environment or request
 def get_redirect_url():
@@ -29,22 +39,16 @@ def get_redirect_url():
 
         # Always use HTTPS for OAuth callbacks in production
         redirect_url = f"https://{domain}/google_login/callback"
-        logger.info(f"Generated redirect URL: {redirect_url}")
+        logger.debug("Generated redirect URL: %s", redirect_url)
         return redirect_url
 
     # Fallback for initialization (should rarely be used)
     return f"https://{os.environ.get('REPLIT_DEV_DOMAIN')}/google_login/callback"
 
-# Print setup instructions
-current_redirect_url = get_redirect_url()
-print(f"""To make Google authentication work:
-1. Go to https://console.cloud.google.com/apis/credentials
-2. Create a new OAuth 2.0 Client ID
-3. Add {current_redirect_url} to Authorized redirect URIs
-
-For detailed instructions, see:
-https://docs.replit.com/additional-resources/google-auth-in-flask#set-up-your-oauth-app--client
-""")
+# To make Google authentication work, create an OAuth 2.0 Client ID at
+# https://console.cloud.google.com/apis/credentials and add
+# https://<your domain>/google_login/callback to its Authorized redirect URIs; see
+# https://docs.replit.com/additional-resources/google-auth-in-flask#set-up-your-oauth-app--client
 
 # Allow OAuth over HTTP for development only
 if os.environ.get('FLASK_DEBUG'):
@@ -56,15 +60,19 @@ google_auth = Blueprint("google_auth", __name__)
 
 @google_auth.route("/google_login")
 def login():
+    with timed('login_start'):
+        return _start_login()
+
+def _start_login():
     try:
         logger.debug("Starting Google login process")
 
         # Generate and store a random state parameter
         session['oauth_state'] = secrets.token_urlsafe(32)
         redirect_uri = get_redirect_url()
-        logger.debug(f"Using redirect URL: {redirect_uri}")
+        logger.debug("Using redirect URL: %s", redirect_uri)
 
-        google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+        google_provider_cfg = provider_config.get()
         authorization_endpoint = google_provider_cfg["authorization_endpoint"]
 
         request_uri = client.prepare_request_uri(
@@ -73,15 +81,26 @@ def login():
             scope=["openid", "email", "profile"],
             state=session['oauth_state']
         )
-        logger.debug(f"Redirecting to Google authorization URL: {request_uri}")
+        # The full URL carries the state token, so only the endpoint is logged
+        logger.debug("Redirecting to Google authorization endpoint %s", authorization_endpoint)
         return redirect(request_uri)
     except Exception as e:
-        logger.error(f"Error in login route: {str(e)}")
+        logger.error("Error in login route: %s", e)
         flash("Failed to initialize Google login. Please try again.", "error")
         return redirect(url_for("login"))
 
 @google_auth.route("/google_login/callback")
 def callback():
+    with timed('login_callback'):
+        return _complete_login()
+
+def _login_failed(message):
+    """Count a failed sign-in and send the user back to the login page."""
+    LOGINS.labels('failed').inc()
+    flash(message, "error")
+    return redirect(url_for("login"))
+
+def _complete_login():
     try:
         logger.debug("Received callback from Google")
 
@@ -91,67 +110,62 @@ def callback():
         error = request.args.get('error')
 
         if error:
-            logger.error(f"Google OAuth error: {error}")
-            flash("Authentication failed: " + error, "error")
-            return redirect(url_for("login"))
-
-        logger.debug(f"Received state: {state}")
-        logger.debug(f"Stored state: {stored_state}")
+            logger.error("Google OAuth error: %s", error)
+            return _login_failed("Authentication failed: " + error)
 
         if not state or state != stored_state:
             logger.error("State verification failed")
-            flash("Authentication failed: Invalid state parameter.", "error")
-            return redirect(url_for("login"))
+            return _login_failed("Authentication failed: Invalid state parameter.")
 
         code = request.args.get("code")
         if not code:
             logger.error("No authorization code received from Google")
-            flash("Authentication failed: No authorization code received.", "error")
-            return redirect(url_for("login"))
+            return _login_failed("Authentication failed: No authorization code received.")
 
-        google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+        google_provider_cfg = provider_config.get()
         token_endpoint = google_provider_cfg["token_endpoint"]
         redirect_uri = get_redirect_url()
 
-        token_url, headers, body = client.prepare_token_request(
+        # The client holds the access token once parsed, so each callback gets its own
+        oauth_client = WebApplicationClient(GOOGLE_CLIENT_ID)
+        token_url, headers, body = oauth_client.prepare_token_request(
             token_endpoint,
             authorization_response=request.url.replace('http://', 'https://'),
             redirect_url=redirect_uri,
             code=code
         )
 
-        token_response = requests.post(
+        token_response = http_session.post(
             token_url,
             headers=headers,
             data=body,
             auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
+            timeout=OIDC_HTTP_TIMEOUT,
         )
 
-        logger.debug(f"Token response status: {token_response.status_code}")
+        logger.debug("Token response status: %s", token_response.status_code)
 
         if not token_response.ok:
-            logger.error(f"Token response error: {token_response.text}")
-            flash("Authentication failed: Could not get access token.", "error")
-            return redirect(url_for("login"))
+            logger.error("Token response error: %s", token_response.text)
+            return _login_failed("Authentication failed: Could not get access token.")
 
-        client.parse_request_body_response(json.dumps(token_response.json()))
+        oauth_client.parse_request_body_response(json.dumps(token_response.json()))
 
         userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
-        uri, headers, body = client.add_token(userinfo_endpoint)
-        userinfo_response = requests.get(uri, headers=headers, data=body)
+        uri, headers, body = oauth_client.add_token(userinfo_endpoint)
+        userinfo_response = http_session.get(uri, headers=headers, data=body, timeout=OIDC_HTTP_TIMEOUT)
 
         logger.debug("Processing user info")
         if not userinfo_response.ok:
-            logger.error(f"Userinfo response error: {userinfo_response.text}")
-            flash("Authentication failed: Could not get user info.", "error")
-            return redirect(url_for("login"))
+            logger.error("Userinfo response error: %s", userinfo_response.text)
+            return _login_failed("Authentication failed: Could not get user info.")
 
         userinfo = userinfo_response.json()
         if userinfo.get("email_verified"):
             users_email = userinfo["email"]
             users_name = userinfo["given_name"]
 
-            logger.debug(f"User verified: {users_email}")
+            logger.debug("User verified: %s", users_email)
 
             user = User.query.filter_by(email=users_email).first()
             if not user:
@@ -168,16 +182,16 @@ def callback():
                 try:
                     db.session.add(user)
                     db.session.commit()
-                    logger.debug(f"Created new user with username: {username}")
+                    logger.debug("Created new user with username: %s", username)
                 except Exception as e:
-                    logger.error(f"Error creating user: {str(e)}")
+                    logger.error("Error creating user: %s", e)
                     db.session.rollback()
-                    flash("Failed to create user account. Please try again.", "error")
-                    return redirect(url_for("login"))
+                    return _login_failed("Failed to create user account. Please try again.")
 
             # Set session permanent to True and log in user
             session.permanent = True
             login_user(user, remember=True)
+            LOGINS.labels('ok').inc()
             logger.debug("User logged in successfully")
 
             # Get the next URL from session if available
@@ -185,18 +199,16 @@ def callback():
             if not next_url or not next_url.startswith('/'):
                 next_url = url_for('index')
 
-            logger.debug(f"Redirecting to: {next_url}")
+            logger.debug("Redirecting to: %s", next_url)
             flash("Successfully logged in!", "success")
             return redirect(next_url)
         else:
             logger.error("User email not available or not verified by Google")
-            flash("Authentication failed: Email not verified by Google.", "error")
-            return redirect(url_for("login"))
+            return _login_failed("Authentication failed: Email not verified by Google.")
 
     except Exception as e:
-        logger.error(f"OAuth error: {str(e)}")
-        flash("Authentication failed. Please try again.", "error")
-        return redirect(url_for("login"))
+        logger.error("OAuth error: %s", e)
+        return _login_failed("Authentication failed. Please try again.")
 
 @google_auth.route("/logout")
 @login_required
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import threading
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# gevent workers serve many requests at once: while one chat waits on OpenAI,
+# the others keep running. Set GUNICORN_WORKER_CLASS=sync to go back to one
+# request per worker.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# Load the OpenAI client, langchain and FAISS in the background once the worker
+# is up, so it takes traffic quickly and the first chat rarely waits for them
+warm_services = os.environ.get('WARM_SERVICES', '1') == '1'
+
+# Workers write metric samples here so /metrics can aggregate all of them;
+# it must be set before any worker imports prometheus_client
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                      os.path.join(tempfile.gettempdir(), f"kb-prometheus-{os.getpid()}"))
+
+
+def _warm_services():
+    from utils.openai_helper import get_text_processor
+    from utils.tokens import get_encoding
+    # The tokenizer may download its BPE file; better here than on the first
+    # upload, whose splitting runs on a native thread
+    get_encoding(get_text_processor().text_splitter.model)
+
+
+def on_starting(server):
+    # Samples left by a previous run would be summed into this one
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+
+
+def on_exit(server):
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent' and os.environ.get('DATABASE_URL', '').startswith('postgres'):
+        # Let psycopg2 yield to other greenlets while waiting on PostgreSQL
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def post_worker_init(worker):
+    # Ingestion jobs run in serving workers only, not wherever the app is imported
+    from ingestion import ingestion_queue
+    ingestion_queue.start()
+    if warm_services:
+        threading.Thread(target=_warm_services, name='warm-services', daemon=True).start()
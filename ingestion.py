@@ -0,0 +1,333 @@
+import os
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from extensions import db
+from models import File
+from chunk_store import chunk_store
+from utils.metrics import timed
+from utils.openai_helper import (compact_index, index_documents, prepare_document, prepare_pdf, process_document,
+                                 process_pdf, remove_document)
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_INDEXING = 'indexing'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+
+# Files of one bulk upload being prepared at the same time; 0 uses every ingestion worker
+BULK_INGESTION_CONCURRENCY = int(os.environ.get('BULK_INGESTION_CONCURRENCY', 0))
+# A file left 'indexing' without progress for this long is assumed lost with
+# its worker and is re-queued; must exceed the time a single file takes to embed
+INGESTION_LEASE_SECONDS = int(os.environ.get('INGESTION_LEASE_SECONDS', 900))
+
+
+class IngestionBatch:
+    """
+    The files of one bulk upload. Runners take files from the queue one at a
+    time; what they prepare is held until the last runner finishes and
+    indexes the whole batch.
+    """
+
+    def __init__(self, user_id, file_ids):
+        self.user_id = user_id
+        self.queue = deque(file_ids)
+        self.prepared = {}  # file_id -> PreparedDocument
+        self.runners = 0
+        self.lock = threading.Lock()
+
+    def next_file(self):
+        """The next file to prepare, or None once the queue is empty."""
+        with self.lock:
+            return self.queue.popleft() if self.queue else None
+
+    def finish_runner(self):
+        """Retire a runner; True for the last one, which commits the batch."""
+        with self.lock:
+            self.runners -= 1
+            return self.runners == 0
+
+
+class IngestionQueue:
+    """
+    In-process worker pool that extracts, chunks and embeds uploaded files
+    outside the request cycle.
+
+    The File table doubles as the job queue: a job is claimed by atomically
+    moving its row from 'pending' to 'indexing', so the same file is never
+    processed twice even though every gunicorn worker runs its own pool.
+    The claim is a lease (claimed_at) renewed as the job progresses; files
+    whose lease expires are handed back to the queue by resume_pending.
+    """
+
+    def __init__(self, app=None, max_workers=None):
+        self.app = None
+        self.max_workers = int(max_workers or os.environ.get('INGESTION_WORKERS', 2))
+        # Greenlets on gevent workers, like the requests, so jobs share the OpenAI
+        # client and database sessions safely; the text processor hands their
+        # CPU heavy steps to native threads (see utils.concurrency.run_blocking)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='ingestion',
+        )
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+
+    def submit(self, file_id):
+        """Queue a pending file for ingestion."""
+        logger.debug("Queueing file %s for ingestion", file_id)
+        return self.executor.submit(self._run, file_id)
+
+    def submit_batch(self, user_id, file_ids):
+        """
+        Queue the pending files of a bulk upload as one job.
+
+        A bounded number of runners extract, split and embed the files
+        concurrently, so one file's embedding requests overlap the next
+        one's extraction. A file that fails is marked failed on its own;
+        the rest are added to the index in a single commit at the end.
+        """
+        batch = IngestionBatch(user_id, file_ids)
+        batch.runners = min(len(file_ids), BULK_INGESTION_CONCURRENCY or self.max_workers)
+        logger.debug("Queueing %s files for batch ingestion with %s runners", len(file_ids), batch.runners)
+        for _ in range(batch.runners):
+            self.executor.submit(self._run_batch, batch)
+        return batch
+
+    def submit_compaction(self, user_id):
+        """
+        Queue a merge of the user's index segments, e.g. after a delete left
+        chunks in them that searches have to skip.
+        """
+        return self.executor.submit(self._compact, user_id)
+
+    def resume_pending(self, stale_only=False):
+        """
+        Re-queue files whose job was lost with a restarted or crashed worker.
+        Must be called inside an app context.
+
+        Files left 'indexing' go back to 'pending' once their lease expires;
+        they start over, as do batch files waiting at 90% whose vectors were
+        only held in memory. With stale_only, pending files are only
+        re-queued once they have waited longer than a lease, so the ones
+        still queued in a live worker are not submitted twice.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=INGESTION_LEASE_SECONDS)
+        lease_expired = (File.status == STATUS_INDEXING) & or_(File.claimed_at.is_(None), File.claimed_at < cutoff)
+        expired = {file_id for (file_id,) in db.session.query(File.id).filter(lease_expired)}
+        if expired:
+            (File.query
+             .filter(File.id.in_(expired), lease_expired)
+             .update({'status': STATUS_PENDING, 'progress': 0, 'claimed_at': None}, synchronize_session=False))
+            db.session.commit()
+            logger.warning("Re-queueing %s ingestion jobs whose lease expired", len(expired))
+
+        query = db.session.query(File.id).filter_by(status=STATUS_PENDING)
+        if stale_only:
+            query = query.filter(or_(File.uploaded_at.is_(None), File.uploaded_at < cutoff))
+        pending = expired | {file_id for (file_id,) in query}
+        for file_id in sorted(pending):
+            self.submit(file_id)
+        if pending:
+            logger.info("Resumed %s pending ingestion jobs", len(pending))
+
+    def start(self):
+        """
+        Re-queue the files earlier processes left unfinished and start the
+        lease sweeper. Only processes that serve requests call this (see
+        gunicorn.conf.py and main.py), so CLI commands and tests importing
+        the app never run ingestion jobs.
+        """
+        with self.app.app_context():
+            self.resume_pending()
+        return self.start_lease_sweeper()
+
+    def start_lease_sweeper(self):
+        """
+        Check for expired leases every half lease in the background, so jobs
+        of a worker that died are picked up without waiting for a restart.
+        """
+        thread = threading.Thread(target=self._sweep_leases, name='ingestion-leases', daemon=True)
+        thread.start()
+        return thread
+
+    def _sweep_leases(self):
+        while True:
+            time.sleep(INGESTION_LEASE_SECONDS / 2)
+            with self.app.app_context():
+                try:
+                    self.resume_pending(stale_only=True)
+                except Exception as e:
+                    logger.error("Unexpected error re-queueing expired ingestion jobs: %s", e)
+                    db.session.rollback()
+
+    def _run(self, file_id):
+        with self.app.app_context():
+            try:
+                with timed('ingest'):
+                    self._ingest(file_id)
+            except Exception as e:
+                logger.error("Unexpected error ingesting file %s: %s", file_id, e)
+                db.session.rollback()
+
+    def _compact(self, user_id):
+        try:
+            with timed('compact'):
+                compact_index(user_id)
+        except Exception as e:
+            logger.error("Unexpected error compacting index of user %s: %s", user_id, e)
+
+    def _run_batch(self, batch):
+        with self.app.app_context():
+            file_id = batch.next_file()
+            while file_id is not None:
+                try:
+                    with timed('ingest'):
+                        self._prepare(batch, file_id)
+                    self._renew(list(batch.prepared))
+                except Exception as e:
+                    logger.error("Unexpected error preparing file %s: %s", file_id, e)
+                    db.session.rollback()
+                file_id = batch.next_file()
+            if batch.finish_runner():
+                try:
+                    self._commit_batch(batch)
+                except Exception as e:
+                    logger.error("Unexpected error committing batch of user %s: %s", batch.user_id, e)
+                    db.session.rollback()
+
+    def _claim(self, file_id):
+        claimed = (File.query
+                   .filter_by(id=file_id, status=STATUS_PENDING)
+                   .update({'status': STATUS_INDEXING, 'progress': 0, 'claimed_at': datetime.utcnow()},
+                           synchronize_session=False))
+        db.session.commit()
+        return claimed == 1
+
+    def _renew(self, file_ids):
+        """Extend the lease of files still waiting for their batch to be committed."""
+        if not file_ids:
+            return
+        (File.query
+         .filter(File.id.in_(file_ids), File.status == STATUS_INDEXING)
+         .update({'claimed_at': datetime.utcnow()}, synchronize_session=False))
+        db.session.commit()
+
+    def _set_progress(self, file_record, progress, status=None, error=None):
+        file_record.progress = progress
+        file_record.claimed_at = datetime.utcnow()
+        if status:
+            file_record.status = status
+        file_record.error = error
+        db.session.commit()
+
+    def _ingest(self, file_id):
+        if not self._claim(file_id):
+            logger.debug("File %s already claimed by another worker", file_id)
+            return
+
+        file_record = db.session.get(File, file_id)
+        filepath = os.path.join(self.app.config['UPLOAD_FOLDER'], file_record.filename)
+        user_id = file_record.user_id
+
+        try:
+            self._set_progress(file_record, 10)
+
+            # Process based on file type; PDF pages are streamed straight into the splitter
+            if file_record.original_filename.lower().endswith('.pdf'):
+                chunks = process_pdf(filepath, user_id, file_id)
+            else:  # .txt files
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                logger.debug("File content read, length: %s characters", len(content))
+                chunks = process_document(content, user_id, file_id)
+
+            logger.debug("Document processed into %s chunks", len(chunks))
+
+            # The file may have been deleted while it was being embedded
+            db.session.expire_all()
+            file_record = db.session.get(File, file_id)
+            if file_record is None:
+                remove_document(user_id, file_id)
+                return
+
+            # Stored in the same commit that marks the file ready
+            with timed('db_commit'):
+                chunk_store.save(file_id, user_id, chunks)
+                self._set_progress(file_record, 100, status=STATUS_READY)
+
+        except Exception as e:
+            logger.error("Error processing file %s: %s", file_id, e)
+            self._fail(file_id, filepath, e)
+
+    def _prepare(self, batch, file_id):
+        if not self._claim(file_id):
+            logger.debug("File %s already claimed by another worker", file_id)
+            return
+
+        file_record = db.session.get(File, file_id)
+        filepath = os.path.join(self.app.config['UPLOAD_FOLDER'], file_record.filename)
+
+        try:
+            self._set_progress(file_record, 10)
+            if file_record.original_filename.lower().endswith('.pdf'):
+                document = prepare_pdf(filepath, file_id)
+            else:  # .txt files
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    document = prepare_document(f.read(), file_id)
+            batch.prepared[file_id] = document
+            # Embedded; what is left is the batch's index commit
+            self._set_progress(file_record, 90)
+
+        except Exception as e:
+            logger.error("Error processing file %s: %s", file_id, e)
+            self._fail(file_id, filepath, e)
+
+    def _commit_batch(self, batch):
+        if not batch.prepared:
+            return
+        file_ids = list(batch.prepared)
+        try:
+            records = index_documents(batch.user_id, list(batch.prepared.values()))
+
+            # Files deleted while the batch was running lose their vectors again
+            db.session.expire_all()
+            existing = {file_id for (file_id,) in db.session.query(File.id).filter(File.id.in_(file_ids))}
+            for file_id in file_ids:
+                if file_id not in existing and file_id in records:
+                    remove_document(batch.user_id, file_id)
+
+            # Stored in the same commit that marks the files ready
+            with timed('db_commit'):
+                for file_id in existing:
+                    chunk_store.save(file_id, batch.user_id, records.get(file_id, []))
+                (File.query
+                 .filter(File.id.in_(existing))
+                 .update({'status': STATUS_READY, 'progress': 100, 'error': None}, synchronize_session=False))
+                db.session.commit()
+            logger.info("Indexed batch of %s files for user %s", len(existing), batch.user_id)
+
+        except Exception as e:
+            logger.error("Error indexing batch of user %s: %s", batch.user_id, e)
+            db.session.rollback()
+            for file_record in db.session.query(File).filter(File.id.in_(file_ids)).all():
+                self._fail(file_record.id, os.path.join(self.app.config['UPLOAD_FOLDER'], file_record.filename), e)
+
+    def _fail(self, file_id, filepath, error):
+        db.session.rollback()
+        file_record = db.session.get(File, file_id)
+        if file_record is not None:
+            self._set_progress(file_record, file_record.progress or 0, status=STATUS_FAILED, error=str(error))
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+
+ingestion_queue = IngestionQueue()
@@ -1,4 +1,10 @@
+import os
+
 from app import app
+from ingestion import ingestion_queue
 
 if __name__ == "__main__":
+    # The reloader's parent process only watches files; its child serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        ingestion_queue.start()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -13,6 +13,11 @@ class User(UserMixin, db.Model):
     files = db.relationship('File', backref='user', lazy=True)
 
 class ChatMessage(db.Model):
+    # Backs per-user history pagination ordered by time
+    __table_args__ = (
+        db.Index('ix_chat_message_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
     content = db.Column(db.Text, nullable=False)
@@ -21,6 +26,7 @@ class ChatMessage(db.Model):
 
     def to_dict(self):
         return {
+            'id': self.id,
             'role': self.role,
             'content': self.content,
             'timestamp': self.timestamp.isoformat()
@@ -32,11 +38,46 @@ class File(db.Model):
     original_filename = db.Column(db.String(255), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    job_id = db.Column(db.String(36), unique=True, index=True)
+    batch_id = db.Column(db.String(36), index=True)  # set for files of a bulk upload
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, indexing, ready, failed
+    progress = db.Column(db.Integer, nullable=False, default=0)  # 0-100
+    error = db.Column(db.Text)
+    claimed_at = db.Column(db.DateTime)  # lease of the worker indexing the file, renewed as it progresses
 
     def to_dict(self):
         return {
             'id': self.id,
             'filename': self.filename,
             'original_filename': self.original_filename,
-            'uploaded_at': self.uploaded_at.isoformat()
-        }
\ No newline at end of file
+            'uploaded_at': self.uploaded_at.isoformat(),
+            'job_id': self.job_id,
+            'batch_id': self.batch_id,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error
+        }
+
+class DocumentChunk(db.Model):
+    # Chunk text lives here so indexes can be rebuilt without the original upload
+    __table_args__ = (
+        db.UniqueConstraint('file_id', 'ordinal', name='uq_document_chunk_file_id_ordinal'),
+        db.Index('ix_document_chunk_user_id_file_id', 'user_id', 'file_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    ordinal = db.Column(db.Integer, nullable=False)  # position within the file
+    page = db.Column(db.Integer)  # 1-based PDF page, None for plain text
+    text = db.Column(db.Text, nullable=False)
+    token_count = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)  # sha256 of text
+    vector_id = db.Column(db.String(64), nullable=False)  # docstore id in the user's vector index
+
+class ConversationSummary(db.Model):
+    # Rolling summary of a user's older chat turns, replacing them in prompts
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    content = db.Column(db.Text, nullable=False, default='')
+    summarized_until = db.Column(db.Integer, nullable=False, default=0)  # id of the last folded-in message
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
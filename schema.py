@@ -0,0 +1,105 @@
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from sqlalchemy import inspect, literal, text
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_lock key serialising schema changes across processes and hosts
+SCHEMA_LOCK_KEY = 0x6b625f736368656d  # "kb_schem"
+
+# Value given to existing rows when a NOT NULL column is added. Files uploaded
+# before background ingestion were indexed during the upload request.
+BACKFILL = {
+    ('file', 'status'): 'ready',
+    ('file', 'progress'): 100,
+}
+
+
+def _add_column_sql(table, column, dialect):
+    preparer = dialect.identifier_preparer
+    sql = (f"ALTER TABLE {preparer.format_table(table)} "
+           f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=dialect)}")
+    if not column.nullable:
+        value = BACKFILL.get((table.name, column.name))
+        if value is None:
+            raise RuntimeError(f"No backfill value for NOT NULL column {table.name}.{column.name}")
+        default = literal(value, column.type).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+        sql += f" DEFAULT {default} NOT NULL"
+    return sql
+
+
+@contextmanager
+def schema_lock(engine):
+    """
+    Hold an exclusive lock on schema changes for the engine's database.
+
+    Every gunicorn worker imports the app and creates the schema on its own,
+    so on a fresh database they would race to create the same tables.
+    PostgreSQL uses an advisory lock; other databases a file lock, next to
+    the database file for SQLite, which covers all processes on the host.
+    """
+    if engine.dialect.name == 'postgresql':
+        with engine.connect() as connection:
+            connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': SCHEMA_LOCK_KEY})
+            try:
+                yield
+            finally:
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': SCHEMA_LOCK_KEY})
+        return
+
+    database = engine.url.database
+    if engine.dialect.name == 'sqlite' and database and database != ':memory:':
+        path = os.path.abspath(database) + '.schema-lock'
+    else:
+        digest = hashlib.sha256(str(engine.url).encode('utf-8')).hexdigest()[:16]
+        path = os.path.join(tempfile.gettempdir(), f"kb-schema-{digest}.lock")
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def create_schema():
+    """
+    Create missing tables, then add the columns and indexes older databases
+    lack, holding schema_lock() throughout so processes starting together
+    take turns. Must be called inside an app context.
+    """
+    with schema_lock(db.engine):
+        db.create_all()
+        upgrade_schema()
+
+
+def upgrade_schema():
+    """
+    Add the columns and indexes the models gained since a database was created.
+
+    db.create_all() only creates missing tables, so databases from an older
+    release lack e.g. the ingestion columns on file and the chat history
+    index. Idempotent, but not safe to run from several processes at once:
+    call it through create_schema(). Must be called inside an app context.
+    """
+    engine = db.engine
+    tables = set(inspect(engine).get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        present = {column['name'] for column in inspect(engine).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in present:
+                with engine.begin() as connection:
+                    connection.execute(text(_add_column_sql(table, column, engine.dialect)))
+                logger.info("Added column %s.%s", table.name, column.name)
+
+        indexes = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(engine)
+                logger.info("Created index %s", index.name)
@@ -146,7 +146,7 @@ document.addEventListener('DOMContentLoaded', function() {
             }
 
             const responseData = await response.json();
-            alert('File uploaded and processed successfully!');
+            alert('File uploaded! It will be searchable once indexing finishes.');
 
             // Clear the UI after successful upload
             fileInput.value = '';
@@ -158,6 +158,7 @@ document.addEventListener('DOMContentLoaded', function() {
             uploadBtn.classList.remove('ready');
 
             loadFiles(); // Refresh the files list
+            pollJobStatus(responseData.job_id);
 
         } catch (error) {
             console.error('Upload error:', error);
@@ -168,6 +169,28 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Poll a background ingestion job until it is ready or failed
+    async function pollJobStatus(jobId) {
+        try {
+            const response = await fetch(`/jobs/${jobId}`);
+            const data = await response.json();
+
+            if (!response.ok) {
+                throw new Error(data.error || 'Error checking job status');
+            }
+
+            loadFiles();
+
+            if (data.job.status === 'failed') {
+                alert(`Error processing ${data.job.original_filename}: ${data.job.error}`);
+            } else if (data.job.status !== 'ready') {
+                setTimeout(() => pollJobStatus(jobId), 2000);
+            }
+        } catch (error) {
+            console.error('Job status error:', error);
+        }
+    }
+
     function handleFileUpload(file) {
         if (!file) {
             alert('Please select a file first.');
@@ -206,7 +229,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // Modified addMessageToChat function
-    function addMessageToChat(message, role) {
+    function addMessageToChat(message, role, prepend = false) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${role === 'user' ? 'user-message' : 'ai-message'}`;
 
@@ -237,7 +260,27 @@ document.addEventListener('DOMContentLoaded', function() {
 
         const content = document.createElement('div');
         content.className = 'message-content';
+        renderMessageContent(content, message, role);
+
+        messageDiv.appendChild(header);
+        messageDiv.appendChild(content);
 
+        let messageList = chatContainer.querySelector('.message-list');
+        if (!messageList) {
+            messageList = document.createElement('div');
+            messageList.className = 'message-list';
+            chatContainer.appendChild(messageList);
+        }
+        if (prepend) {
+            messageList.insertBefore(messageDiv, messageList.firstChild);
+        } else {
+            messageList.appendChild(messageDiv);
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        }
+        return content;
+    }
+
+    function renderMessageContent(content, message, role) {
         if (role === 'assistant') {
             // Format AI messages with proper spacing and structure
             const formattedMessage = message
@@ -299,17 +342,6 @@ document.addEventListener('DOMContentLoaded', function() {
                 .join('');
         }
 
-        messageDiv.appendChild(header);
-        messageDiv.appendChild(content);
-
-        let messageList = chatContainer.querySelector('.message-list');
-        if (!messageList) {
-            messageList = document.createElement('div');
-            messageList.className = 'message-list';
-            chatContainer.appendChild(messageList);
-        }
-        messageList.appendChild(messageDiv);
-        chatContainer.scrollTop = chatContainer.scrollHeight;
     }
 
     // Reset Chat Handler
@@ -339,6 +371,8 @@ document.addEventListener('DOMContentLoaded', function() {
 
             chatContainer.innerHTML = '';
             messageInput.value = '';
+            oldestMessageId = null;
+            hasMoreHistory = false;
 
             // Re-add typing indicator after clearing
             chatContainer.appendChild(typingIndicator);
@@ -376,7 +410,7 @@ document.addEventListener('DOMContentLoaded', function() {
         showTypingIndicator();
 
         try {
-            const response = await fetch('/chat', {
+            const response = await fetch('/chat/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -384,31 +418,83 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify({ message })
             });
 
-            const data = await response.json();
-
             if (!response.ok) {
+                const data = await response.json();
                 throw new Error(data.error || 'Error sending message');
             }
 
-            hideTypingIndicator();
-            updateChatDisplay(data.history);
+            await readChatStream(response);
 
         } catch (error) {
             console.error('Chat error:', error);
-            hideTypingIndicator();
             alert('Error processing message: ' + error.message);
         } finally {
+            hideTypingIndicator();
             sendBtn.disabled = false;
         }
     }
 
+    // Render Server-Sent Events from /chat/stream as the tokens arrive
+    async function readChatStream(response) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let reply = '';
+        let content = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+
+            for (const rawEvent of events) {
+                let eventType = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) {
+                        eventType = line.slice(7);
+                    } else if (line.startsWith('data: ')) {
+                        data += line.slice(6);
+                    }
+                });
+                if (!data) continue;
+
+                const payload = JSON.parse(data);
+                if (eventType === 'error') {
+                    throw new Error(payload.error || 'Error processing message');
+                }
+                if (eventType === 'done') {
+                    return payload.message;
+                }
+
+                if (!content) {
+                    hideTypingIndicator();
+                    content = addMessageToChat('', 'assistant');
+                }
+                reply += payload.token;
+                renderMessageContent(content, reply, 'assistant');
+                chatContainer.scrollTop = chatContainer.scrollHeight;
+            }
+        }
+        return null;
+    }
+
+    // Cursor for loading older pages of history
+    let oldestMessageId = null;
+    let hasMoreHistory = false;
+    let loadingOlderHistory = false;
+
     async function loadChatHistory() {
         try {
             const response = await fetch('/history');
             const data = await response.json();
 
             if (response.ok) {
-                updateChatDisplay(data.history);
+                appendMessages(data.history);
+                updateHistoryCursor(data);
             } else {
                 throw new Error(data.error || 'Error loading history');
             }
@@ -418,18 +504,56 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    function updateChatDisplay(history) {
-        // Clear all messages but keep typing indicator
-        const messageList = chatContainer.querySelector('.message-list');
-        if (messageList) {
-            messageList.innerHTML = '';
+    async function loadOlderHistory() {
+        if (!hasMoreHistory || loadingOlderHistory || oldestMessageId === null) return;
+        loadingOlderHistory = true;
+
+        try {
+            const response = await fetch(`/history?before=${oldestMessageId}`);
+            const data = await response.json();
+
+            if (!response.ok) {
+                throw new Error(data.error || 'Error loading history');
+            }
+
+            // Keep the visible messages in place while older ones are inserted above
+            const previousHeight = chatContainer.scrollHeight;
+            prependMessages(data.history);
+            chatContainer.scrollTop += chatContainer.scrollHeight - previousHeight;
+            updateHistoryCursor(data);
+        } catch (error) {
+            console.error('Error loading older chat history:', error);
+        } finally {
+            loadingOlderHistory = false;
+        }
+    }
+
+    function updateHistoryCursor(data) {
+        if (data.history.length > 0) {
+            oldestMessageId = data.history[0].id;
+        }
+        hasMoreHistory = data.has_more;
+    }
+
+    chatContainer.addEventListener('scroll', () => {
+        if (chatContainer.scrollTop === 0) {
+            loadOlderHistory();
         }
+    });
 
-        history.forEach(message => {
+    function appendMessages(messages) {
+        messages.forEach(message => {
             addMessageToChat(message.content, message.role);
         });
     }
 
+    function prependMessages(messages) {
+        // Insert newest first so the page ends up in chronological order
+        messages.slice().reverse().forEach(message => {
+            addMessageToChat(message.content, message.role, true);
+        });
+    }
+
     async function loadFiles() {
         try {
             const response = await fetch('/files');
@@ -481,8 +605,20 @@ document.addEventListener('DOMContentLoaded', function() {
             fileTime.className = 'file-time';
             fileTime.textContent = new Date(file.uploaded_at).toLocaleString();
 
+            const fileStatus = document.createElement('p');
+            fileStatus.className = `file-status status-${file.status}`;
+            if (file.status === 'indexing') {
+                fileStatus.textContent = `Indexing ${file.progress}%`;
+            } else if (file.status === 'failed') {
+                fileStatus.textContent = 'Failed';
+                fileStatus.title = file.error || '';
+            } else {
+                fileStatus.textContent = file.status.charAt(0).toUpperCase() + file.status.slice(1);
+            }
+
             details.appendChild(fileName);
             details.appendChild(fileTime);
+            details.appendChild(fileStatus);
 
             fileInfo.appendChild(icon);
             fileInfo.appendChild(details);
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+# The app reads its settings at import time; point everything at a scratch
+# directory and fake credentials, since tests never reach OpenAI or Google
+SCRATCH_DIR = tempfile.mkdtemp(prefix='kb-tests-')
+os.environ.update({
+    'OPENAI_API_KEY': 'test',
+    'GOOGLE_OAUTH_CLIENT_ID': 'test',
+    'GOOGLE_OAUTH_CLIENT_SECRET': 'test',
+    'FLASK_SECRET_KEY': 'test',
+    'DATABASE_URL': f"sqlite:///{os.path.join(SCRATCH_DIR, 'app.db')}",
+    'INDEX_STORE_DIR': os.path.join(SCRATCH_DIR, 'indexes'),
+    'EMBEDDING_CACHE_PATH': os.path.join(SCRATCH_DIR, 'embedding_cache.sqlite3'),
+})
+
+import pytest
+
+from benchmarks.synthetic import HashingEmbeddings
+
+
+@pytest.fixture
+def embeddings():
+    return HashingEmbeddings()
+
+
+@pytest.fixture
+def text_processor(tmp_path, embeddings):
+    from utils.text_processor import TextProcessor
+    return TextProcessor(embeddings=embeddings, index_dir=str(tmp_path / 'indexes'))
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    return app
+
+
+@pytest.fixture
+def database(app):
+    """An app context over empty tables."""
+    from extensions import db
+    with app.app_context():
+        yield db
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+
+@pytest.fixture
+def user(database):
+    from models import User
+    user = User(id=1, username='tester', email='tester@example.com')
+    database.session.add(user)
+    database.session.commit()
+    return user
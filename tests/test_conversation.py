@@ -0,0 +1,64 @@
+import pytest
+
+import conversation
+from conversation import ConversationSummarizer
+from models import ChatMessage, ConversationSummary
+from utils.prompt_builder import PROMPT_HISTORY_TOKENS, SUMMARY_INPUT_TOKENS, message_tokens
+
+
+@pytest.fixture
+def summaries(monkeypatch):
+    """Stand-in for the summary model, recording what each call was sent."""
+    calls = []
+
+    def summarize_conversation(previous, messages):
+        calls.append((previous, messages))
+        return f"summary {len(calls)}"
+
+    monkeypatch.setattr(conversation, 'summarize_conversation', summarize_conversation)
+    return calls
+
+
+def add_messages(database, user, contents):
+    for number, content in enumerate(contents):
+        database.session.add(ChatMessage(user_id=user.id, role='user' if number % 2 == 0 else 'assistant',
+                                         content=content))
+    database.session.commit()
+
+
+def test_long_backlog_is_folded_in_bounded_steps(app, database, user, summaries):
+    add_messages(database, user, [f"message {number} " + 'tile ' * 60 for number in range(200)])
+
+    ConversationSummarizer(app)._summarize(user.id)
+
+    assert len(summaries) > 1
+    for _, messages in summaries:
+        assert sum(message_tokens(message) for message in messages) <= SUMMARY_INPUT_TOKENS
+    # Each step builds on the summary saved by the one before
+    assert [previous for previous, _ in summaries] == [''] + [f"summary {n}" for n in range(1, len(summaries))]
+    folded = [message['id'] for _, messages in summaries for message in messages]
+    assert folded == sorted(folded) and len(folded) == len(set(folded))
+
+    summary = database.session.get(ConversationSummary, user.id)
+    assert (summary.content, summary.summarized_until) == (f"summary {len(summaries)}", folded[-1])
+    _, history = ConversationSummarizer(app).load_history(user.id)
+    assert history[0]['id'] == folded[-1] + 1
+    assert sum(message_tokens(message) for message in history) <= PROMPT_HISTORY_TOKENS // 2
+
+
+def test_oversized_message_is_truncated_to_the_step_budget(app, database, user, summaries):
+    add_messages(database, user, ['tile ' * (4 * SUMMARY_INPUT_TOKENS), 'short question', 'short answer'])
+
+    ConversationSummarizer(app)._summarize(user.id)
+
+    (_, messages), = summaries
+    assert message_tokens(messages[0]) <= SUMMARY_INPUT_TOKENS
+
+
+def test_history_within_budget_is_left_alone(app, database, user, summaries):
+    add_messages(database, user, ['hello', 'hi, how can I help?'])
+
+    ConversationSummarizer(app)._summarize(user.id)
+
+    assert summaries == []
+    assert database.session.get(ConversationSummary, user.id) is None
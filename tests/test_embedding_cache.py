@@ -0,0 +1,39 @@
+import pytest
+
+from utils.embedding_cache import EVICTION_SLACK, EmbeddingCache
+
+
+def vectors(start, stop):
+    return [(f"key-{i}", [float(i)] * 4) for i in range(start, stop)]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(path=str(tmp_path / 'embeddings.sqlite3'), max_entries=100)
+
+
+def test_eviction_drops_the_least_recently_used(cache):
+    cache.put_many(vectors(0, 60))
+    cache.get_many([f"key-{i}" for i in range(10)])
+    cache.put_many(vectors(60, 120))
+
+    assert len(cache) == int(100 * (1 - EVICTION_SLACK))
+    kept = cache.get_many([key for key, _ in vectors(0, 120)])
+    # Evicted from the first batch, apart from the keys read since
+    assert {f"key-{i}" for i in range(10)} | {key for key, _ in vectors(60, 120)} <= set(kept)
+    assert kept['key-119'] == [119.0] * 4
+
+
+def test_table_is_only_counted_near_the_limit(cache, monkeypatch):
+    counts = []
+    count = EmbeddingCache._count
+    monkeypatch.setattr(EmbeddingCache, '_count', staticmethod(lambda conn: counts.append(1) or count(conn)))
+
+    for start in range(0, 100, 10):
+        cache.put_many(vectors(start, start + 10))
+    # Once when the process first writes, not once per batch
+    assert len(counts) == 1
+
+    cache.put_many(vectors(100, 110))
+    assert len(counts) == 2
+    assert len(cache) <= 100
@@ -0,0 +1,102 @@
+import json
+import os
+import time
+
+import pytest
+
+from utils.index_store import CURRENT_FILE, MANIFEST_SUFFIX, UNPUBLISHED_MAX_AGE
+
+USER_ID = 1
+
+
+def document(topic):
+    return f"{topic.title()} brochure.\n\nThe {topic} range ships in three finishes and two sizes."
+
+
+def user_dir(text_processor):
+    return text_processor.index_store._user_dir(USER_ID)
+
+
+def manifests(text_processor):
+    return sorted(entry[:-len(MANIFEST_SUFFIX)] for entry in os.listdir(user_dir(text_processor))
+                  if entry.endswith(MANIFEST_SUFFIX))
+
+
+def segment_dirs(text_processor):
+    directory = user_dir(text_processor)
+    return {entry for entry in os.listdir(directory) if os.path.isdir(os.path.join(directory, entry))}
+
+
+def referenced_segments(text_processor, versions):
+    segments = set()
+    for version in versions:
+        with open(os.path.join(user_dir(text_processor), version + MANIFEST_SUFFIX)) as f:
+            segments.update(json.load(f)['segments'])
+    return segments
+
+
+def test_commit_keeps_only_the_current_and_previous_versions(text_processor):
+    versions = []
+    for file_id, topic in enumerate(['marble', 'granite', 'slate', 'oak', 'walnut', 'cork']):
+        text_processor.process_document(document(topic), USER_ID, file_id)
+        versions.append(text_processor.index_store.current_version(USER_ID))
+        kept = manifests(text_processor)
+        assert versions[-1] in kept
+        assert len(kept) <= 2
+        assert segment_dirs(text_processor) == referenced_segments(text_processor, kept)
+
+    with open(os.path.join(user_dir(text_processor), CURRENT_FILE)) as f:
+        assert f.read() == versions[-1]
+
+
+def test_snapshot_is_unaffected_by_later_commits(text_processor):
+    text_processor.process_document(document('marble'), USER_ID, 1)
+    text_processor.process_document(document('granite'), USER_ID, 2)
+    snapshot = text_processor.index_store.snapshot(USER_ID)
+    marble_ids = snapshot.doc_ids([1])
+    total = snapshot.ntotal
+
+    text_processor.remove_document(USER_ID, 1)
+    for file_id, topic in enumerate(['slate', 'oak', 'walnut', 'cork'], start=3):
+        text_processor.process_document(document(topic), USER_ID, file_id)
+    text_processor.rebuild_index(USER_ID)
+
+    # Everything the old snapshot listed is gone from disk by now
+    assert not {segment.id for segment in snapshot.segments} & segment_dirs(text_processor)
+    assert set(snapshot.files()) == {1, 2}
+    assert snapshot.ntotal == total
+    for doc_id in marble_ids:
+        assert 'Marble' in snapshot.document(doc_id).page_content
+    assert snapshot.vectors(sorted(marble_ids)).shape[0] == len(marble_ids)
+
+    current = text_processor.index_store.snapshot(USER_ID)
+    assert current.version != snapshot.version
+    assert set(current.files()) == {2, 3, 4, 5, 6}
+    assert not current.doc_ids([1])
+
+
+def test_deleted_file_is_hidden_before_it_is_merged_away(text_processor):
+    text_processor.process_document(document('marble'), USER_ID, 1)
+    text_processor.process_document(document('granite'), USER_ID, 2)
+
+    text_processor.remove_document(USER_ID, 1)
+
+    snapshot = text_processor.index_store.snapshot(USER_ID)
+    assert any(1 in segment.file_map for segment in snapshot.segments)
+    assert set(snapshot.files()) == {2}
+    assert snapshot.ntotal == len(snapshot.doc_ids([2]))
+    results = text_processor.retrieve('marble finishes', USER_ID, k=5, mode='lexical')
+    assert results
+    assert {result.metadata['file_id'] for result in results} == {2}
+
+
+@pytest.mark.parametrize('age, kept', [(0, True), (UNPUBLISHED_MAX_AGE + 60, False)])
+def test_unpublished_segments_are_pruned_once_abandoned(text_processor, age, kept):
+    text_processor.process_document(document('marble'), USER_ID, 1)
+    unpublished = os.path.join(user_dir(text_processor), 'crashed-writer.tmp')
+    os.makedirs(unpublished)
+    os.utime(unpublished, (time.time() - age, time.time() - age))
+
+    text_processor.process_document(document('granite'), USER_ID, 2)
+
+    assert os.path.isdir(unpublished) == kept
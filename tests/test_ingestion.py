@@ -0,0 +1,128 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import ingestion
+from ingestion import INGESTION_LEASE_SECONDS, STATUS_INDEXING, STATUS_PENDING, STATUS_READY, IngestionQueue
+from models import DocumentChunk, File
+
+EXPIRED = datetime.utcnow() - timedelta(seconds=2 * INGESTION_LEASE_SECONDS)
+
+
+@pytest.fixture
+def queue(app, monkeypatch):
+    """An ingestion queue that records submitted files instead of running them."""
+    queue = IngestionQueue(app, max_workers=1)
+    queue.submitted = []
+    monkeypatch.setattr(queue, 'submit', queue.submitted.append)
+    return queue
+
+
+def add_file(database, user, **columns):
+    file_record = File(filename=f"stored-{columns.get('id', 'x')}.txt", original_filename='notes.txt',
+                       user_id=user.id, **columns)
+    database.session.add(file_record)
+    database.session.commit()
+    return file_record.id
+
+
+def test_claim_takes_a_pending_file_once(database, user, queue):
+    file_id = add_file(database, user)
+
+    assert queue._claim(file_id)
+    assert not queue._claim(file_id)
+
+    file_record = database.session.get(File, file_id)
+    assert file_record.status == STATUS_INDEXING
+    assert file_record.claimed_at is not None
+
+
+def test_claim_skips_files_that_are_not_pending(database, user, queue):
+    file_id = add_file(database, user, status=STATUS_READY, progress=100)
+
+    assert not queue._claim(file_id)
+    assert database.session.get(File, file_id).status == STATUS_READY
+
+
+def test_resume_requeues_pending_files_and_expired_leases(database, user, queue):
+    pending = add_file(database, user)
+    expired = add_file(database, user, status=STATUS_INDEXING, progress=10, claimed_at=EXPIRED)
+    # A batch file embedded in a worker that died before the batch commit
+    prepared = add_file(database, user, status=STATUS_INDEXING, progress=90, claimed_at=EXPIRED, batch_id='b')
+    unleased = add_file(database, user, status=STATUS_INDEXING, progress=10)
+    running = add_file(database, user, status=STATUS_INDEXING, progress=10, claimed_at=datetime.utcnow())
+    ready = add_file(database, user, status=STATUS_READY, progress=100, claimed_at=EXPIRED)
+
+    queue.resume_pending()
+
+    assert sorted(queue.submitted) == sorted([pending, expired, prepared, unleased])
+    database.session.expire_all()
+    for file_id in (expired, prepared, unleased):
+        file_record = database.session.get(File, file_id)
+        assert (file_record.status, file_record.progress, file_record.claimed_at) == (STATUS_PENDING, 0, None)
+    assert database.session.get(File, running).status == STATUS_INDEXING
+    assert database.session.get(File, ready).status == STATUS_READY
+
+
+def test_sweep_leaves_recently_queued_files_alone(database, user, queue):
+    recent = add_file(database, user)
+    stale = add_file(database, user, uploaded_at=EXPIRED)
+    expired = add_file(database, user, status=STATUS_INDEXING, claimed_at=EXPIRED)
+
+    queue.resume_pending(stale_only=True)
+
+    assert sorted(queue.submitted) == sorted([stale, expired])
+    assert recent not in queue.submitted
+
+
+def test_renew_extends_the_lease_of_prepared_files(database, user, queue):
+    file_id = add_file(database, user, status=STATUS_INDEXING, progress=90, claimed_at=EXPIRED)
+
+    queue._renew([file_id])
+    queue.resume_pending()
+
+    assert queue.submitted == []
+    database.session.expire_all()
+    assert database.session.get(File, file_id).claimed_at > EXPIRED
+
+
+def test_ingest_stores_chunks_and_marks_the_file_ready(database, user, app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    (tmp_path / 'stored.txt').write_text('Tile LIK-4821B is in stock.', encoding='utf-8')
+    file_record = File(filename='stored.txt', original_filename='stock.txt', user_id=user.id)
+    database.session.add(file_record)
+    database.session.commit()
+    indexed = []
+
+    def process_document(content, user_id, file_id):
+        indexed.append((content, user_id, file_id))
+        return [{'ordinal': 0, 'page': None, 'text': content, 'token_count': 7, 'vector_id': f"{file_id}-0"}]
+
+    monkeypatch.setattr(ingestion, 'process_document', process_document)
+    queue = IngestionQueue(app, max_workers=1)
+    queue._ingest(file_record.id)
+    # Already claimed, so a second job for the same file does nothing
+    queue._ingest(file_record.id)
+
+    assert indexed == [('Tile LIK-4821B is in stock.', user.id, file_record.id)]
+    database.session.expire_all()
+    file_record = database.session.get(File, file_record.id)
+    assert (file_record.status, file_record.progress, file_record.error) == (STATUS_READY, 100, None)
+    assert [chunk.vector_id for chunk in DocumentChunk.query.filter_by(file_id=file_record.id)] == [
+        f"{file_record.id}-0"]
+
+
+def test_importing_the_app_starts_no_jobs(app):
+    assert 'ingestion-leases' not in {thread.name for thread in threading.enumerate()}
+
+
+def test_start_resumes_pending_files_and_sweeps_leases(database, user, queue, monkeypatch):
+    pending = add_file(database, user)
+    sweepers = []
+    monkeypatch.setattr(queue, 'start_lease_sweeper', lambda: sweepers.append(queue))
+
+    queue.start()
+
+    assert queue.submitted == [pending]
+    assert sweepers == [queue]
@@ -0,0 +1,70 @@
+import pytest
+
+from utils.keyword_index import KeywordIndex, reciprocal_rank_fusion, search_indexes, tokenize
+
+
+def test_rrf_scores_each_id_by_its_ranks_across_lists():
+    fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'a']], k=60, with_scores=True)
+
+    scores = dict(fused)
+    assert scores['a'] == pytest.approx(1 / 61 + 1 / 62)
+    assert scores['b'] == pytest.approx(1 / 62)
+    assert scores['c'] == pytest.approx(1 / 63 + 1 / 61)
+    assert [doc_id for doc_id, _ in fused] == ['a', 'c', 'b']
+
+
+@pytest.mark.parametrize('k', [1, 60])
+def test_rrf_prefers_agreement_over_a_single_top_rank(k):
+    fused = reciprocal_rank_fusion([['only-dense', 'both'], ['only-lexical', 'both']], k=k)
+
+    assert fused[0] == 'both'
+
+
+def test_rrf_breaks_ties_by_first_appearance():
+    # Lexical results go first, so an exact term match wins a tie
+    assert reciprocal_rank_fusion([['lexical'], ['dense']]) == ['lexical', 'dense']
+
+
+def test_rrf_of_nothing_is_empty():
+    assert reciprocal_rank_fusion([]) == []
+    assert reciprocal_rank_fusion([[], []], with_scores=True) == []
+
+
+def test_tokenize_keeps_product_codes_whole_and_in_parts():
+    assert tokenize('Order LIK-4821B today') == ['order', 'lik-4821b', 'lik', '4821b', 'today']
+
+
+def test_bm25_ranks_the_exact_code_match_first():
+    index = KeywordIndex()
+    index.add('tile', 'Porcelain tile LIK-4821B in matt grey')
+    index.add('other', 'Porcelain tile LIK-4822 in gloss white')
+    index.add('adhesive', 'Tile adhesive for porcelain floors')
+
+    results = index.search('LIK-4821B', k=3)
+
+    assert results[0][0] == 'tile'
+    assert 'adhesive' not in dict(results)
+
+
+def test_search_indexes_scores_segments_as_one_corpus():
+    whole = KeywordIndex()
+    first, second = KeywordIndex(), KeywordIndex()
+    texts = {'a': 'marble floor tiles', 'b': 'granite wall tiles', 'c': 'marble wall panels', 'd': 'oak floor'}
+    for doc_id, text in texts.items():
+        whole.add(doc_id, text)
+        (first if doc_id in 'ab' else second).add(doc_id, text)
+
+    split = search_indexes([(first, ()), (second, ())], 'marble wall', k=4)
+
+    assert split == pytest.approx(whole.search('marble wall', k=4))
+
+
+def test_search_indexes_skips_excluded_and_disallowed_documents():
+    first, second = KeywordIndex(), KeywordIndex()
+    first.add('a', 'marble floor')
+    first.add('b', 'marble wall')
+    second.add('c', 'marble panel')
+
+    results = search_indexes([(first, {'a'}), (second, ())], 'marble', k=5, allowed={'a', 'c'})
+
+    assert [doc_id for doc_id, _ in results] == ['c']
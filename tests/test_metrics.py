@@ -0,0 +1,39 @@
+import sys
+
+import pytest
+
+from utils.metrics import cache_stats
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_metrics_are_not_served_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(sys.modules['app'], 'METRICS_TOKEN', None)
+
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 404
+
+
+@pytest.mark.parametrize('authorization, status', [
+    (None, 401),
+    ('Bearer wrong', 401),
+    ('secret', 401),
+    ('Bearer secret', 200),
+])
+def test_metrics_require_the_bearer_token(client, monkeypatch, authorization, status):
+    monkeypatch.setattr(sys.modules['app'], 'METRICS_TOKEN', 'secret')
+    headers = {'Authorization': authorization} if authorization else {}
+
+    response = client.get('/metrics', headers=headers)
+
+    assert response.status_code == status
+    if status == 200:
+        assert b'kb_stage_duration_seconds' in response.data
+
+
+def test_cache_stats():
+    assert cache_stats(3, 1, entries=2) == {'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'entries': 2}
+    assert cache_stats(0, 0)['hit_rate'] == 0.0
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+import requests
+
+from utils.oidc import ProviderConfigCache
+
+CONFIG = {'authorization_endpoint': 'https://provider.example/auth'}
+
+
+class Response:
+    headers = {'Cache-Control': 'max-age=3600'}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return dict(CONFIG)
+
+
+class SlowProvider:
+    """A session whose discovery requests wait for `release`, or fail once `down` is set."""
+
+    def __init__(self):
+        self.requests = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.down = False
+
+    def get(self, url, timeout):
+        self.requests += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.down:
+            raise requests.ConnectionError('provider unreachable')
+        return Response()
+
+
+def in_threads(function, count):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(function())) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_first_fetch_is_shared_by_concurrent_callers():
+    provider = SlowProvider()
+    cache = ProviderConfigCache('https://provider.example/discovery', session=provider)
+
+    threads, results = in_threads(cache.get, 4)
+    provider.started.wait(5)
+    provider.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == [CONFIG] * 4
+    assert provider.requests == 1
+
+
+def test_stale_copy_is_served_while_refreshing_and_when_it_fails(monkeypatch):
+    provider = SlowProvider()
+    cache = ProviderConfigCache('https://provider.example/discovery', session=provider)
+    provider.release.set()
+    stale = cache.get()
+    monkeypatch.setattr(cache, '_expires_at', 0.0)
+    provider.release.clear()
+    provider.started.clear()
+    provider.down = True
+
+    threads, results = in_threads(cache.get, 1)
+    provider.started.wait(5)
+    # The lock is free during the fetch, and the old document still answers
+    assert cache.get() is stale
+    provider.release.set()
+    threads[0].join(5)
+
+    assert results == [stale]
+    assert provider.requests == 2
+
+
+def test_first_fetch_failure_is_raised():
+    provider = SlowProvider()
+    provider.down = True
+    provider.release.set()
+    cache = ProviderConfigCache('https://provider.example/discovery', session=provider)
+
+    with pytest.raises(requests.ConnectionError):
+        cache.get()
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from utils import openai_helper
+from utils.response_cache import ResponseCache
+
+USER_ID = 1
+QUESTION = 'what is the warranty period of the marble tiles'
+
+
+@pytest.fixture
+def helper(monkeypatch, text_processor):
+    """openai_helper running on the test's text processor with an empty response cache."""
+    monkeypatch.setattr(openai_helper, '_services', {'client': None, 'text_processor': text_processor})
+    monkeypatch.setattr(openai_helper, 'response_cache', ResponseCache(threshold=0.95))
+    openai_helper.process_document('Marble tiles carry a ten year warranty.', USER_ID, 1)
+    return openai_helper
+
+
+def answer_question(helper):
+    cached, query_vector, index_version = helper.lookup_cached_response(QUESTION, USER_ID)
+    if cached is None:
+        helper.response_cache.store(USER_ID, query_vector, index_version, 'Ten years.')
+    return cached
+
+
+def test_repeated_question_is_answered_from_the_cache(helper):
+    assert answer_question(helper) is None
+    assert answer_question(helper) == 'Ten years.'
+    assert helper.lookup_cached_response(QUESTION.capitalize(), USER_ID)[0] == 'Ten years.'
+
+
+def test_upload_invalidates_cached_answers(helper):
+    answer_question(helper)
+
+    helper.process_document('Granite tiles carry a five year warranty.', USER_ID, 2)
+
+    assert answer_question(helper) is None
+
+
+def test_delete_invalidates_cached_answers(helper):
+    answer_question(helper)
+
+    helper.remove_document(USER_ID, 1)
+
+    assert answer_question(helper) is None
+
+
+def test_answers_from_an_older_index_version_are_dropped():
+    cache = ResponseCache(threshold=0.95)
+    vector = np.ones(8, dtype=np.float32)
+    cache.store(USER_ID, vector, 'v1', 'Ten years.')
+
+    # Another worker committed an upload: this worker only sees the new version
+    assert cache.lookup(USER_ID, vector, 'v2') is None
+    assert cache.lookup(USER_ID, vector, 'v1') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_answers_are_not_shared_between_users():
+    cache = ResponseCache(threshold=0.95)
+    vector = np.ones(8, dtype=np.float32)
+    cache.store(USER_ID, vector, 'v1', 'Ten years.')
+
+    assert cache.lookup(USER_ID + 1, vector, 'v1') is None
+
+
+def test_explicit_zero_settings_are_kept(monkeypatch):
+    monkeypatch.setenv('RESPONSE_CACHE_THRESHOLD', '0.5')
+
+    cache = ResponseCache(threshold=0, ttl=0, max_entries=0)
+
+    assert (cache.threshold, cache.ttl, cache.max_entries) == (0.0, 0.0, 0)
+    assert ResponseCache().threshold == 0.5
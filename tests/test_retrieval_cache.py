@@ -0,0 +1,63 @@
+import pytest
+
+USER_ID = 1
+QUERY = 'marble tiles warranty'
+
+
+@pytest.fixture
+def searches(monkeypatch, text_processor):
+    """Count the searches that actually run, as opposed to cache hits."""
+    calls = []
+    search = text_processor._search
+
+    def counted(*args):
+        calls.append(args[1])
+        return search(*args)
+
+    monkeypatch.setattr(text_processor, '_search', counted)
+    return calls
+
+
+def file_ids(documents):
+    return {document.metadata['file_id'] for document in documents}
+
+
+def test_repeated_query_is_served_from_the_cache(text_processor, searches):
+    text_processor.process_document('Marble tiles carry a ten year warranty.', USER_ID, 1)
+
+    first = text_processor.retrieve(QUERY, USER_ID)
+    second = text_processor.retrieve('  Marble tiles WARRANTY ', USER_ID)
+
+    assert len(searches) == 1
+    assert [doc.page_content for doc in second] == [doc.page_content for doc in first]
+    assert text_processor.retrieval_cache.stats()['hits'] == 1
+
+
+def test_upload_makes_new_chunks_retrievable(text_processor, searches):
+    text_processor.process_document('Marble tiles carry a ten year warranty.', USER_ID, 1)
+    assert file_ids(text_processor.retrieve(QUERY, USER_ID, k=5)) == {1}
+
+    text_processor.process_document('Marble tiles: the warranty covers cracking.', USER_ID, 2)
+
+    assert file_ids(text_processor.retrieve(QUERY, USER_ID, k=5)) == {1, 2}
+    assert len(searches) == 2
+
+
+def test_delete_removes_chunks_from_cached_queries(text_processor, searches):
+    text_processor.process_document('Marble tiles carry a ten year warranty.', USER_ID, 1)
+    text_processor.process_document('Marble tiles: the warranty covers cracking.', USER_ID, 2)
+    assert file_ids(text_processor.retrieve(QUERY, USER_ID, k=5)) == {1, 2}
+
+    text_processor.remove_document(USER_ID, 1)
+
+    assert file_ids(text_processor.retrieve(QUERY, USER_ID, k=5)) == {2}
+    assert len(searches) == 2
+
+
+def test_cached_results_are_per_user(text_processor, searches):
+    text_processor.process_document('Marble tiles carry a ten year warranty.', USER_ID, 1)
+    text_processor.process_document('Marble tiles are out of stock.', USER_ID + 1, 2)
+
+    assert file_ids(text_processor.retrieve(QUERY, USER_ID)) == {1}
+    assert file_ids(text_processor.retrieve(QUERY, USER_ID + 1)) == {2}
+    assert len(searches) == 2
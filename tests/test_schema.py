@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+from flask import Flask
+from sqlalchemy import inspect
+
+import models  # noqa: F401  (registers the tables on db.metadata)
+from extensions import db
+from schema import upgrade_schema
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tables as created before ingestion jobs and chat history pagination
+OLD_SCHEMA = """
+CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(64) NOT NULL UNIQUE,
+                   email VARCHAR(120) NOT NULL UNIQUE, created_at DATETIME);
+CREATE TABLE chat_message (id INTEGER PRIMARY KEY, role VARCHAR(20) NOT NULL, content TEXT NOT NULL,
+                           timestamp DATETIME, user_id INTEGER REFERENCES user (id));
+CREATE TABLE file (id INTEGER PRIMARY KEY, filename VARCHAR(255) NOT NULL,
+                   original_filename VARCHAR(255) NOT NULL, uploaded_at DATETIME,
+                   user_id INTEGER NOT NULL REFERENCES user (id));
+INSERT INTO user (id, username, email) VALUES (1, 'tester', 'tester@example.com');
+INSERT INTO file (id, filename, original_filename, user_id) VALUES (1, 'stored.txt', 'notes.txt', 1);
+"""
+
+
+@pytest.fixture
+def old_database(tmp_path):
+    path = tmp_path / 'old.db'
+    with sqlite3.connect(path) as connection:
+        connection.executescript(OLD_SCHEMA)
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield path
+        db.engine.dispose()
+
+
+def test_upgrade_adds_missing_columns_and_indexes(old_database):
+    upgrade_schema()
+    # A second run, e.g. by another worker, finds nothing to do
+    upgrade_schema()
+
+    inspector = inspect(db.engine)
+    columns = {column['name'] for column in inspector.get_columns('file')}
+    assert {'job_id', 'batch_id', 'status', 'progress', 'error', 'claimed_at'} <= columns
+    indexes = {index['name'] for table in ('file', 'chat_message') for index in inspector.get_indexes(table)}
+    assert {'ix_file_job_id', 'ix_file_batch_id', 'ix_chat_message_user_id_timestamp'} <= indexes
+
+
+def test_existing_files_are_backfilled_as_ready(old_database):
+    upgrade_schema()
+
+    with sqlite3.connect(old_database) as connection:
+        assert connection.execute('SELECT status, progress, error FROM file').fetchall() == [('ready', 100, None)]
+
+
+# Builds the schema of a fresh database from its own process, starting at
+# the same moment as its sibling, like two gunicorn workers booting
+STARTUP = """
+import sys, time
+from flask import Flask
+import models  # noqa: F401  (registers the tables on db.metadata)
+from extensions import db
+import models
+from schema import create_schema
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = sys.argv[1]
+db.init_app(app)
+with app.app_context():
+    time.sleep(max(0.0, float(sys.argv[2]) - time.time()))
+    create_schema()
+"""
+
+
+@pytest.mark.parametrize('attempt', range(5))
+def test_concurrent_first_startups_share_one_fresh_database(tmp_path, attempt):
+    url = f"sqlite:///{tmp_path / 'fresh.db'}"
+    start_at = str(time.time() + 2)
+    startups = [subprocess.Popen([sys.executable, '-c', STARTUP, url, start_at], cwd=REPO_ROOT,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                for _ in range(2)]
+    outputs = [startup.communicate(timeout=60)[0].decode() for startup in startups]
+
+    assert [startup.returncode for startup in startups] == [0, 0], outputs
+    with sqlite3.connect(tmp_path / 'fresh.db') as connection:
+        tables = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert tables == set(db.metadata.tables)
@@ -0,0 +1,81 @@
+import pytest
+
+from benchmarks.synthetic import synthetic_text
+from utils.text_splitter import StructuredSplitter
+from utils.tokens import count_tokens
+
+TABLE = "\n".join(f"LIK-{code}   Porcelain   60x60   {code % 7 + 20}.50" for code in range(4800, 4806))
+
+
+def paragraph(words, seed=0):
+    return ' '.join(f"word{(seed * 31 + i) % 97}" for i in range(words)) + '.'
+
+
+@pytest.mark.parametrize('chunk_tokens', [32, 64, 256])
+def test_chunks_fit_the_token_budget(chunk_tokens):
+    splitter = StructuredSplitter(chunk_tokens=chunk_tokens, overlap_tokens=8, min_tokens=16)
+    text = synthetic_text(3000, seed=1)
+
+    offsets = splitter.split_offsets(text)
+
+    assert len(offsets) > 1
+    for start, end, tokens in offsets:
+        assert tokens <= chunk_tokens
+        assert count_tokens(text[start:end]) <= chunk_tokens
+
+
+def test_text_without_spaces_is_still_cut_to_budget():
+    splitter = StructuredSplitter(chunk_tokens=32, overlap_tokens=0)
+
+    chunks = splitter.split_text('x' * 2000)
+
+    assert ''.join(chunks) == 'x' * 2000
+    assert all(count_tokens(chunk) <= 32 for chunk in chunks)
+
+
+def test_heading_opens_a_new_chunk_once_the_current_one_is_big_enough():
+    splitter = StructuredSplitter(chunk_tokens=200, overlap_tokens=0, min_tokens=20)
+    text = f"# Floors\n{paragraph(60)}\n\n# Walls\n{paragraph(60, seed=1)}\n"
+
+    chunks = splitter.split_text(text)
+
+    assert [chunk.splitlines()[0] for chunk in chunks] == ['# Floors', '# Walls']
+
+
+def test_small_sections_share_a_chunk():
+    splitter = StructuredSplitter(chunk_tokens=200, overlap_tokens=0, min_tokens=64)
+    text = f"# Floors\n{paragraph(5)}\n\n# Walls\n{paragraph(5, seed=1)}\n"
+
+    assert len(splitter.split_text(text)) == 1
+
+
+def test_table_that_fits_stays_whole():
+    splitter = StructuredSplitter(chunk_tokens=128, overlap_tokens=0, min_tokens=16)
+    text = f"{paragraph(90)}\n\n{TABLE}\n\n{paragraph(90, seed=1)}"
+
+    chunks = splitter.split_text(text)
+
+    assert sum(TABLE in chunk for chunk in chunks) == 1
+
+
+def test_overlap_only_where_a_paragraph_is_cut():
+    splitter = StructuredSplitter(chunk_tokens=64, overlap_tokens=16, min_tokens=16)
+    sentences = [f"Sentence {i} about tile number {i}." for i in range(40)]
+    long_paragraph = ' '.join(sentences)
+
+    cut = splitter.split_text(long_paragraph)
+    whole = splitter.split_text(f"# One\n{paragraph(20)}\n\n# Two\n{paragraph(20, seed=1)}")
+
+    assert len(cut) > 1
+    for previous, chunk in zip(cut, cut[1:]):
+        assert chunk.split('.')[0] + '.' in previous
+    assert len(whole) == 2
+    assert not set(whole[0].split()) & set(whole[1].split()) - {'#'}
+
+
+def test_pages_are_never_joined():
+    splitter = StructuredSplitter(chunk_tokens=256)
+
+    chunks = list(splitter.split_pages([(1, paragraph(10)), (2, paragraph(10, seed=1))]))
+
+    assert [page for page, _, _ in chunks] == [1, 2]
@@ -0,0 +1,125 @@
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from flask_login.utils import _create_identifier
+from sqlalchemy import event
+
+from models import User
+
+
+@pytest.fixture
+def cache(app, monkeypatch):
+    """The app's user cache, emptied, so nothing is left from other tests."""
+    from user_cache import user_cache
+    monkeypatch.setattr(user_cache, '_entries', OrderedDict())
+    return user_cache
+
+
+@pytest.fixture
+def client(app, user):
+    """A client logged in as user under 'strong' session protection."""
+    client = app.test_client()
+    # The session cookie is Secure, so it is only sent over https
+    client.environ_base['wsgi.url_scheme'] = 'https'
+    with app.test_request_context(environ_base=client.environ_base):
+        identifier = _create_identifier()
+    with client.session_transaction() as session:
+        session.update({'_user_id': str(user.id), '_fresh': True, '_id': identifier})
+    return client
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def get(app, client, path):
+    # A fresh app context per request, as under a server; requests made
+    # inside the test's own context would share its flask.g
+    with app.app_context(), count_statements(app.extensions['sqlalchemy'].engine) as statements:
+        response = client.get(path)
+    assert response.status_code == 200
+    return statements
+
+
+@pytest.mark.parametrize('path', ['/files', '/history'])
+def test_cached_user_saves_a_query_per_request(app, database, cache, client, path):
+    cold = get(app, client, path)
+    warm = get(app, client, path)
+
+    assert len(warm) == len(cold) - 1
+    assert any('FROM user' in statement for statement in cold)
+    assert not any('FROM user' in statement for statement in warm)
+
+
+def test_disabled_cache_queries_the_user_every_request(app, database, cache, client, monkeypatch):
+    monkeypatch.setattr(cache, 'ttl', 0)
+
+    cold = get(app, client, '/files')
+    again = get(app, client, '/files')
+
+    assert len(again) == len(cold)
+    assert not cache._entries
+
+
+def test_entries_expire_after_the_ttl(database, user, cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sys.modules['user_cache'], 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    monkeypatch.setattr(cache, 'ttl', 60)
+    hits, misses = cache.hits, cache.misses
+
+    cache.get(user.id)
+    now[0] += 59
+    cache.get(user.id)
+    now[0] += 2
+    cache.get(user.id)
+
+    assert (cache.hits - hits, cache.misses - misses) == (1, 2)
+
+
+def test_update_drops_the_cached_user(database, user, cache):
+    cache.get(user.id)
+    assert user.id in cache._entries
+
+    user.username = 'renamed'
+    database.session.commit()
+
+    assert user.id not in cache._entries
+    assert cache.get(user.id).username == 'renamed'
+
+
+def test_delete_drops_the_cached_user(database, user, cache):
+    cache.get(user.id)
+
+    database.session.delete(user)
+    database.session.commit()
+
+    assert user.id not in cache._entries
+    assert cache.get(user.id) is None
+
+
+def test_user_is_memoised_per_request(app, database, user, cache):
+    cache.get(user.id)
+    hits = cache.hits
+
+    with app.app_context(), app.test_request_context():
+        first = cache.get(user.id)
+        assert cache.get(user.id) is first
+    with app.app_context(), app.test_request_context():
+        second = cache.get(user.id)
+
+    assert cache.hits - hits == 2
+    assert second is not first
+    assert isinstance(second, User) and second.username == first.username
@@ -0,0 +1,116 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from flask import g, has_request_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from extensions import db
+from models import User
+from utils.metrics import cache_stats, count_cache_lookups
+
+logger = logging.getLogger(__name__)
+
+
+class UserCache:
+    """
+    Per-process cache of users by id, behind Flask-Login's user loader.
+
+    Every authenticated request resolves its user from the session cookie,
+    which would otherwise cost a database round-trip per request. Column
+    values are kept for `ttl` seconds (0 disables the cache) and the least
+    recently used are evicted above `max_entries`. A user updated or deleted
+    through the ORM is dropped from this process's cache when the session
+    commits; other workers pick the change up once their entry expires.
+    Bulk query.update() calls bypass the ORM events and only expire.
+
+    Each request gets its own detached User built from the cached values,
+    memoised in flask.g, so no instance is shared between requests.
+    """
+
+    def __init__(self, app=None, ttl=None, max_entries=None):
+        self.ttl = float(os.environ.get('USER_CACHE_TTL', 60) if ttl is None else ttl)
+        self.max_entries = int(max_entries or os.environ.get('USER_CACHE_MAX_ENTRIES', 10000))
+        self._entries = OrderedDict()  # user_id -> (expires_at, column values), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        event.listen(User, 'after_update', self._changed)
+        event.listen(User, 'after_delete', self._changed)
+        event.listen(Session, 'after_commit', self._committed)
+        event.listen(Session, 'after_rollback', self._rolled_back)
+
+    def get(self, user_id):
+        """Return the User with this id, or None."""
+        if not has_request_context():
+            return self._get(user_id)
+        users = g.setdefault('_users', {})
+        if user_id not in users:
+            users[user_id] = self._get(user_id)
+        return users[user_id]
+
+    def _get(self, user_id):
+        values = self._lookup(user_id)
+        if values is None:
+            logger.debug("Loading user %s from the database", user_id)
+            user = db.session.get(User, user_id)
+            if user is None or self.ttl <= 0:
+                return user
+            values = {column.key: getattr(user, column.key) for column in inspect(User).column_attrs}
+            self._store(user_id, values)
+            return user
+        user = User(**values)
+        make_transient_to_detached(user)
+        return user
+
+    def _lookup(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                count_cache_lookups('user', 1, 0)
+                return entry[1]
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            count_cache_lookups('user', 0, 1)
+            return None
+
+    def _store(self, user_id, values):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Forget a cached user."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def _changed(self, mapper, connection, user):
+        # Dropped now and again on commit, so a request that reloads the
+        # old row before the commit cannot keep it cached
+        self.invalidate(user.id)
+        session = inspect(user).session
+        if session is not None:
+            session.info.setdefault('changed_users', set()).add(user.id)
+
+    def _committed(self, session):
+        for user_id in session.info.pop('changed_users', ()):
+            self.invalidate(user_id)
+
+    def _rolled_back(self, session):
+        session.info.pop('changed_users', None)
+
+    def stats(self):
+        with self._lock:
+            return cache_stats(self.hits, self.misses, entries=len(self._entries))
+
+
+user_cache = UserCache()
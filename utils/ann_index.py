@@ -0,0 +1,171 @@
+import logging
+import math
+import os
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ('flat', 'ivfpq', 'hnsw')
+
+# 'flat' always searches exactly; 'ivfpq' or 'hnsw' build that ANN index for every
+# index segment of at least INDEX_ANN_MIN_VECTORS chunks; 'auto' keeps segments flat
+# until they reach INDEX_PROMOTION_THRESHOLD chunks and then promotes to INDEX_ANN_TYPE.
+INDEX_TYPE = os.environ.get('INDEX_TYPE', 'auto')
+INDEX_ANN_TYPE = os.environ.get('INDEX_ANN_TYPE', 'hnsw')
+INDEX_PROMOTION_THRESHOLD = int(os.environ.get('INDEX_PROMOTION_THRESHOLD', 20000))
+# Smaller segments are searched exactly whatever the type: that is already fast,
+# and IVF-PQ cannot train its 256-entry codebooks on fewer points
+INDEX_ANN_MIN_VECTORS = int(os.environ.get('INDEX_ANN_MIN_VECTORS', 1000))
+
+# HNSW vector storage: 'fp16' halves memory with negligible recall loss, 'pq' compresses further
+INDEX_HNSW_STORAGE = os.environ.get('INDEX_HNSW_STORAGE', 'fp16')
+INDEX_HNSW_M = int(os.environ.get('INDEX_HNSW_M', 32))
+INDEX_EF_SEARCH = int(os.environ.get('INDEX_EF_SEARCH', 64))
+INDEX_NPROBE = int(os.environ.get('INDEX_NPROBE', 16))
+
+# A filtered search that keeps at most this many chunks is answered exactly from
+# the flat index; wider filters search the ANN index with the filter applied
+INDEX_FILTER_EXACT_MAX = int(os.environ.get('INDEX_FILTER_EXACT_MAX', 20000))
+# Up to this many, the selected vectors are copied out and searched directly
+# instead of scanning the whole flat index past everything the filter rejects
+INDEX_FILTER_GATHER_MAX = int(os.environ.get('INDEX_FILTER_GATHER_MAX', 4096))
+# Narrow filters leave fewer matches per probed list / graph neighbourhood, so
+# nprobe and efSearch grow with the filter's selectivity, up to this factor
+INDEX_FILTER_MAX_WIDENING = int(os.environ.get('INDEX_FILTER_MAX_WIDENING', 16))
+
+
+def choose_index_type(num_vectors, index_type=None):
+    """
+    Return the index type to use for a corpus of num_vectors chunks.
+    """
+    index_type = index_type or INDEX_TYPE
+    if index_type == 'auto':
+        return INDEX_ANN_TYPE if num_vectors >= INDEX_PROMOTION_THRESHOLD else 'flat'
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    return index_type if num_vectors >= INDEX_ANN_MIN_VECTORS else 'flat'
+
+
+def _pq_subquantizers(dimensions):
+    # About 8 dimensions per sub-quantizer, and the count must divide the dimensionality
+    target = max(1, dimensions // 8)
+    for m in range(target, 0, -1):
+        if dimensions % m == 0:
+            return m
+    return 1
+
+
+def factory_string(index_type, num_vectors, dimensions):
+    """
+    faiss.index_factory description for an ANN index sized for num_vectors.
+    """
+    if index_type == 'ivfpq':
+        # ~4*sqrt(n) lists, but at least 39 training points per centroid
+        nlist = max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+        return f"IVF{nlist},PQ{_pq_subquantizers(dimensions)}"
+    if index_type == 'hnsw':
+        if INDEX_HNSW_STORAGE == 'pq':
+            return f"HNSW{INDEX_HNSW_M}_PQ{_pq_subquantizers(dimensions)}"
+        if INDEX_HNSW_STORAGE == 'fp16':
+            return f"HNSW{INDEX_HNSW_M}_SQfp16"
+        return f"HNSW{INDEX_HNSW_M}"
+    raise ValueError(f"No ANN factory for index type: {index_type}")
+
+
+def configure_search(index):
+    """
+    Apply query-time parameters (nprobe, efSearch) to a loaded ANN index.
+    """
+    try:
+        faiss.extract_index_ivf(index).nprobe = INDEX_NPROBE
+    except RuntimeError:
+        pass
+    hnsw = getattr(faiss.downcast_index(index), 'hnsw', None)
+    if hnsw is not None:
+        hnsw.efSearch = INDEX_EF_SEARCH
+    return index
+
+
+def build_ann_index(index_type, vectors, metric=faiss.METRIC_L2):
+    """
+    Train and populate an ANN index. Labels are row positions in `vectors`.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dimensions = vectors.shape
+    description = factory_string(index_type, num_vectors, dimensions)
+    logger.info("Building %s index over %s vectors", description, num_vectors)
+
+    index = faiss.index_factory(dimensions, description, metric)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return configure_search(index)
+
+
+def segment_ann_index(vectors, index_type=None, metric=faiss.METRIC_L2):
+    """
+    Build the ANN companion of an index segment from its vectors, labels
+    being positions in the segment's flat index. Segments are immutable, so
+    the index is trained once, on exactly the data it serves. Returns
+    (ann_index, ann_meta), both None while the segment should stay flat.
+    """
+    num_vectors = len(vectors)
+    target = choose_index_type(num_vectors, index_type)
+    if target == 'flat':
+        return None, None
+    return build_ann_index(target, vectors, metric), {'type': target, 'trained_on': num_vectors}
+
+
+def id_selector(mask):
+    """
+    Return (selector, bitmap) admitting the index positions where mask is True.
+    The bitmap backs the selector and must stay referenced while it is in use.
+    """
+    bitmap = np.packbits(mask, bitorder='little')
+    return faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap)), bitmap
+
+
+def search_parameters(index, selector, widening=1):
+    """
+    faiss search parameters applying selector, with the index's nprobe or
+    efSearch multiplied by widening.
+    """
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(ivf.nlist, INDEX_NPROBE * widening))
+    except RuntimeError:
+        pass
+    if getattr(faiss.downcast_index(index), 'hnsw', None) is not None:
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=INDEX_EF_SEARCH * widening)
+    return faiss.SearchParameters(sel=selector)
+
+
+def filtered_search(flat_index, ann_index, query, k, mask):
+    """
+    Search only the vectors whose position is set in the boolean mask and
+    return (distances, labels).
+
+    The filter is applied inside the search, so all k results come from the
+    allowed set. A few selected chunks are searched directly; narrow filters
+    scan the flat index, skipping everything else without computing its
+    distance; wide ones use the ANN index.
+    """
+    selected = int(np.count_nonzero(mask))
+    k = min(k, selected)
+    if k == 0:
+        return np.empty((len(query), 0), dtype=np.float32), np.empty((len(query), 0), dtype=np.int64)
+
+    if selected <= INDEX_FILTER_GATHER_MAX:
+        positions = np.flatnonzero(mask)
+        distances, labels = faiss.knn(query, flat_index.reconstruct_batch(positions), k,
+                                      metric=flat_index.metric_type)
+        return distances, positions[labels]
+
+    selector, bitmap = id_selector(mask)
+    if ann_index is None or selected <= INDEX_FILTER_EXACT_MAX:
+        return flat_index.search(query, k, params=faiss.SearchParameters(sel=selector))
+
+    widening = max(1, min(INDEX_FILTER_MAX_WIDENING, len(mask) // selected))
+    return ann_index.search(query, k, params=search_parameters(ann_index, selector, widening))
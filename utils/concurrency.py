@@ -0,0 +1,89 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# The gevent hub run_blocking hands work off from; set on first use
+_hub = None
+
+
+def gevent_active():
+    """
+    Whether this process has been monkey-patched by gevent (e.g. a gunicorn gevent worker).
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def _native_thread_ident():
+    from gevent import monkey
+    return monkey.get_original('_thread', 'get_ident')()
+
+
+def _off_hub(hub):
+    """Whether the calling thread is one of the hub's native worker threads."""
+    return hub is not None and _native_thread_ident() != hub.thread_ident
+
+
+def run_blocking(function, *args, **kwargs):
+    """
+    Call function without stalling other requests.
+
+    Under gevent, network I/O already yields to other greenlets, but CPU and
+    disk bound work (FAISS searches, writing an index segment) would hold
+    the whole worker, so it runs on gevent's pool of native threads instead.
+    Without gevent, or when already on such a thread, this is a plain call.
+
+    The function must not use anything built on gevent primitives (the
+    OpenAI client, database sessions, greenlet locks): those hang when a
+    native thread waits on them. Metrics and logging are safe, see call_on_hub.
+    """
+    global _hub
+    if not gevent_active() or _off_hub(_hub):
+        return function(*args, **kwargs)
+    import gevent
+    _hub = gevent.get_hub()
+    return _hub.threadpool.apply(function, args, kwargs)
+
+
+def call_on_hub(function, *args):
+    """
+    Call function on the thread running the gevent hub: right away when
+    already there or without gevent, otherwise queued for the hub to run
+    soon, and None is returned.
+
+    For fire-and-forget updates of state guarded by gevent primitives, such
+    as Prometheus samples and the log queue, made from run_blocking threads.
+    """
+    hub = _hub
+    if not _off_hub(hub):
+        return function(*args)
+    hub.loop.run_callback_threadsafe(function, *args)
+    return None
+
+
+def native_lock():
+    """
+    A lock that can be shared by greenlets and run_blocking threads.
+
+    Under gevent, threading.Lock is a greenlet lock that can hang when it is
+    contended across native threads. An OS lock never yields to other
+    greenlets, so it must only guard short sections that do no I/O and call
+    nothing that could switch greenlets, or the waiting greenlet would block
+    the one holding it.
+    """
+    if gevent_active():
+        from gevent import monkey
+        return monkey.get_original('_thread', 'allocate_lock')()
+    return threading.Lock()
+
+
+def native_rlock():
+    """Re-entrant variant of native_lock()."""
+    if gevent_active():
+        from gevent import monkey
+        return monkey.get_original('_thread', 'RLock')()
+    return threading.RLock()
@@ -0,0 +1,220 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.concurrency import native_lock, run_blocking
+from utils.metrics import cache_stats, count_cache_lookups
+from utils.query_cache import LRUCache, normalize_query
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'embedding_cache.sqlite3'
+)
+DEFAULT_MAX_ENTRIES = 50000
+# Share of max_entries freed by each eviction, so the next one is some inserts away
+EVICTION_SLACK = 0.05
+# Query vectors kept in memory, about 6 KB each at 1536 dimensions
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', 2000))
+
+
+def embedding_key(text, model):
+    """
+    Content address of a chunk: the same text embedded by the same model
+    always maps to the same key.
+    """
+    return hashlib.sha256(f"{model}\0{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed store of float32 embedding vectors with LRU eviction.
+
+    The database is shared by every worker process; each thread keeps its own
+    connection because sqlite3 connections cannot be shared across threads.
+    Queries run through run_blocking so a busy database never stalls the
+    worker's other requests.
+
+    Rather than counting the table on every insert, each process keeps an
+    estimate: the count when it last looked plus the rows it has written
+    since. Only once that passes max_entries is the table counted, and then
+    trimmed EVICTION_SLACK below the limit. Rows written by other workers
+    are not in the estimate, so the table can run past max_entries until
+    one of them notices.
+    """
+
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or os.environ.get('EMBEDDING_CACHE_PATH', DEFAULT_CACHE_PATH)
+        self.max_entries = int(max_entries or os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+        self._local = threading.local()
+        self._estimate = None  # Rows in the table as far as this process knows
+        self._estimate_lock = native_lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, keys):
+        """
+        Return {key: vector} for the keys present in the cache and mark them as recently used.
+        """
+        if not keys:
+            return {}
+        return run_blocking(self._get_many, keys)
+
+    def _get_many(self, keys):
+        conn = self._connection()
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # Stay below SQLite's bound-parameter limit
+        for start in range(0, len(unique_keys), 500):
+            batch = unique_keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+        if found:
+            now = time.time()
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+            conn.commit()
+        return found
+
+    def put_many(self, items):
+        """
+        Store (key, vector) pairs, evicting the least recently used entries above max_entries.
+        """
+        if not items:
+            return
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+        run_blocking(self._put_many, rows)
+
+    def _put_many(self, rows):
+        conn = self._connection()
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, blob, now) for key, blob in rows],
+        )
+        with self._estimate_lock:
+            if self._estimate is not None:
+                self._estimate += len(rows)
+            over_limit = self._estimate is None or self._estimate > self.max_entries
+        if over_limit:
+            count = self._count(conn)
+            overflow = 0
+            if count > self.max_entries:
+                overflow = count - int(self.max_entries * (1 - EVICTION_SLACK))
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+                logger.debug("Evicted %s embeddings from cache", overflow)
+            with self._estimate_lock:
+                self._estimate = count - overflow
+        conn.commit()
+
+    @staticmethod
+    def _count(conn):
+        return conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def __len__(self):
+        return run_blocking(lambda: self._count(self._connection()))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends chunks to the underlying model when
+    their (text, model) pair has not been embedded before.
+
+    Query vectors are kept in a separate in-memory LRU keyed by the
+    normalised query, so a repeated question costs no API round-trip.
+    """
+
+    def __init__(self, embeddings, cache=None, model_name=None, query_cache_size=None):
+        self.embeddings = embeddings
+        self.cache = cache or EmbeddingCache()
+        self.query_cache = LRUCache('query_embedding', QUERY_CACHE_SIZE if query_cache_size is None
+                                    else query_cache_size)
+        self.model_name = model_name or getattr(embeddings, 'model', type(embeddings).__name__)
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        keys = [embedding_key(text, self.model_name) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # Identical chunks within one document are embedded only once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            embed_batches = getattr(self.embeddings, 'embed_batches', None)
+            if embed_batches:
+                # Persist each batch as soon as it lands so an interrupted document
+                # only has to embed the chunks that never made it into the cache
+                def store_batch(batch_texts, batch_vectors):
+                    self.cache.put_many([(embedding_key(text, self.model_name), vector)
+                                         for text, vector in zip(batch_texts, batch_vectors)])
+
+                vectors = embed_batches(list(missing.values()), on_batch=store_batch)
+            else:
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+                self.cache.put_many(list(zip(missing.keys(), vectors)))
+            cached.update(zip(missing.keys(), vectors))
+
+        with self._stats_lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        count_cache_lookups('embedding', len(texts) - len(missing), len(missing))
+        logger.debug("Embedding cache: %s hits, %s misses", len(texts) - len(missing), len(missing))
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        vector = self.query_cache.get(key)
+        if vector is None:
+            # Stored read-only, since every caller of this query shares the array
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            vector.flags.writeable = False
+            self.query_cache.put(key, vector)
+        return vector
+
+    def stats(self):
+        """
+        Return hit/miss counters for this process.
+        """
+        with self._stats_lock:
+            return cache_stats(self.hits, self.misses, entries=len(self.cache), queries=self.query_cache.stats())
@@ -0,0 +1,176 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+from langchain_core.embeddings import Embeddings
+from openai import OpenAI
+from utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'text-embedding-ada-002'
+MAX_INPUTS_PER_REQUEST = 2048  # OpenAI limit on inputs per embeddings request
+MAX_TOKENS_PER_INPUT = 8191
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_SECONDS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_reset_duration(value):
+    """
+    Parse OpenAI rate-limit reset values such as '20ms', '1.5s' or '6m0s' into seconds.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_SECONDS[unit] for amount, unit in parts)
+
+
+def retry_delay_from_headers(headers):
+    """
+    Work out how long to wait after a 429 from the response's rate-limit headers.
+    """
+    if not headers:
+        return None
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        return float(retry_after_ms) / 1000
+    delays = [parse_reset_duration(headers.get(name)) for name in
+              ('retry-after', 'x-ratelimit-reset-tokens', 'x-ratelimit-reset-requests')]
+    delays = [delay for delay in delays if delay is not None]
+    return max(delays) if delays else None
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    Embeds chunks in token-sized batches on a small thread pool.
+
+    Batches are packed up to max_batch_tokens so each request stays well under
+    the API's per-request limits, several batches are in flight at once, and a
+    429 pauses every thread until the reset time advertised in the response
+    headers rather than letting each batch hammer the API independently.
+    """
+
+    def __init__(self, client=None, model=None, max_batch_tokens=None, concurrency=None, max_retries=6):
+        # Retries are handled here, with rate-limit awareness, instead of inside the client
+        self.client = client or OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0, timeout=60.0)
+        self.model = model or os.environ.get('EMBEDDING_MODEL', DEFAULT_MODEL)
+        self.max_batch_tokens = int(max_batch_tokens or os.environ.get('EMBEDDING_BATCH_TOKENS', 20000))
+        self.concurrency = int(concurrency or os.environ.get('EMBEDDING_CONCURRENCY', 4))
+        self.max_retries = max_retries
+
+        self._resume_at = 0.0  # monotonic time before which no request may be sent
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rate_limited = 0
+        self.retries = 0
+
+    def make_batches(self, texts):
+        """
+        Group texts into lists of (position, text) whose token total fits max_batch_tokens.
+        """
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for position, text in enumerate(texts):
+            tokens = min(count_tokens(text, self.model), MAX_TOKENS_PER_INPUT)
+            if batch and (batch_tokens + tokens > self.max_batch_tokens or len(batch) >= MAX_INPUTS_PER_REQUEST):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append((position, text))
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embed_batches(self, texts, on_batch=None):
+        """
+        Embed texts concurrently, calling on_batch(texts, vectors) as each batch completes
+        so callers can persist partial progress. Returns vectors in input order.
+        """
+        if not texts:
+            return []
+        batches = self.make_batches(texts)
+        logger.debug("Embedding %s texts in %s batches with concurrency %s",
+                     len(texts), len(batches), self.concurrency)
+
+        results = [None] * len(texts)
+
+        def run(batch):
+            batch_texts = [text for _, text in batch]
+            vectors = self._embed_with_retry(batch_texts)
+            for (position, _), vector in zip(batch, vectors):
+                results[position] = vector
+            if on_batch:
+                on_batch(batch_texts, vectors)
+
+        if len(batches) == 1 or self.concurrency <= 1:
+            for batch in batches:
+                run(batch)
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+                # list() re-raises the first batch failure
+                list(pool.map(run, batches))
+        return results
+
+    def embed_documents(self, texts):
+        return self.embed_batches(texts)
+
+    def embed_query(self, text):
+        return self._embed_with_retry([text])[0]
+
+    def _wait_for_rate_limit(self):
+        with self._lock:
+            delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _embed_with_retry(self, texts):
+        attempt = 0
+        while True:
+            self._wait_for_rate_limit()
+            try:
+                response = self.client.embeddings.create(model=self.model, input=texts)
+                with self._lock:
+                    self.batches += 1
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+            except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+
+                # Exponential backoff with jitter, stretched to the advertised reset time on 429
+                delay = min(2 ** attempt, 60) * (0.5 + random.random() / 2)
+                if isinstance(e, openai.RateLimitError):
+                    advertised = retry_delay_from_headers(e.response.headers)
+                    if advertised is not None:
+                        delay = advertised + random.random() * 0.1
+                    with self._lock:
+                        self.rate_limited += 1
+                        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                with self._lock:
+                    self.retries += 1
+                logger.warning("Embedding request failed (%s), retrying in %.2fs (attempt %s/%s)",
+                               type(e).__name__, delay, attempt, self.max_retries)
+                time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'rate_limited': self.rate_limited,
+                'retries': self.retries,
+            }
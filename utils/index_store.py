@@ -0,0 +1,436 @@
+import fcntl
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from utils.ann_index import configure_search
+from utils.concurrency import native_lock
+from utils.keyword_index import KeywordIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'indexes'
+)
+
+# Memory-map the flat vector codes when the installed faiss supports it so
+# every gunicorn worker shares the same page cache instead of a private copy.
+MMAP_IO_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', getattr(faiss, 'IO_FLAG_MMAP', 0))
+
+CURRENT_FILE = 'CURRENT'
+MANIFEST_SUFFIX = '.json'
+UNPUBLISHED_SUFFIX = '.tmp'
+FILE_MAP_FILE = 'file_map.json'
+KEYWORD_INDEX_FILE = 'keyword.pkl'
+ANN_INDEX_FILE = 'ann.faiss'
+ANN_META_FILE = 'ann.json'
+LOCK_FILE = '.lock'
+# Reads of CURRENT retried when the version is pruned before it is loaded
+SNAPSHOT_ATTEMPTS = 3
+# Unpublished segments older than this were left behind by a crashed writer
+UNPUBLISHED_MAX_AGE = 24 * 3600
+
+
+class IndexSegment:
+    """
+    One immutable part of a user's index: the chunks of one upload, or of a
+    merge of earlier segments, with their vectors, BM25 keyword index, file
+    map and, for large segments, an ANN index. Lookup tables derived from
+    them are built on first use.
+    """
+
+    def __init__(self, segment_id, vector_store, keyword_index, ann_index, ann_meta, file_map):
+        self.id = segment_id
+        self.vector_store = vector_store
+        self.keyword_index = keyword_index
+        self.ann_index = ann_index
+        self.ann_meta = ann_meta
+        self.file_map = file_map
+        self._position_files = None
+        self._docstore_positions = None
+
+    def __len__(self):
+        return self.vector_store.index.ntotal
+
+    @property
+    def position_files(self):
+        """
+        Array holding, for each flat index position, the id of the file the
+        chunk belongs to (-1 if unknown); used to restrict searches to some files.
+        """
+        if self._position_files is None:
+            doc_files = {doc_id: file_id for file_id, ids in self.file_map.items() for doc_id in ids}
+            index_to_docstore_id = self.vector_store.index_to_docstore_id
+            self._position_files = np.fromiter(
+                (doc_files.get(index_to_docstore_id[position], -1) for position in range(len(index_to_docstore_id))),
+                dtype=np.int64, count=len(index_to_docstore_id),
+            )
+        return self._position_files
+
+    @property
+    def docstore_positions(self):
+        """
+        {docstore id: flat index position}, to look up the stored vectors of retrieved chunks.
+        """
+        if self._docstore_positions is None:
+            self._docstore_positions = {doc_id: position for position, doc_id
+                                        in self.vector_store.index_to_docstore_id.items()}
+        return self._docstore_positions
+
+
+class IndexSnapshot:
+    """
+    One version of a user's index: its segments, oldest first, and the
+    files deleted from each of them since the segment was written.
+
+    A file's chunks live in one segment only. Deleting or re-processing the
+    file just records it as deleted there; its chunks are skipped by every
+    lookup until a merge drops them.
+    """
+
+    def __init__(self, version, segments, deleted):
+        self.version = version
+        self.segments = segments
+        self.deleted = deleted  # segment id -> set of file ids
+        self._dead_ids = {}
+        self._live_masks = {}
+        self._files = None
+
+    @property
+    def ntotal(self):
+        """Number of live chunks."""
+        return sum(len(segment) - len(self.dead_ids(segment)) for segment in self.segments)
+
+    def dead_ids(self, segment):
+        """Docstore ids of the segment's chunks that belong to deleted files."""
+        dead = self._dead_ids.get(segment.id)
+        if dead is None:
+            dead = self._dead_ids[segment.id] = {
+                doc_id for file_id in self.deleted.get(segment.id, ()) for doc_id in segment.file_map.get(file_id, ())
+            }
+        return dead
+
+    def live_mask(self, segment):
+        """
+        Boolean array over the segment's positions, False for chunks of
+        deleted files, or None when nothing in it was deleted.
+        """
+        deleted = self.deleted.get(segment.id)
+        if not deleted:
+            return None
+        mask = self._live_masks.get(segment.id)
+        if mask is None:
+            mask = self._live_masks[segment.id] = ~np.isin(segment.position_files, list(deleted))
+        return mask
+
+    def files(self):
+        """{file_id: segment holding its live chunks}."""
+        if self._files is None:
+            self._files = {
+                file_id: segment
+                for segment in self.segments
+                for file_id in segment.file_map
+                if file_id not in self.deleted.get(segment.id, ())
+            }
+        return self._files
+
+    def doc_ids(self, file_ids):
+        """Docstore ids of the live chunks of file_ids."""
+        files = self.files()
+        return {doc_id for file_id in file_ids if file_id in files for doc_id in files[file_id].file_map[file_id]}
+
+    def locate(self, doc_id):
+        """Return (segment, position) of a live chunk, or (None, None)."""
+        for segment in reversed(self.segments):
+            position = segment.docstore_positions.get(doc_id)
+            if position is not None and doc_id not in self.dead_ids(segment):
+                return segment, position
+        return None, None
+
+    def document(self, doc_id):
+        """Return the langchain Document of a live chunk."""
+        segment, _ = self.locate(doc_id)
+        return segment.vector_store.docstore.search(doc_id)
+
+    def vectors(self, doc_ids):
+        """Return the stored vectors of live chunks, one row per doc id."""
+        located = [self.locate(doc_id) for doc_id in doc_ids]
+        vectors = None
+        for segment in {segment.id: segment for segment, _ in located}.values():
+            rows = [row for row, (owner, _) in enumerate(located) if owner is segment]
+            found = segment.vector_store.index.reconstruct_batch(
+                np.array([located[row][1] for row in rows], dtype=np.int64)
+            )
+            if vectors is None:
+                vectors = np.empty((len(doc_ids), found.shape[1]), dtype=np.float32)
+            vectors[rows] = found
+        return vectors
+
+
+class IndexStore:
+    """
+    Disk-backed, segmented FAISS indexes, one directory per user.
+
+    Each upload is written as a new immutable segment holding only its own
+    chunks (see IndexSegment), so adding a document costs time in
+    proportion to that document rather than to the user's whole corpus. A
+    version is a small manifest listing the live segments and the files
+    deleted from each; callers merge segments to keep their number small
+    and to drop deleted chunks.
+
+    Every commit writes a new manifest and then atomically repoints the
+    user's CURRENT file at it, so readers in other worker processes never
+    observe a half-written index. Segments are loaded once per process and
+    shared by every version that lists them; snapshots are reloaded as soon
+    as CURRENT changes on disk.
+
+    Directories saved before segments existed hold a whole index in the
+    segment layout; a CURRENT naming one reads as a single-segment version.
+    """
+
+    def __init__(self, embeddings, root=None):
+        self.embeddings = embeddings
+        self.root = root or os.environ.get('INDEX_STORE_DIR', DEFAULT_INDEX_DIR)
+        self._snapshots = {}  # user_id -> IndexSnapshot
+        self._segments = {}  # (user_id, segment_id) -> IndexSegment
+        # Also taken by searches and commits on run_blocking threads
+        self._lock = native_lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.root, f"user_{int(user_id)}")
+
+    def current_version(self, user_id):
+        """
+        Return the version id of the user's index on disk, or None if the user
+        has no index yet.
+        """
+        try:
+            with open(os.path.join(self._user_dir(user_id), CURRENT_FILE), 'r') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def write_lock(self, user_id):
+        """
+        Serialize writers for one user across threads and worker processes.
+        """
+        user_dir = self._user_dir(user_id)
+        os.makedirs(user_dir, exist_ok=True)
+        with open(os.path.join(user_dir, LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def snapshot(self, user_id):
+        """
+        Return an IndexSnapshot of the user's current version, or None if
+        nothing has been indexed.
+
+        CURRENT is read once and every segment comes from that version's
+        manifest, so a query never mixes two versions, even while an upload
+        commits a new one. Snapshots are cached until CURRENT changes.
+        """
+        for attempt in range(SNAPSHOT_ATTEMPTS):
+            version = self.current_version(user_id)
+            if version is None:
+                with self._lock:
+                    self._snapshots.pop(user_id, None)
+                return None
+            with self._lock:
+                cached = self._snapshots.get(user_id)
+            if cached is not None and cached.version == version:
+                return cached
+            try:
+                return self._read_snapshot(user_id, version)
+            except (FileNotFoundError, RuntimeError):
+                # Pruned by two later commits between reading CURRENT and loading the version
+                if attempt == SNAPSHOT_ATTEMPTS - 1 or self.current_version(user_id) == version:
+                    raise
+                logger.debug("Index version %s of user %s was replaced while loading, retrying", version, user_id)
+
+    def _read_snapshot(self, user_id, version):
+        manifest = self._read_manifest(user_id, version)
+        segments = [self._segment(user_id, segment_id) for segment_id in manifest['segments']]
+        snapshot = IndexSnapshot(version, segments, {
+            segment_id: set(file_ids) for segment_id, file_ids in manifest['deleted'].items() if file_ids
+        })
+        live = set(manifest['segments'])
+        with self._lock:
+            self._snapshots[user_id] = snapshot
+            # Segments merged away are only still needed by queries already running
+            for key in [key for key in self._segments if key[0] == user_id and key[1] not in live]:
+                del self._segments[key]
+        logger.debug("Loaded index version %s for user %s (%s segments)", version, user_id, len(segments))
+        return snapshot
+
+    def _read_manifest(self, user_id, version):
+        user_dir = self._user_dir(user_id)
+        try:
+            with open(os.path.join(user_dir, version + MANIFEST_SUFFIX), 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            if not os.path.isdir(os.path.join(user_dir, version)):
+                raise
+            # Saved before segments existed: the whole index in one directory
+            return {'segments': [version], 'deleted': {}}
+        manifest['deleted'] = {segment_id: [int(file_id) for file_id in file_ids]
+                               for segment_id, file_ids in manifest.get('deleted', {}).items()}
+        return manifest
+
+    def _segment(self, user_id, segment_id):
+        key = (user_id, segment_id)
+        with self._lock:
+            segment = self._segments.get(key)
+        if segment is None:
+            segment = self._read_segment(segment_id, os.path.join(self._user_dir(user_id), segment_id))
+            with self._lock:
+                segment = self._segments.setdefault(key, segment)
+        return segment
+
+    def _read_segment(self, segment_id, path):
+        if not os.path.isdir(path):
+            raise FileNotFoundError(path)
+        vector_store = FAISS.load_local(
+            path,
+            self.embeddings,
+            allow_dangerous_deserialization=True,  # only ever reads files written by write_segment()
+            io_flags=MMAP_IO_FLAGS,
+        )
+        ann_index, ann_meta = self._read_ann_index(path)
+        logger.debug("Loaded index segment %s (%s vectors)", segment_id, vector_store.index.ntotal)
+        return IndexSegment(segment_id, vector_store, self._read_keyword_index(path, vector_store),
+                            ann_index, ann_meta, self._read_file_map(path))
+
+    @staticmethod
+    def _read_keyword_index(path, vector_store):
+        try:
+            with open(os.path.join(path, KEYWORD_INDEX_FILE), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            # Saved before keyword indexes existed; indexed from the docstore
+            keyword_index = KeywordIndex()
+            for doc_id in vector_store.index_to_docstore_id.values():
+                keyword_index.add(doc_id, vector_store.docstore.search(doc_id).page_content)
+            return keyword_index
+
+    @staticmethod
+    def _read_ann_index(path):
+        try:
+            with open(os.path.join(path, ANN_META_FILE), 'r') as f:
+                ann_meta = json.load(f)
+        except FileNotFoundError:
+            return None, None
+        index_path = os.path.join(path, ANN_INDEX_FILE)
+        try:
+            ann_index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+        except RuntimeError:
+            # Not every index type can be memory-mapped (HNSW graphs cannot)
+            ann_index = faiss.read_index(index_path)
+        logger.debug("Loaded %s ANN index from %s (%s vectors)", ann_meta['type'], path, ann_index.ntotal)
+        return configure_search(ann_index), ann_meta
+
+    @staticmethod
+    def _read_file_map(path):
+        try:
+            with open(os.path.join(path, FILE_MAP_FILE), 'r') as f:
+                return {int(file_id): ids for file_id, ids in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+
+    def write_segment(self, user_id, vector_store, file_map, keyword_index, ann_index=None, ann_meta=None):
+        """
+        Write a new segment and return its id.
+
+        The segment stays unpublished, invisible to readers and left alone by
+        pruning, until a commit() lists it. Writing needs no lock, so large
+        merges don't hold up other writers.
+        """
+        segment_id = uuid.uuid4().hex
+        path = os.path.join(self._user_dir(user_id), segment_id + UNPUBLISHED_SUFFIX)
+        vector_store.save_local(path)
+        with open(os.path.join(path, FILE_MAP_FILE), 'w') as f:
+            json.dump({str(file_id): ids for file_id, ids in file_map.items()}, f)
+        with open(os.path.join(path, KEYWORD_INDEX_FILE), 'wb') as f:
+            pickle.dump(keyword_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if ann_index is not None:
+            faiss.write_index(ann_index, os.path.join(path, ANN_INDEX_FILE))
+            with open(os.path.join(path, ANN_META_FILE), 'w') as f:
+                json.dump(ann_meta, f)
+        logger.debug("Wrote index segment %s for user %s (%s vectors)",
+                     segment_id, user_id, vector_store.index.ntotal)
+        return segment_id
+
+    def discard_segment(self, user_id, segment_id):
+        """
+        Remove a segment written by write_segment() that will not be committed.
+        """
+        shutil.rmtree(os.path.join(self._user_dir(user_id), segment_id + UNPUBLISHED_SUFFIX), ignore_errors=True)
+
+    def commit(self, user_id, segments, deleted):
+        """
+        Publish the given segment ids (oldest first), with the
+        {segment id: file ids} deleted from them, as the user's new current
+        version. Segments from write_segment() are published on the way.
+
+        Callers must hold write_lock() and must have derived segments and
+        deleted from the snapshot that is still current.
+        """
+        user_dir = self._user_dir(user_id)
+        os.makedirs(user_dir, exist_ok=True)
+        previous = self.current_version(user_id)
+
+        for segment_id in segments:
+            unpublished = os.path.join(user_dir, segment_id + UNPUBLISHED_SUFFIX)
+            if os.path.isdir(unpublished):
+                os.rename(unpublished, os.path.join(user_dir, segment_id))
+
+        version = uuid.uuid4().hex
+        manifest = {
+            'segments': list(segments),
+            'deleted': {segment_id: sorted(deleted[segment_id]) for segment_id in segments if deleted.get(segment_id)},
+        }
+        with open(os.path.join(user_dir, version + MANIFEST_SUFFIX), 'w') as f:
+            json.dump(manifest, f)
+
+        tmp_current = os.path.join(user_dir, f"{CURRENT_FILE}.{version}")
+        with open(tmp_current, 'w') as f:
+            f.write(version)
+        os.replace(tmp_current, os.path.join(user_dir, CURRENT_FILE))
+        logger.debug("Committed index version %s for user %s (%s segments)", version, user_id, len(segments))
+
+        self._prune(user_id, keep={version, previous} - {None})
+        return version
+
+    def _prune(self, user_id, keep):
+        # The previous version is kept around so a worker that read CURRENT
+        # just before the swap can still finish loading it.
+        user_dir = self._user_dir(user_id)
+        referenced = set()
+        for version in keep:
+            try:
+                referenced.update(self._read_manifest(user_id, version)['segments'])
+            except FileNotFoundError:
+                pass
+        now = time.time()
+        for entry in os.listdir(user_dir):
+            path = os.path.join(user_dir, entry)
+            if entry.endswith(MANIFEST_SUFFIX) and os.path.isfile(path):
+                if entry[:-len(MANIFEST_SUFFIX)] not in keep:
+                    os.remove(path)
+            elif os.path.isdir(path) and entry not in referenced:
+                # Segments another writer has not committed yet are left alone
+                if entry.endswith(UNPUBLISHED_SUFFIX) and now - os.path.getmtime(path) < UNPUBLISHED_MAX_AGE:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
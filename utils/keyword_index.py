@@ -0,0 +1,125 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+# Words, numbers and product codes such as "LIK-4821B", "60x60" or "A12.5"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+CODE_SEPARATORS = re.compile(r"[-_./]")
+
+
+def tokenize(text):
+    """
+    Lowercase terms for lexical matching.
+
+    Compound codes are indexed whole and by their parts, so "LIK-4821B"
+    matches a query for "LIK-4821B" exactly and still matches "4821B".
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        if CODE_SEPARATORS.search(token):
+            terms.extend(part for part in CODE_SEPARATORS.split(token) if part)
+    return terms
+
+
+class KeywordIndex:
+    """
+    In-memory inverted index with Okapi BM25 scoring.
+
+    Documents are keyed by the same docstore ids as the FAISS index so the
+    two result lists can be fused directly.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id, text):
+        if doc_id in self.doc_lengths:
+            self.remove([doc_id])
+        terms = tokenize(text)
+        for term, frequency in Counter(terms).items():
+            self.postings[term][doc_id] = frequency
+        self.doc_lengths[doc_id] = len(terms)
+        self.total_length += len(terms)
+
+    def remove(self, doc_ids):
+        doc_ids = set(doc_ids) & self.doc_lengths.keys()
+        if not doc_ids:
+            return
+        for term in list(self.postings):
+            docs = self.postings[term]
+            for doc_id in doc_ids & docs.keys():
+                del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+        for doc_id in doc_ids:
+            self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def search(self, query, k=10, allowed=None):
+        """
+        Return up to k (doc_id, score) pairs, best first. If allowed is given,
+        only those doc ids are scored.
+        """
+        return search_indexes([(self, ())], query, k, allowed)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['postings'] = dict(self.postings)
+        return state
+
+    def __setstate__(self, state):
+        state['postings'] = defaultdict(dict, state['postings'])
+        self.__dict__.update(state)
+
+
+def search_indexes(indexes, query, k=10, allowed=None):
+    """
+    Score a query with BM25 over several keyword indexes as if they were
+    one, and return up to k (doc_id, score) pairs, best first.
+
+    indexes holds (keyword_index, excluded doc ids) pairs; excluded
+    documents are never returned but still count towards the corpus
+    statistics until they are removed from their index.
+    """
+    num_docs = sum(len(index) for index, _ in indexes)
+    if not num_docs:
+        return []
+    average_length = sum(index.total_length for index, _ in indexes) / num_docs
+
+    scores = defaultdict(float)
+    for term in set(tokenize(query)):
+        postings = [(index, excluded, index.postings.get(term)) for index, excluded in indexes]
+        postings = [(index, excluded, docs) for index, excluded, docs in postings if docs]
+        if not postings:
+            continue
+        matching = sum(len(docs) for _, _, docs in postings)
+        idf = math.log(1 + (num_docs - matching + 0.5) / (matching + 0.5))
+        for index, excluded, docs in postings:
+            for doc_id, frequency in docs.items():
+                if doc_id in excluded or (allowed is not None and doc_id not in allowed):
+                    continue
+                norm = index.k1 * (1 - index.b + index.b * index.doc_lengths[doc_id] / average_length)
+                scores[doc_id] += idf * frequency * (index.k1 + 1) / (frequency + norm)
+
+    return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(result_lists, k=60, with_scores=False):
+    """
+    Merge ranked lists of ids: each id scores sum(1 / (k + rank)) over the lists it appears in.
+    With with_scores, (id, score) pairs are returned.
+    """
+    scores = defaultdict(float)
+    for results in result_lists:
+        for rank, doc_id in enumerate(results, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return ranked if with_scores else [doc_id for doc_id, _ in ranked]
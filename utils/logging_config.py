@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from utils.concurrency import call_on_hub, native_rlock
+
+# Root level, and per-logger overrides as "name=LEVEL,name=LEVEL",
+# e.g. LOG_LEVELS="utils.text_processor=DEBUG,werkzeug=WARNING"
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+# 'json' for one object per line, 'text' for a human-readable line
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_lock = threading.Lock()
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, message, any extra=
+    fields and the formatted traceback when there is one.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler formats each record in the logging thread before
+    queueing it, which is the cost this setup exists to move off request
+    threads. Records stay in this process, so they need no pickling.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def createLock(self):
+        # Records also arrive from run_blocking threads, see utils.concurrency
+        self.lock = native_rlock()
+
+    def enqueue(self, record):
+        call_on_hub(self.queue.put_nowait, record)
+
+
+def parse_levels(spec):
+    """Parse "name=LEVEL,name=LEVEL" into {name: LEVEL}."""
+    levels = {}
+    for item in spec.split(','):
+        name, _, level = item.strip().partition('=')
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(level=None, levels=None, log_format=None, stream=None):
+    """
+    Configure logging for the process once; later calls are no-ops.
+
+    Records are put on an in-memory queue by a QueueHandler on the root
+    logger and formatted and written by a QueueListener thread, so request
+    threads never wait on log I/O. Messages use %-style arguments, which
+    are only formatted when a record passes its logger's level.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        handler = logging.StreamHandler(stream or sys.stderr)
+        if (log_format or LOG_FORMAT) == 'json':
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        for existing in root.handlers[:]:
+            root.removeHandler(existing)
+        root.addHandler(DeferredQueueHandler(log_queue))
+        root.setLevel(level or LOG_LEVEL)
+        for name, logger_level in parse_levels(LOG_LEVELS if levels is None else levels).items():
+            logging.getLogger(name).setLevel(logger_level)
+
+        _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
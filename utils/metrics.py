@@ -0,0 +1,75 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+from utils.concurrency import call_on_hub
+
+logger = logging.getLogger(__name__)
+
+# From index lookups (milliseconds) to slow completions and large uploads (minutes)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    'kb_stage_duration_seconds',
+    'Time spent in each stage of chat and upload handling',
+    ['stage'], buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    'kb_http_request_duration_seconds',
+    'Time to produce an HTTP response (streamed bodies finish later)',
+    ['endpoint', 'method', 'status'], buckets=LATENCY_BUCKETS,
+)
+TOKENS = Counter('kb_openai_tokens', 'Tokens sent to and received from OpenAI', ['kind'])
+CACHE_LOOKUPS = Counter('kb_cache_lookups', 'Cache lookups by cache and result', ['cache', 'result'])
+CHUNKS_INDEXED = Counter('kb_chunks_indexed', 'Document chunks added to vector indexes')
+LOGINS = Counter('kb_logins', 'Completed Google sign-in callbacks by result', ['result'])
+
+
+def observe(stage, seconds):
+    # Metric locks are greenlet locks under gevent; samples taken on
+    # run_blocking threads are recorded by the hub
+    call_on_hub(STAGE_SECONDS.labels(stage).observe, seconds)
+
+
+@contextmanager
+def timed(stage):
+    """
+    Record the duration of the enclosed block as one observation of stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def count_cache_lookups(cache, hits, misses):
+    if hits:
+        call_on_hub(CACHE_LOOKUPS.labels(cache, 'hit').inc, hits)
+    if misses:
+        call_on_hub(CACHE_LOOKUPS.labels(cache, 'miss').inc, misses)
+
+
+def cache_stats(hits, misses, **extra):
+    """The hit counters a cache reports on /stats, plus any extra fields."""
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0, **extra}
+
+
+def render():
+    """
+    Return (body, content_type) in the Prometheus text format.
+
+    Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+    and this aggregates all of them, whichever worker serves the scrape.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,110 @@
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Used when the provider sends no Cache-Control max-age
+DISCOVERY_DEFAULT_TTL = int(os.environ.get('OIDC_DISCOVERY_DEFAULT_TTL', 3600))
+OIDC_HTTP_TIMEOUT = float(os.environ.get('OIDC_HTTP_TIMEOUT', 10))
+
+_MAX_AGE = re.compile(r'(?:^|,)\s*(?:s-maxage|max-age)\s*=\s*"?(\d+)"?', re.IGNORECASE)
+_NO_CACHE = re.compile(r'(?:^|,)\s*(?:no-store|no-cache)\s*(?:,|$)', re.IGNORECASE)
+
+
+def cache_ttl(cache_control, default=DISCOVERY_DEFAULT_TTL):
+    """
+    Seconds a response may be reused for, from its Cache-Control header.
+    """
+    if not cache_control:
+        return default
+    if _NO_CACHE.search(cache_control):
+        return 0
+    match = _MAX_AGE.search(cache_control)
+    return int(match.group(1)) if match else default
+
+
+def make_session(pool_size=20):
+    """
+    requests.Session with a keep-alive pool, so repeated calls to the same
+    provider reuse TCP and TLS connections instead of opening new ones.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class ProviderConfigCache:
+    """
+    Per-process cache of an OpenID Connect discovery document.
+
+    The document is refetched once the max-age from its Cache-Control header
+    has passed, by one request at a time and outside the lock: the others
+    keep using the stale copy meanwhile, and only wait when there is none
+    yet. If the provider is unreachable, the stale copy keeps logins working
+    until it answers again.
+    """
+
+    def __init__(self, url, session=None, timeout=None):
+        self.url = url
+        self.session = session or make_session()
+        self.timeout = timeout or OIDC_HTTP_TIMEOUT
+        self._config = None
+        self._expires_at = 0.0
+        self._refreshing = None  # threading.Event set when the fetch in flight ends
+        self._lock = threading.Lock()
+        self.fetches = 0
+        self.hits = 0
+
+    def get(self):
+        while True:
+            with self._lock:
+                fresh = time.monotonic() < self._expires_at
+                if self._config is not None and (fresh or self._refreshing is not None):
+                    self.hits += 1
+                    return self._config
+                refreshing = self._refreshing
+                if refreshing is None:
+                    refreshing = self._refreshing = threading.Event()
+                    break
+            # Nothing cached yet: wait for that fetch, then take its result or try again
+            refreshing.wait()
+
+        try:
+            return self._fetch()
+        finally:
+            with self._lock:
+                self._refreshing = None
+            refreshing.set()
+
+    def _fetch(self):
+        try:
+            response = self.session.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            config = response.json()
+        except (requests.RequestException, ValueError) as e:
+            with self._lock:
+                config = self._config
+            if config is None:
+                raise
+            logger.warning("Refreshing OpenID configuration failed, using cached copy: %s", e)
+            return config
+
+        ttl = cache_ttl(response.headers.get('Cache-Control'))
+        with self._lock:
+            self.fetches += 1
+            self._config = config
+            self._expires_at = time.monotonic() + ttl
+        logger.debug("Fetched OpenID configuration from %s, caching for %ss", self.url, ttl)
+        return config
+
+    def stats(self):
+        with self._lock:
+            return {'fetches': self.fetches, 'hits': self.hits}
@@ -1,66 +1,321 @@
 import os
+import re
 import logging
-from openai import OpenAI
+import threading
 import time
-from utils.text_processor import TextProcessor
+from utils.metrics import TOKENS, observe, timed
+from utils.prompt_builder import PROMPT_MAX_CHUNKS, SUMMARY_MAX_TOKENS, PromptBuilder
+from utils.query_cache import normalize_query
+from utils.tokens import count_tokens
+from utils.response_cache import ResponseCache
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is not set")
 
-client = OpenAI(api_key=OPENAI_API_KEY, timeout=30.0)
-text_processor = TextProcessor()
+# On gevent workers every in-flight chat holds an OpenAI connection, so the
+# pool must be much larger than httpx's default of 100
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 500))
 
-def process_document(text):
-    """Process an uploaded document and store its vectors."""
-    return text_processor.process_document(text)
+response_cache = ResponseCache()
+prompt_builder = PromptBuilder()
 
-def process_message(message, history):
+_services = None
+_services_lock = threading.Lock()
+# Returns a user's stored chunk records; lets the retrieval service rebuild missing indexes
+_chunk_loader = None
+
+def set_chunk_loader(loader):
+    """Register the source of stored chunks used to rebuild missing indexes."""
+    global _chunk_loader
+    _chunk_loader = loader
+    if _services is not None:
+        _services['text_processor'].chunk_loader = loader
+
+def _get_services():
+    """
+    Create this process's OpenAI client and retrieval service on first use.
+
+    openai, langchain and FAISS account for most of a worker's import time,
+    so they are loaded by the first request that needs them rather than at boot.
+    """
+    global _services
+    if _services is None:
+        with _services_lock:
+            if _services is None:
+                start_time = time.time()
+                import httpx
+                from openai import DefaultHttpxClient, OpenAI
+                from utils.embedding_cache import CachedEmbeddings
+                from utils.embedding_scheduler import EmbeddingScheduler
+                from utils.text_processor import TextProcessor
+
+                # Chat and embedding requests share one connection pool
+                http_client = DefaultHttpxClient(limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=min(OPENAI_MAX_CONNECTIONS, 100),
+                ))
+                _services = {
+                    'client': OpenAI(api_key=OPENAI_API_KEY, timeout=30.0, http_client=http_client),
+                    'text_processor': TextProcessor(embeddings=CachedEmbeddings(EmbeddingScheduler(
+                        client=OpenAI(api_key=OPENAI_API_KEY, max_retries=0, timeout=60.0, http_client=http_client)
+                    )), chunk_loader=_chunk_loader),
+                }
+                logger.info("Initialized OpenAI and retrieval services in %.2f seconds", time.time() - start_time)
+    return _services
+
+def get_client():
+    """The process-wide OpenAI client for chat completions."""
+    return _get_services()['client']
+
+def get_text_processor():
+    """The process-wide retrieval service shared by chat and ingestion."""
+    return _get_services()['text_processor']
+
+# Older turns are folded into a rolling summary by this (cheaper) model
+SUMMARY_MODEL = os.environ.get('SUMMARY_MODEL', 'gpt-3.5-turbo')
+
+# Short messages such as "tell me more" depend on the conversation, not just
+# the question, so they are never answered from the response cache.
+RESPONSE_CACHE_MIN_WORDS = int(os.environ.get('RESPONSE_CACHE_MIN_WORDS', 3))
+
+# Continuations such as "tell me more" or "why?" carry no topic of their own,
+# so they are retrieved with the question they follow, reusing its context
+FOLLOW_UP_MAX_WORDS = int(os.environ.get('FOLLOW_UP_MAX_WORDS', 6))
+_FOLLOW_UP = re.compile(
+    r"(?:(?:ok(?:ay)?|and|so|please|can you|could you)\s+)*"
+    r"(?:tell me more(?: about (?:that|this|it))?|more(?: details| info(?:rmation)?)?|go on|continue|"
+    r"elaborate(?: on (?:that|this|it))?|expand(?: on (?:that|this|it))?|"
+    r"explain(?: (?:that|this|it|further|more))?|why|how so|what else|anything else|"
+    r"(?:give me |any )?(?:an )?examples?|such as|details|really)"
+    r"(?:\s+please)?"
+)
+
+def process_document(text, user_id, file_id):
+    """Process an uploaded document, store its vectors and return its chunk records."""
+    chunks = get_text_processor().process_document(text, user_id, file_id)
+    response_cache.invalidate(user_id)
+    return chunks
+
+def process_pdf(pdf_path, user_id, file_id):
+    """Stream an uploaded PDF page by page into the user's index and return its chunk records."""
+    text_processor = get_text_processor()
+    chunks = text_processor.process_pages(text_processor.iter_pdf_pages(pdf_path), user_id, file_id)
+    response_cache.invalidate(user_id)
+    return chunks
+
+def prepare_document(text, file_id):
+    """Split and embed an uploaded text document for a later index_documents call."""
+    return get_text_processor().prepare_pages([(None, text)], file_id)
+
+def prepare_pdf(pdf_path, file_id):
+    """Stream an uploaded PDF's pages into the splitter and embed them for a later index_documents call."""
+    text_processor = get_text_processor()
+    return text_processor.prepare_pages(text_processor.iter_pdf_pages(pdf_path), file_id)
+
+def index_documents(user_id, documents):
+    """Add prepared documents to the user's index in one commit and return {file_id: chunk records}."""
+    records = get_text_processor().add_documents(user_id, documents)
+    response_cache.invalidate(user_id)
+    return records
+
+def remove_document(user_id, file_id):
+    """Remove a deleted document's vectors from the user's index."""
+    num_chunks = get_text_processor().remove_document(user_id, file_id)
+    response_cache.invalidate(user_id)
+    return num_chunks
+
+def compact_index(user_id):
+    """Merge a user's index segments that are due, dropping chunks of deleted files."""
+    return get_text_processor().compact(user_id)
+
+def rebuild_index(user_id, index_type=None):
+    """Retrain a user's ANN index, optionally switching index type."""
+    return get_text_processor().rebuild_index(user_id, index_type)
+
+def restore_index(user_id, records):
+    """Rebuild a user's index from stored chunk records."""
+    num_chunks = get_text_processor().restore_index(user_id, records)
+    response_cache.invalidate(user_id)
+    return num_chunks
+
+def get_cache_stats():
+    """Hit/miss counters of this worker's caches."""
+    return {
+        'response_cache': response_cache.stats(),
+        'embedding_cache': get_text_processor().embeddings.stats(),
+        'retrieval_cache': get_text_processor().retrieval_cache.stats(),
+    }
+
+def get_rerank_stats():
+    """Re-ranking budget and duplicate counters of this worker; latency is the rerank stage on /metrics."""
+    return get_text_processor().reranker.stats()
+
+def is_cacheable(message, file_ids=None):
+    """
+    Whether a message is self-contained enough to share answers with similar questions.
+    Answers restricted to a selection of files are not shared.
+    """
+    return file_ids is None and len(message.split()) >= RESPONSE_CACHE_MIN_WORDS and not is_follow_up(message)
+
+def is_follow_up(message):
+    """Whether a message only continues the previous question, e.g. "tell me more"."""
+    words = re.sub(r'[^\w\s]', ' ', normalize_query(message)).split()
+    query = ' '.join(words)
+    return len(words) <= FOLLOW_UP_MAX_WORDS and _FOLLOW_UP.fullmatch(query) is not None
+
+def retrieval_query(message, history):
+    """
+    The text to retrieve context for: the message itself or, for a follow-up,
+    the latest earlier question in the history that was not one. The
+    previous turn's chunks then come straight from the retrieval cache.
+    """
+    if not is_follow_up(message):
+        return message
+    for entry in reversed(history or []):
+        if entry['role'] == 'user' and not is_follow_up(entry['content']):
+            return entry['content']
+    return message
+
+def lookup_cached_response(message, user_id, file_ids=None, query=None):
+    """
+    Embed the question (or the retrieval query standing in for it) and look
+    it up in the response cache.
+
+    Returns (answer or None, query_vector, index_version); the vector and version
+    are reused for retrieval and for storing the fresh answer.
+    """
+    text_processor = get_text_processor()
+    query_vector = text_processor.embed_query(query or message)
+    index_version = text_processor.index_version(user_id)
+    if not is_cacheable(message, file_ids):
+        return None, query_vector, index_version
+    return response_cache.lookup(user_id, query_vector, index_version), query_vector, index_version
+
+def build_messages(message, history, user_id, query_vector=None, summary=None, file_ids=None, query=None):
+    """Assemble the system prompt, retrieved context, summary, recent history and the new message within the token budget."""
+    # Retrieve more than will fit; the builder keeps the best chunks the budget allows
+    with timed('retrieve'):
+        documents = get_text_processor().retrieve(query or message, user_id, k=PROMPT_MAX_CHUNKS,
+                                                  query_vector=query_vector, file_ids=file_ids)
+    with timed('prompt_build'):
+        messages, stats = prompt_builder.build(
+            message, [doc.page_content for doc in documents], history, summary
+        )
+    TOKENS.labels('prompt').inc(stats['prompt_tokens'])
+    logger.debug("Prompt uses %s tokens with %s chunks and %s history messages",
+                 stats['prompt_tokens'], stats['context_chunks'], stats['history_messages'])
+    return messages
+
+def summarize_conversation(summary, messages):
+    """Fold chat messages into the running conversation summary."""
+    transcript = "\n".join(f"{entry['role']}: {entry['content']}" for entry in messages)
+    try:
+        response = get_client().chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": (
+                    "You maintain a concise running summary of a conversation between a user and an AI "
+                    "assistant about the user's documents. Keep names, figures, decisions and open "
+                    "questions; drop pleasantries. Reply with the updated summary only."
+                )},
+                {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"},
+            ],
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0.2,
+        )
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        logger.error("Error summarizing conversation: %s", e)
+        raise
+
+def process_message(message, history, user_id, summary=None, file_ids=None):
+    start_time = time.time()
+    try:
+        query = retrieval_query(message, history)
+        cached, query_vector, index_version = lookup_cached_response(message, user_id, file_ids, query)
+        if cached is not None:
+            return cached
+
+        messages = build_messages(message, history, user_id, query_vector, summary, file_ids, query)
+
+        logger.debug("Sending request to OpenAI API with %s messages", len(messages))
+
+        with timed('llm_total'):
+            response = get_client().chat.completions.create(
+                model="gpt-4",  # Fixed model name
+                messages=messages,
+                max_tokens=500,
+                temperature=0.7,
+            )
+
+        elapsed_time = time.time() - start_time
+        logger.debug("OpenAI API request completed in %.2f seconds", elapsed_time)
+
+        answer = response.choices[0].message.content
+        usage = getattr(response, 'usage', None)
+        TOKENS.labels('completion').inc(usage.completion_tokens if usage else count_tokens(answer or ''))
+        if is_cacheable(message, file_ids):
+            response_cache.store(user_id, query_vector, index_version, answer)
+        return answer
+
+    except Exception as e:
+        elapsed_time = time.time() - start_time
+        logger.error("OpenAI API error after %.2f seconds: %s", elapsed_time, e)
+        if elapsed_time >= 30:
+            raise Exception("Request timed out. Please try again.")
+        raise Exception(f"Error processing message: {str(e)}")
+
+def stream_message(message, history, user_id, summary=None, file_ids=None):
+    """Yield the assistant's reply token by token as the completion streams in."""
     start_time = time.time()
+    first_token_time = None
     try:
-        messages = [
-            {"role": "system", "content": "You are a helpful AI assistant that helps users understand and analyze text content."}
-        ]
-
-        # Get relevant context from vector store
-        context = text_processor.get_relevant_context(message)
-        if context:
-            messages.append({
-                "role": "system",
-                "content": f"Here is relevant context from the uploaded documents:\n{context}"
-            })
-
-        # Add history context
-        for entry in history[-5:]:  # Only use last 5 messages for context
-            messages.append({
-                "role": entry["role"],
-                "content": entry["content"]
-            })
-
-        # Add current message
-        messages.append({"role": "user", "content": message})
-
-        logger.debug(f"Sending request to OpenAI API with {len(messages)} messages")
-
-        response = client.chat.completions.create(
-            model="gpt-4",  # Fixed model name
+        query = retrieval_query(message, history)
+        cached, query_vector, index_version = lookup_cached_response(message, user_id, file_ids, query)
+        if cached is not None:
+            yield cached
+            return
+
+        messages = build_messages(message, history, user_id, query_vector, summary, file_ids, query)
+
+        logger.debug("Sending streaming request to OpenAI API with %s messages", len(messages))
+
+        llm_start = time.perf_counter()
+        stream = get_client().chat.completions.create(
+            model="gpt-4",
             messages=messages,
             max_tokens=500,
             temperature=0.7,
+            stream=True,
         )
 
-        elapsed_time = time.time() - start_time
-        logger.debug(f"OpenAI API request completed in {elapsed_time:.2f} seconds")
+        tokens = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                if first_token_time is None:
+                    first_token_time = time.time()
+                    observe('llm_first_token', time.perf_counter() - llm_start)
+                    logger.debug("First token after %.2f seconds", first_token_time - start_time)
+                tokens.append(token)
+                yield token
+
+        observe('llm_total', time.perf_counter() - llm_start)
+        TOKENS.labels('completion').inc(count_tokens(''.join(tokens)))
+        if is_cacheable(message, file_ids):
+            response_cache.store(user_id, query_vector, index_version, ''.join(tokens))
 
-        return response.choices[0].message.content
+        elapsed_time = time.time() - start_time
+        logger.debug("OpenAI streaming request completed in %.2f seconds", elapsed_time)
 
     except Exception as e:
         elapsed_time = time.time() - start_time
-        logger.error(f"OpenAI API error after {elapsed_time:.2f} seconds: {str(e)}")
+        logger.error("OpenAI API error after %.2f seconds: %s", elapsed_time, e)
         if elapsed_time >= 30:
             raise Exception("Request timed out. Please try again.")
-        raise Exception(f"Error processing message: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error processing message: {str(e)}")
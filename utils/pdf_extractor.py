@@ -0,0 +1,89 @@
+import logging
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from PyPDF2 import PdfReader
+
+from utils.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# PDFs with fewer pages than this are extracted in-process; the pool only pays
+# off once there is enough work to amortise shipping pages between processes.
+PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 64))
+PAGES_PER_TASK = int(os.environ.get('PDF_PAGES_PER_TASK', 16))
+MAX_PROCESSES = int(os.environ.get('PDF_EXTRACT_PROCESSES', os.cpu_count() or 1))
+# Page ranges of one PDF submitted ahead of the consumer; enough to keep every
+# process busy while bounding the extracted text waiting to be read
+RANGES_IN_FLIGHT = 2 * MAX_PROCESSES
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork: the parent runs ingestion threads, and forking a
+            # threaded process can deadlock the child on a lock held by another thread.
+            # This module only imports PyPDF2, so spawned workers start quickly.
+            _pool = ProcessPoolExecutor(
+                max_workers=MAX_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def _extract_page_range(pdf_path, start, end):
+    """
+    Extract pages [start, end) in a worker process. Returns (page_number, text) pairs.
+    """
+    reader = PdfReader(pdf_path)
+    return [(number + 1, reader.pages[number].extract_text() or '') for number in range(start, end)]
+
+
+def iter_pdf_pages(pdf_path, parallel=None):
+    """
+    Yield (page_number, text) for every page of a PDF, in page order.
+
+    Large documents are fanned out across a process pool in page ranges,
+    at most RANGES_IN_FLIGHT at a time, the next one submitted as each is
+    yielded, so a long PDF neither floods the pool's queue nor piles up
+    extracted text ahead of a slow caller.
+    """
+    reader = run_blocking(PdfReader, pdf_path)
+    num_pages = len(reader.pages)
+    if parallel is None:
+        parallel = MAX_PROCESSES > 1 and num_pages >= PARALLEL_MIN_PAGES
+
+    if not parallel:
+        logger.debug("Extracting %s PDF pages in-process", num_pages)
+        for number, page in enumerate(reader.pages, start=1):
+            yield number, run_blocking(page.extract_text) or ''
+        return
+
+    logger.debug("Extracting %s PDF pages across %s processes", num_pages, MAX_PROCESSES)
+    ranges = iter([(start, min(start + PAGES_PER_TASK, num_pages))
+                   for start in range(0, num_pages, PAGES_PER_TASK)])
+    pool = _get_pool()
+    futures = deque()
+
+    def submit_next():
+        page_range = next(ranges, None)
+        if page_range is not None:
+            futures.append(pool.submit(_extract_page_range, pdf_path, *page_range))
+
+    try:
+        for _ in range(RANGES_IN_FLIGHT):
+            submit_next()
+        while futures:
+            pages = futures.popleft().result()
+            submit_next()
+            yield from pages
+    finally:
+        # Stop queued ranges if the consumer gives up early
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,77 @@
+import os
+import time
+import uuid
+import logging
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# Profiling is opt-in per deployment and then per request
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/kb-profiles')
+# Sampling interval in seconds
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.001))
+
+
+class RequestProfiler:
+    """
+    Sampling profiler for individual requests.
+
+    With PROFILING_ENABLED=1, a request carrying an "X-Profile: 1" header or
+    ?profile=1 is sampled by pyinstrument from before_request until its
+    response is closed, so streamed chat bodies are included. The HTML
+    report is written to PROFILE_DIR and named in the X-Profile-Report
+    response header. Other requests pay nothing. Under gevent workers,
+    samples can include time spent in other greenlets while this one waits.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not PROFILING_ENABLED:
+            return
+        try:
+            import pyinstrument  # noqa: F401
+        except ImportError:
+            logger.warning("PROFILING_ENABLED is set but pyinstrument is not installed; profiling disabled")
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        self.enabled = True
+        app.before_request(self._start)
+        app.after_request(self._attach)
+        logger.info("Per-request profiling enabled, reports in %s", PROFILE_DIR)
+
+    def _requested(self):
+        return request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+
+    def _start(self):
+        if not self._requested():
+            return
+        from pyinstrument import Profiler
+        profiler = Profiler(interval=PROFILE_INTERVAL, async_mode='disabled')
+        profiler.start()
+        g.profiler = profiler
+
+    def _attach(self, response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint}-{uuid.uuid4().hex[:8]}.html")
+        response.headers['X-Profile-Report'] = os.path.basename(path)
+        response.call_on_close(lambda: self._write(profiler, path))
+        return response
+
+    def _write(self, profiler, path):
+        try:
+            profiler.stop()
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+            logger.info("Wrote request profile to %s", path)
+        except Exception as e:
+            logger.error("Error writing request profile: %s", e)
+
+
+request_profiler = RequestProfiler()
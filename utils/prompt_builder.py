@@ -0,0 +1,145 @@
+import logging
+import os
+
+from utils.tokens import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tokens available for the whole prompt; the reply's max_tokens comes on top
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', 3000))
+# Most of the budget recent turns may take verbatim; older turns live in the summary
+PROMPT_HISTORY_TOKENS = int(os.environ.get('PROMPT_HISTORY_TOKENS', 800))
+# Retrieval candidates offered to the builder, which keeps as many as fit
+PROMPT_MAX_CHUNKS = int(os.environ.get('PROMPT_MAX_CHUNKS', 12))
+# Length cap for the rolling conversation summary
+SUMMARY_MAX_TOKENS = int(os.environ.get('SUMMARY_MAX_TOKENS', 300))
+# Messages sent per summarization call; longer backlogs are folded in several calls
+SUMMARY_INPUT_TOKENS = int(os.environ.get('SUMMARY_INPUT_TOKENS', 2000))
+
+# The chat format adds a few tokens per message, plus a few to prime the reply
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+SYSTEM_PROMPT = "You are a helpful AI assistant that helps users understand and analyze text content."
+CONTEXT_HEADER = "Here is relevant context from the uploaded documents:\n"
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+CHUNK_SEPARATOR = "\n\n"
+
+
+def message_tokens(message, model='gpt-4'):
+    return count_tokens(message['content'], model) + MESSAGE_OVERHEAD_TOKENS
+
+
+def dedupe_chunks(chunks):
+    """
+    Drop chunks that repeat, or are contained in, a higher-ranked chunk.
+    """
+    kept = []
+    normalized = []
+    for chunk in chunks:
+        text = ' '.join(chunk.split())
+        if not text or any(text in other for other in normalized):
+            continue
+        kept.append(chunk)
+        normalized.append(text)
+    return kept
+
+
+def fit_history(history, budget, model='gpt-4'):
+    """
+    Split history into (older, recent): recent is the longest run of newest
+    messages whose tokens fit in budget.
+    """
+    used = 0
+    split = len(history)
+    while split > 0:
+        tokens = message_tokens(history[split - 1], model)
+        if used + tokens > budget:
+            break
+        used += tokens
+        split -= 1
+    return history[:split], history[split:]
+
+
+def take_oldest(history, budget, model='gpt-4'):
+    """
+    Return the longest run of oldest messages whose tokens fit in budget.
+    The first message is always taken, its content cut to fit if need be.
+    """
+    taken = []
+    used = 0
+    for message in history:
+        tokens = message_tokens(message, model)
+        if used + tokens > budget:
+            if not taken:
+                content = truncate_tokens(message['content'], max(budget - MESSAGE_OVERHEAD_TOKENS, 1), model)
+                taken.append({**message, 'content': content})
+            break
+        taken.append(message)
+        used += tokens
+    return taken
+
+
+class PromptBuilder:
+    """
+    Assembles chat prompts within a token budget.
+
+    The system prompt, conversation summary and question always go in.
+    Recent history then takes whole messages, newest first, up to
+    history_tokens. Retrieved chunks fill whatever is left, in rank order,
+    after dropping duplicates.
+    """
+
+    def __init__(self, budget=None, history_tokens=None, model='gpt-4'):
+        self.budget = budget or PROMPT_TOKEN_BUDGET
+        self.history_tokens = history_tokens or PROMPT_HISTORY_TOKENS
+        self.model = model
+
+    def build(self, message, context_chunks=(), history=(), summary=None):
+        """
+        Return (messages, stats) where stats records prompt_tokens and what was included.
+        """
+        system = {"role": "system", "content": SYSTEM_PROMPT}
+        question = {"role": "user", "content": message}
+        used = REPLY_PRIMING_TOKENS + message_tokens(system, self.model) + message_tokens(question, self.model)
+
+        summary_message = None
+        if summary:
+            summary_message = {"role": "system", "content": f"{SUMMARY_HEADER}{summary}"}
+            used += message_tokens(summary_message, self.model)
+
+        _, recent = fit_history(list(history), min(self.history_tokens, max(self.budget - used, 0)), self.model)
+        recent = [{"role": entry["role"], "content": entry["content"]} for entry in recent]
+        used += sum(message_tokens(entry, self.model) for entry in recent)
+
+        context_budget = (self.budget - used - MESSAGE_OVERHEAD_TOKENS
+                          - count_tokens(CONTEXT_HEADER, self.model))
+        separator_tokens = count_tokens(CHUNK_SEPARATOR, self.model)
+        selected = []
+        context_used = 0
+        for chunk in dedupe_chunks(context_chunks):
+            tokens = count_tokens(chunk, self.model) + (separator_tokens if selected else 0)
+            if context_used + tokens > context_budget:
+                # A shorter, lower-ranked chunk may still fit
+                continue
+            selected.append(chunk)
+            context_used += tokens
+
+        messages = [system]
+        if selected:
+            context_message = {"role": "system", "content": CONTEXT_HEADER + CHUNK_SEPARATOR.join(selected)}
+            messages.append(context_message)
+            used += message_tokens(context_message, self.model)
+        if summary_message:
+            messages.append(summary_message)
+        messages.extend(recent)
+        messages.append(question)
+
+        stats = {
+            'prompt_tokens': used,
+            'context_chunks': len(selected),
+            'history_messages': len(recent),
+            'summary': summary_message is not None,
+        }
+        logger.debug("Built prompt: %s", stats)
+        return messages, stats
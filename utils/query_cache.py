@@ -0,0 +1,66 @@
+import re
+import logging
+import unicodedata
+from collections import OrderedDict
+
+from utils.concurrency import native_lock
+from utils.metrics import cache_stats, count_cache_lookups
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+_EDGE_PUNCTUATION = ' ?!.,;:\'"'
+
+
+def normalize_query(text):
+    """
+    Case-folded, NFKC-normalised query with whitespace collapsed and
+    surrounding punctuation removed, so "What is X?" and "what is x" share
+    cache entries.
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return _WHITESPACE.sub(' ', text).strip(_EDGE_PUNCTUATION)
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU mapping. Lookups are counted in
+    kb_cache_lookups under `name`; max_entries of 0 disables the cache.
+    """
+
+    def __init__(self, name, max_entries):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = native_lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value, or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        count_cache_lookups(self.name, value is not None, value is None)
+        return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return cache_stats(self.hits, self.misses, entries=len(self._entries))
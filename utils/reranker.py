@@ -0,0 +1,108 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+from utils.concurrency import native_lock
+
+logger = logging.getLogger(__name__)
+
+RERANK_ENABLED = os.environ.get('RERANK_ENABLED', '1') == '1'
+# First-stage candidates handed to the re-ranker
+RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES', 50))
+# Maximal marginal relevance trade-off: 1.0 ranks by relevance alone, lower favours diversity
+RERANK_MMR_LAMBDA = float(os.environ.get('RERANK_MMR_LAMBDA', 0.9))
+# Share of relevance taken from exact query similarity instead of the fused
+# (dense + BM25) score. The fused score already includes the dense rank, so
+# this mostly corrects for ANN approximation and is off by default.
+RERANK_DENSE_WEIGHT = float(os.environ.get('RERANK_DENSE_WEIGHT', 0.0))
+# Candidates at least this similar to an already chosen chunk are dropped as near-duplicates
+RERANK_DUPLICATE_SIMILARITY = float(os.environ.get('RERANK_DUPLICATE_SIMILARITY', 0.95))
+# Past this many milliseconds the remaining slots are filled in relevance order
+RERANK_BUDGET_MS = float(os.environ.get('RERANK_BUDGET_MS', 20))
+
+
+def _normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _min_max(values):
+    spread = values.max() - values.min()
+    return (values - values.min()) / spread if spread else np.ones_like(values)
+
+
+class Reranker:
+    """
+    Second retrieval stage: picks k of the first stage's candidates by
+    maximal marginal relevance.
+
+    Relevance is the fused rank score, optionally blended with similarity
+    to the exact (flat) chunk vectors. Each pick is penalised by its
+    similarity to chunks already chosen, and candidates nearly identical to
+    a chosen chunk are dropped, which keeps overlapping neighbours and
+    re-uploaded copies from filling the prompt with the same passage.
+    """
+
+    def __init__(self, mmr_lambda=None, dense_weight=None, duplicate_similarity=None, budget_ms=None):
+        self.mmr_lambda = RERANK_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+        self.dense_weight = RERANK_DENSE_WEIGHT if dense_weight is None else dense_weight
+        self.duplicate_similarity = duplicate_similarity or RERANK_DUPLICATE_SIMILARITY
+        self.budget_ms = budget_ms or RERANK_BUDGET_MS
+        # Re-ranking runs on run_blocking threads
+        self._lock = native_lock()
+        self.calls = 0
+        self.over_budget = 0
+        self.duplicates_dropped = 0
+
+    def rerank(self, query_vector, candidate_vectors, fused_scores, k):
+        """
+        Return the positions of the chosen candidates, best first. Fewer than
+        k are returned when the rest are near-duplicates of chosen chunks.
+        """
+        start = time.perf_counter()
+        deadline = start + self.budget_ms / 1000
+        vectors = _normalize_rows(np.asarray(candidate_vectors, dtype=np.float32))
+        query = _normalize_rows(np.asarray(query_vector, dtype=np.float32))
+        relevance = (self.dense_weight * _min_max(vectors @ query)
+                     + (1 - self.dense_weight) * _min_max(np.asarray(fused_scores, dtype=np.float32)))
+        similarity = vectors @ vectors.T
+
+        available = np.ones(len(vectors), dtype=bool)
+        redundancy = np.zeros(len(vectors), dtype=np.float32)
+        chosen = []
+        dropped = 0
+        over_budget = False
+        while len(chosen) < k and available.any():
+            if time.perf_counter() > deadline:
+                # Out of time: keep the most relevant of what is left
+                over_budget = True
+                remaining = np.flatnonzero(available)
+                chosen.extend(remaining[np.argsort(-relevance[remaining], kind='stable')][:k - len(chosen)].tolist())
+                break
+            scores = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * redundancy
+            scores[~available] = -np.inf
+            best = int(np.argmax(scores))
+            chosen.append(best)
+            available[best] = False
+            redundancy = np.maximum(redundancy, similarity[best])
+            duplicates = available & (similarity[best] >= self.duplicate_similarity)
+            available &= ~duplicates
+            dropped += int(duplicates.sum())
+
+        duration = time.perf_counter() - start
+        with self._lock:
+            self.calls += 1
+            self.over_budget += over_budget
+            self.duplicates_dropped += dropped
+        logger.debug("Re-ranked %s candidates to %s in %.2f ms", len(vectors), len(chosen), duration * 1000)
+        return chosen
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'over_budget': self.over_budget,
+                'duplicates_dropped': self.duplicates_dropped,
+            }
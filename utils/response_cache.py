@@ -0,0 +1,107 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.metrics import cache_stats, count_cache_lookups
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Per-process semantic cache of assistant answers.
+
+    An answer is reused when a new question from the same user embeds within
+    `threshold` cosine similarity of a cached question and the user's index is
+    still at the version the answer was generated from. Uploading or deleting
+    a file bumps the index version, so stale answers are never served, on this
+    worker or any other. Entries also expire after `ttl` seconds and the least
+    recently used are evicted above `max_entries`.
+    """
+
+    def __init__(self, threshold=None, ttl=None, max_entries=None):
+        self.threshold = float(os.environ.get('RESPONSE_CACHE_THRESHOLD', 0.95) if threshold is None else threshold)
+        self.ttl = float(os.environ.get('RESPONSE_CACHE_TTL', 3600) if ttl is None else ttl)
+        self.max_entries = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000) if max_entries is None
+                               else max_entries)
+        self._entries = OrderedDict()  # key -> entry, least recently used first
+        self._by_user = {}  # user_id -> {key: entry}
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, user_id, query_vector, index_version):
+        """
+        Return the cached answer for the most similar fresh question, or None.
+        """
+        query = self._normalize(query_vector)
+        now = time.time()
+        with self._lock:
+            entries = self._by_user.get(user_id, {})
+            # Drop anything expired or generated against an older index
+            for key in [key for key, entry in entries.items()
+                        if entry['version'] != index_version or now - entry['created'] > self.ttl]:
+                self._remove(key)
+
+            best_key = None
+            if entries:
+                keys = list(entries)
+                similarities = np.stack([entries[key]['vector'] for key in keys]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    best_key = keys[best]
+
+            if best_key is None:
+                self.misses += 1
+                count_cache_lookups('response', 0, 1)
+                return None
+
+            self.hits += 1
+            count_cache_lookups('response', 1, 0)
+            self._entries.move_to_end(best_key)
+            logger.debug("Response cache hit for user %s", user_id)
+            return self._entries[best_key]['answer']
+
+    def store(self, user_id, query_vector, index_version, answer):
+        entry = {
+            'user_id': user_id,
+            'vector': self._normalize(query_vector),
+            'version': index_version,
+            'answer': answer,
+            'created': time.time(),
+        }
+        with self._lock:
+            key = next(self._keys)
+            self._entries[key] = entry
+            self._by_user.setdefault(user_id, {})[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, user_id):
+        """Forget every cached answer for a user."""
+        with self._lock:
+            for key in list(self._by_user.get(user_id, {})):
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        user_entries = self._by_user[entry['user_id']]
+        del user_entries[key]
+        if not user_entries:
+            del self._by_user[entry['user_id']]
+
+    def stats(self):
+        with self._lock:
+            return cache_stats(self.hits, self.misses, entries=len(self._entries))
@@ -1,80 +1,581 @@
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
+import faiss
 import logging
+import math
 import os
-from PyPDF2 import PdfReader
+import time
+import numpy as np
+from collections import namedtuple
+from utils.ann_index import filtered_search, segment_ann_index
+from utils.concurrency import run_blocking
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_scheduler import EmbeddingScheduler
+from utils.index_store import IndexStore
+from utils.keyword_index import KeywordIndex, reciprocal_rank_fusion, search_indexes
+from utils.metrics import CHUNKS_INDEXED, observe, timed
+from utils.query_cache import LRUCache, normalize_query
+from utils.reranker import RERANK_CANDIDATES, RERANK_ENABLED, Reranker
+from utils.text_splitter import StructuredSplitter
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Retrieval strategy: 'hybrid' fuses dense and BM25 results, 'dense' or 'lexical' use one path
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'hybrid')
+# BM25 hits scoring below this fraction of the best hit only matched near-ubiquitous
+# terms ("price", "tile"); keeping them would let noise outvote an exact code match in fusion
+LEXICAL_MIN_SCORE_RATIO = float(os.environ.get('LEXICAL_MIN_SCORE_RATIO', 0.1))
+# Retrieval results (chunk ids) memoised per user, query and index version; 0 disables
+RETRIEVAL_CACHE_SIZE = int(os.environ.get('RETRIEVAL_CACHE_SIZE', 5000))
+# Index segments of similar size are merged once this many have accumulated (see TextProcessor.compact)
+INDEX_MERGE_FACTOR = int(os.environ.get('INDEX_MERGE_FACTOR', 4))
+# Segments where this share of the chunks belongs to deleted files are rewritten without them
+INDEX_MAX_DELETED_RATIO = float(os.environ.get('INDEX_MAX_DELETED_RATIO', 0.25))
+
+# A file split and embedded but not yet in any index; embeddings is a float32
+# array with one row per chunk, or None when the file produced no chunks
+PreparedDocument = namedtuple('PreparedDocument', 'file_id chunks metadatas token_counts embeddings')
+
 class TextProcessor:
-    def __init__(self):
-        self.embeddings = OpenAIEmbeddings()
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
-        self.vector_store = None
+    def __init__(self, embeddings=None, index_dir=None, chunk_loader=None):
+        self.embeddings = embeddings or CachedEmbeddings(EmbeddingScheduler())
+        # Callable returning a user's stored chunk records, used to rebuild a
+        # missing index (e.g. after the index directory was wiped)
+        self.chunk_loader = chunk_loader
+        self._users_without_chunks = set()
+        self.text_splitter = StructuredSplitter()
+        self.index_store = IndexStore(self.embeddings, index_dir)
+        self.reranker = Reranker()
+        self.retrieval_cache = LRUCache('retrieval', RETRIEVAL_CACHE_SIZE)
 
     def extract_text_from_pdf(self, pdf_file):
         """
         Extract text content from a PDF file.
         """
         try:
-            logger.debug(f"Processing PDF file")
-            reader = PdfReader(pdf_file)
-            text = ""
+            logger.debug("Processing PDF file")
+            text = "\n".join(page_text for _, page_text in self.iter_pdf_pages(pdf_file))
 
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-
-            logger.debug(f"Extracted {len(text)} characters from PDF")
+            logger.debug("Extracted %s characters from PDF", len(text))
             return text.strip()
 
         except Exception as e:
-            logger.error(f"Error extracting text from PDF: {str(e)}")
+            logger.error("Error extracting text from PDF: %s", e)
             raise
 
-    def process_document(self, text):
+    def iter_pdf_pages(self, pdf_file):
+        """
+        Yield (page_number, text) for each page of a PDF without building the whole document string.
         """
-        Process a document by splitting it into chunks and creating vector embeddings.
+        # PyPDF2 is only needed once a PDF is uploaded
+        from utils.pdf_extractor import iter_pdf_pages
+        return iter_pdf_pages(pdf_file)
+
+    def process_document(self, text, user_id, file_id):
+        """
+        Split a document into chunks, embed them and append them to the user's index.
+        Returns the chunk records, see process_pages.
+        """
+        logger.debug("Processing document of length: %s", len(text))
+        return self.process_pages([(None, text)], user_id, file_id)
+
+    def process_pages(self, pages, user_id, file_id):
+        """
+        Split (page_number, text) pairs into chunks as they arrive, embed them and
+        add them to the user's index. Only the new chunks are embedded and
+        written; the existing index is left as it is.
+
+        Returns one record per chunk (ordinal, page, text, token_count,
+        vector_id) for the caller to persist.
         """
         try:
-            logger.debug(f"Processing document of length: {len(text)}")
+            document = self.prepare_pages(pages, file_id)
+            if not document.chunks:
+                return []
+            return self.add_documents(user_id, [document])[file_id]
+
+        except Exception as e:
+            logger.error("Error processing document: %s", e)
+            raise
+
+    def prepare_pages(self, pages, file_id):
+        """
+        Split (page_number, text) pairs into chunks and embed them without
+        touching any index, so several files can be prepared at once and
+        indexed together by add_documents.
+        """
+        # Split each page into chunks, keeping the page number as chunk metadata.
+        # Pages arrive from a generator, so time spent waiting on it is extraction.
+        chunks = []
+        metadatas = []
+        token_counts = []
+        extract_seconds = split_seconds = 0.0
+        mark = time.perf_counter()
+        for page_number, page_text in pages:
+            split_start = time.perf_counter()
+            extract_seconds += split_start - mark
+            for start, end, tokens in run_blocking(self.text_splitter.split_offsets, page_text):
+                metadatas.append({'file_id': file_id, 'ordinal': len(chunks), 'page': page_number})
+                chunks.append(page_text[start:end])
+                token_counts.append(tokens)
+            mark = time.perf_counter()
+            split_seconds += mark - split_start
+        extract_seconds += time.perf_counter() - mark
+        observe('extract', extract_seconds)
+        observe('split', split_seconds)
+        logger.debug("Document split into %s chunks", len(chunks))
+
+        embeddings = None
+        if chunks:
+            # Held as float32 rows, a sixth of the size of lists of floats, since a
+            # bulk upload keeps every file's vectors until its single index commit
+            with timed('embed_documents'):
+                embeddings = np.asarray(self.embeddings.embed_documents(chunks), dtype=np.float32)
+        return PreparedDocument(file_id, chunks, metadatas, token_counts, embeddings)
+
+    def add_documents(self, user_id, documents):
+        """
+        Add prepared documents to the user's index as one new segment and one
+        commit; re-processed files replace their previous chunks. Embedding
+        and writing the segment happen beforehand, so the write lock is only
+        held to publish it, and the cost of an upload does not grow with the
+        user's corpus.
+
+        Returns {file_id: chunk records} (see process_pages).
+        """
+        documents = [document for document in documents if document.chunks]
+        if not documents:
+            return {}
+        ids = {document.file_id: [f"{document.file_id}-{i}" for i in range(len(document.chunks))]
+               for document in documents}
+        chunks = [chunk for document in documents for chunk in document.chunks]
+        metadatas = [metadata for document in documents for metadata in document.metadatas]
+        all_ids = [doc_id for document in documents for doc_id in ids[document.file_id]]
+        embeddings = np.concatenate([document.embeddings for document in documents])
 
-            # Split text into chunks
-            chunks = self.text_splitter.split_text(text)
-            logger.debug(f"Document split into {len(chunks)} chunks")
+        # Don't start a fresh index over the user's other files if theirs went missing
+        if self.index_store.current_version(user_id) is None:
+            self.warm_index(user_id)
 
-            # Create vector store
-            self.vector_store = FAISS.from_texts(chunks, self.embeddings)
-            logger.debug("Vector store created successfully")
+        with timed('index_add'):
+            run_blocking(self._add_segment, user_id, chunks, embeddings, metadatas, all_ids, ids)
+        self._users_without_chunks.discard(user_id)
+        CHUNKS_INDEXED.inc(len(chunks))
+        logger.debug("Added %s chunks for %s files to index of user %s", len(chunks), len(documents), user_id)
 
-            return len(chunks)
+        self.compact(user_id)
+        return {
+            document.file_id: [
+                {'ordinal': metadata['ordinal'], 'page': metadata['page'], 'text': chunk,
+                 'token_count': tokens, 'vector_id': doc_id}
+                for metadata, chunk, tokens, doc_id in zip(
+                    document.metadatas, document.chunks, document.token_counts, ids[document.file_id])
+            ]
+            for document in documents
+        }
+
+    def remove_document(self, user_id, file_id):
+        """
+        Remove all chunks belonging to a file from the user's index. They are
+        only marked deleted in their segment, which takes one manifest write
+        and retrains nothing; compact() drops them later and should be run
+        off the request path afterwards.
+        """
+        try:
+            return run_blocking(self._remove_file, user_id, file_id)
 
         except Exception as e:
-            logger.error(f"Error processing document: {str(e)}")
+            logger.error("Error removing document: %s", e)
             raise
 
-    def get_relevant_context(self, query, k=3):
+    def compact(self, user_id):
         """
-        Retrieve the most relevant context for a given query.
+        Merge the user's index segments in tiers: a segment's tier is
+        floor(log(live chunks, INDEX_MERGE_FACTOR)), and once a tier holds
+        INDEX_MERGE_FACTOR segments they are merged into one of the next
+        tier. Each chunk is thus rewritten O(log n) times over the life of
+        the index and a query searches O(log n) segments. A segment whose
+        share of deleted chunks reaches INDEX_MAX_DELETED_RATIO is rewritten
+        without them. Returns whether anything was merged.
+        """
+        return run_blocking(self._compact, user_id)
+
+    def _compact(self, user_id):
+        merged = False
+        while True:
+            snapshot = self.index_store.snapshot(user_id)
+            sources = self._merge_candidates(snapshot) if snapshot else None
+            # A merge that lost a race to another writer is retried on its next commit
+            if not sources or not self._merge(user_id, snapshot, sources):
+                return merged
+            merged = True
+
+    @staticmethod
+    def _merge_candidates(snapshot):
+        """Return the segments of the lowest tier that is due for a merge, or None."""
+        tiers = {}
+        for segment in snapshot.segments:
+            live = len(segment) - len(snapshot.dead_ids(segment))
+            tier = int(math.log(live, INDEX_MERGE_FACTOR)) if live > 0 else 0
+            tiers.setdefault(tier, []).append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= INDEX_MERGE_FACTOR:
+                return tiers[tier]
+        # Rewritten alone once enough of it is deleted chunks that searches mostly skip
+        for segment in snapshot.segments:
+            dead = len(snapshot.dead_ids(segment))
+            if dead and dead >= len(segment) * INDEX_MAX_DELETED_RATIO:
+                return [segment]
+        return None
+
+    def rebuild_index(self, user_id, index_type=None):
+        """
+        Merge the user's whole index into one segment, retraining its ANN
+        index and optionally switching index type ('flat', 'ivfpq', 'hnsw'
+        or 'auto'). Returns the resulting type.
+        """
+        snapshot = self.index_store.snapshot(user_id)
+        if snapshot is None:
+            return None
+        if not self._merge(user_id, snapshot, snapshot.segments, index_type):
+            # A concurrent upload changed the index first; merge what it left
+            snapshot = self.index_store.snapshot(user_id)
+            self._merge(user_id, snapshot, snapshot.segments, index_type)
+        snapshot = self.index_store.snapshot(user_id)
+        ann_meta = snapshot.segments[0].ann_meta if snapshot and len(snapshot.segments) == 1 else None
+        index_type = ann_meta['type'] if ann_meta else 'flat'
+        logger.info("Rebuilt index for user %s as %s", user_id, index_type)
+        return index_type
+
+    def restore_index(self, user_id, records, replace=True):
+        """
+        Build the user's index from stored chunk records (file_id, ordinal,
+        page, text, vector_id). Vectors come from the embedding cache, so
+        documents are neither re-extracted nor, normally, re-embedded.
+        With replace=False an index that already exists is left alone.
+        Returns the number of chunks indexed.
+        """
+        records = list(records)
+        if not records:
+            return 0
+        texts = [record['text'] for record in records]
+        embeddings = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        metadatas = [
+            {'file_id': record['file_id'], 'ordinal': record['ordinal'], 'page': record['page']}
+            for record in records
+        ]
+        ids = [record['vector_id'] for record in records]
+        file_map = {}
+        for record in records:
+            file_map.setdefault(record['file_id'], []).append(record['vector_id'])
+
+        if not run_blocking(self._restore_segment, user_id, texts, embeddings, metadatas, ids, file_map, replace):
+            return 0
+        self._users_without_chunks.discard(user_id)
+        logger.info("Restored index of user %s from %s stored chunks", user_id, len(records))
+        return len(records)
+
+    def warm_index(self, user_id):
+        """
+        Rebuild a user's missing index from the chunk loader. Returns the
+        index snapshot, or None if the user has nothing stored.
+        """
+        if self.chunk_loader is None or user_id in self._users_without_chunks:
+            return None
+        records = self.chunk_loader(user_id)
+        if not records:
+            # Remembered so users without documents don't query the database on every
+            # chat; their first upload writes an index, which is found on disk from then on
+            self._users_without_chunks.add(user_id)
+            return None
+        self.restore_index(user_id, records, replace=False)
+        return run_blocking(self.index_store.snapshot, user_id)
+
+    @staticmethod
+    def _manifest(snapshot):
+        """Return the (segment ids, {segment id: deleted file ids}) of a snapshot, for a commit to extend."""
+        if snapshot is None:
+            return [], {}
+        return ([segment.id for segment in snapshot.segments],
+                {segment_id: set(file_ids) for segment_id, file_ids in snapshot.deleted.items()})
+
+    def _add_segment(self, user_id, texts, embeddings, metadatas, ids, file_map):
+        """Write the chunks of new files as a segment and commit it, replacing earlier copies of the files."""
+        segment_id = self._write_segment(user_id, texts, embeddings, metadatas, ids, file_map)
+        try:
+            with self.index_store.write_lock(user_id):
+                snapshot = self.index_store.snapshot(user_id)
+                segments, deleted = self._manifest(snapshot)
+                # Re-processing a file replaces its previous chunks
+                files = snapshot.files() if snapshot else {}
+                for file_id in file_map:
+                    if file_id in files:
+                        deleted.setdefault(files[file_id].id, set()).add(file_id)
+                self.index_store.commit(user_id, segments + [segment_id], deleted)
+        except Exception:
+            self.index_store.discard_segment(user_id, segment_id)
+            raise
+
+    def _remove_file(self, user_id, file_id):
+        with self.index_store.write_lock(user_id):
+            snapshot = self.index_store.snapshot(user_id)
+            segment = snapshot.files().get(file_id) if snapshot else None
+            if segment is None:
+                logger.debug("No indexed chunks for file %s", file_id)
+                return 0
+
+            segments, deleted = self._manifest(snapshot)
+            deleted.setdefault(segment.id, set()).add(file_id)
+            self.index_store.commit(user_id, segments, deleted)
+        removed = len(segment.file_map[file_id])
+        logger.debug("Removed %s chunks for file %s from index of user %s", removed, file_id, user_id)
+        return removed
+
+    def _restore_segment(self, user_id, texts, embeddings, metadatas, ids, file_map, replace):
+        """Publish restored chunks as the user's whole index; returns whether it was committed."""
+        segment_id = self._write_segment(user_id, texts, embeddings, metadatas, ids, file_map)
+        with self.index_store.write_lock(user_id):
+            # Another worker may have restored it while we were embedding
+            if not replace and self.index_store.current_version(user_id) is not None:
+                self.index_store.discard_segment(user_id, segment_id)
+                return False
+            self.index_store.commit(user_id, [segment_id], {})
+        return True
+
+    def _write_segment(self, user_id, texts, embeddings, metadatas, ids, file_map, index_type=None):
+        """Build an index segment from chunks and their vectors and write it unpublished; returns its id."""
+        vector_store = FAISS.from_embeddings(
+            list(zip(texts, embeddings)), self.embeddings, metadatas=metadatas, ids=ids
+        )
+        keyword_index = KeywordIndex()
+        for doc_id, text in zip(ids, texts):
+            keyword_index.add(doc_id, text)
+        ann_index, ann_meta = segment_ann_index(embeddings, index_type, vector_store.index.metric_type)
+        return self.index_store.write_segment(user_id, vector_store, file_map, keyword_index, ann_index, ann_meta)
+
+    def _merge(self, user_id, snapshot, sources, index_type=None):
+        """
+        Replace the source segments of a snapshot with one segment holding
+        their live chunks. The merge is built without the write lock; files
+        deleted from the sources meanwhile stay deleted in the result, and if
+        a concurrent merge consumed a source first, nothing is committed.
+        Returns whether the merge was committed.
+        """
+        texts, vectors, metadatas, ids, file_map = [], [], [], [], {}
+        for segment in sources:
+            mask = snapshot.live_mask(segment)
+            positions = np.arange(len(segment)) if mask is None else np.flatnonzero(mask)
+            if len(positions):
+                vectors.append(segment.vector_store.index.reconstruct_batch(positions))
+            index_to_docstore_id = segment.vector_store.index_to_docstore_id
+            for position in positions.tolist():
+                doc_id = index_to_docstore_id[position]
+                document = segment.vector_store.docstore.search(doc_id)
+                texts.append(document.page_content)
+                metadatas.append(document.metadata)
+                ids.append(doc_id)
+            deleted = snapshot.deleted.get(segment.id, ())
+            file_map.update((file_id, doc_ids) for file_id, doc_ids in segment.file_map.items()
+                            if file_id not in deleted)
+
+        with timed('index_merge'):
+            segment_id = None
+            if ids:
+                segment_id = self._write_segment(user_id, texts, np.concatenate(vectors), metadatas, ids,
+                                                 file_map, index_type)
+            try:
+                with self.index_store.write_lock(user_id):
+                    current = self.index_store.snapshot(user_id)
+                    segments, deleted = self._manifest(current)
+                    source_ids = [segment.id for segment in sources]
+                    if current is None or not set(source_ids) <= set(segments):
+                        if segment_id is not None:
+                            self.index_store.discard_segment(user_id, segment_id)
+                        return False
+                    # Deleted from a source since the snapshot the merge was built from
+                    merged_deleted = {file_id for source in sources
+                                      for file_id in deleted.pop(source.id, set()) - snapshot.deleted.get(source.id, set())}
+                    merged = [] if segment_id is None else [segment_id]
+                    position = segments.index(source_ids[0])
+                    segments = [segment for segment in segments if segment not in source_ids]
+                    segments[position:position] = merged
+                    if merged_deleted:
+                        deleted[segment_id] = merged_deleted
+                    self.index_store.commit(user_id, segments, deleted)
+            except Exception:
+                if segment_id is not None:
+                    self.index_store.discard_segment(user_id, segment_id)
+                raise
+        logger.debug("Merged %s index segments of user %s into one of %s chunks", len(sources), user_id, len(ids))
+        return True
+
+    def embed_query(self, query):
+        """
+        Embed a query once so callers can reuse the vector for search and caching.
+        """
+        with timed('embed_query'):
+            return self.embeddings.embed_query(query)
+
+    def index_version(self, user_id):
+        """
+        Return the version of the user's index; it changes whenever a file is added or removed.
+        """
+        return self.index_store.current_version(user_id)
+
+    def file_mask(self, snapshot, file_ids):
+        """
+        Return {segment id: boolean array over the segment's index positions,
+        True for the live chunks of file_ids}; segments holding none of them
+        are left out.
+        """
+        files = snapshot.files()
+        selected = {}
+        for file_id in set(file_ids):
+            segment = files.get(file_id)
+            if segment is not None:
+                selected.setdefault(segment.id, (segment, []))[1].append(file_id)
+        masks = {}
+        for segment_id, (segment, segment_files) in selected.items():
+            position_files = segment.position_files
+            selected_files = np.zeros(int(position_files.max()) + 2, dtype=bool)
+            selected_files[segment_files] = True
+            # A chunk missing from the file map (-1) looks up the last entry, which is never set
+            masks[segment_id] = selected_files[position_files]
+        return masks
+
+    def dense_search(self, snapshot, query_vector, k, masks=None):
+        """
+        Return docstore ids of the k nearest live chunks to a query vector,
+        searching each segment's ANN index when it has one. With masks (see
+        file_mask), only the selected chunks are searched.
+        """
+        query = np.asarray([query_vector], dtype=np.float32)
+        hits = []
+        for segment in snapshot.segments:
+            mask = snapshot.live_mask(segment) if masks is None else masks.get(segment.id)
+            if masks is not None and mask is None:
+                continue
+            if mask is not None:
+                distances, indices = filtered_search(segment.vector_store.index, segment.ann_index, query, k, mask)
+            else:
+                index = segment.ann_index if segment.ann_index is not None else segment.vector_store.index
+                if index.ntotal == 0:
+                    continue
+                distances, indices = index.search(query, min(k, index.ntotal))
+            index_to_docstore_id = segment.vector_store.index_to_docstore_id
+            hits.extend((distance, index_to_docstore_id[i])
+                        for distance, i in zip(distances[0].tolist(), indices[0].tolist()) if i != -1)
+        if not hits:
+            return []
+        # Inner-product indexes score similarity, higher is better; L2 scores distance
+        similarity = snapshot.segments[0].vector_store.index.metric_type == faiss.METRIC_INNER_PRODUCT
+        hits.sort(key=lambda hit: hit[0], reverse=similarity)
+        return [doc_id for _, doc_id in hits[:k]]
+
+    def lexical_search(self, snapshot, query, k, allowed=None):
         """
-        if not self.vector_store:
+        Return docstore ids of the k best BM25 matches for a query, optionally
+        only among the allowed docstore ids.
+        """
+        results = search_indexes([(segment.keyword_index, snapshot.dead_ids(segment)) for segment in snapshot.segments],
+                                 query, k, allowed=allowed)
+        if not results:
+            return []
+        min_score = results[0][1] * LEXICAL_MIN_SCORE_RATIO
+        return [doc_id for doc_id, score in results if score >= min_score]
+
+    def rerank(self, snapshot, query_vector, fused, k):
+        """
+        Pick k of the fused (doc_id, score) candidates with the re-ranker,
+        using their exact vectors from the flat indexes.
+        """
+        chosen = self.reranker.rerank(
+            query_vector, snapshot.vectors([doc_id for doc_id, _ in fused]), [score for _, score in fused], k
+        )
+        return [fused[i][0] for i in chosen]
+
+    def retrieve(self, query, user_id, k=3, query_vector=None, mode=None, file_ids=None, rerank=None):
+        """
+        Return the k most relevant chunk Documents for a query.
+
+        Every user has their own index, so results only ever come from the
+        user's files; file_ids narrows them further to a selection of files.
+
+        In hybrid mode both the dense and the BM25 path fetch a wider candidate
+        list, which is merged with reciprocal rank fusion; exact product codes
+        that embed poorly still surface through the lexical side. With
+        rerank (RERANK_ENABLED by default) the top RERANK_CANDIDATES fused
+        results are re-ranked for relevance and diversity to pick the k.
+
+        The whole query runs against one snapshot of the index, and results
+        are memoised per snapshot version, so the same (normalised) query
+        asked again before the user's files change is answered without
+        embedding or searching.
+        """
+        mode = mode or RETRIEVAL_MODE
+        rerank = RERANK_ENABLED if rerank is None else rerank
+        snapshot = run_blocking(self.index_store.snapshot, user_id) or self.warm_index(user_id)
+        if snapshot is None or snapshot.ntotal == 0:
             logger.warning("No vector store available. Process a document first.")
-            return ""
+            return []
 
+        key = (user_id, snapshot.version, normalize_query(query), k, mode, rerank,
+               None if file_ids is None else tuple(sorted(set(file_ids))))
+        doc_ids = self.retrieval_cache.get(key)
+        if doc_ids is None:
+            # Embedded here: the search runs on a native thread, which must not use the OpenAI client
+            if query_vector is None and mode != 'lexical':
+                query_vector = self.embed_query(query)
+            doc_ids = run_blocking(self._search, snapshot, query, k, query_vector, mode, file_ids, rerank)
+            self.retrieval_cache.put(key, doc_ids)
+        return [snapshot.document(doc_id) for doc_id in doc_ids]
+
+    def _search(self, snapshot, query, k, query_vector, mode, file_ids, rerank):
+        """
+        Run retrieve's search against one index snapshot; returns docstore ids.
+        query_vector is required unless mode is 'lexical'.
+        """
+        # Lexical-only retrieval has no query vector to re-rank with
+        rerank = rerank and (mode != 'lexical' or query_vector is not None)
+
+        masks = allowed = None
+        if file_ids is not None:
+            masks = self.file_mask(snapshot, file_ids)
+            if not masks:
+                return []
+            if mode in ('hybrid', 'lexical'):
+                allowed = snapshot.doc_ids(file_ids)
+
+        fetch_k = k if mode != 'hybrid' else max(k * 4, 20)
+        if rerank and mode != 'hybrid':
+            # Hybrid fusion already yields a wide pool; deeper lists would only change its ranking
+            fetch_k = max(fetch_k, RERANK_CANDIDATES)
+        # Lexical results go first so that, on a fusion tie, an exact term match wins
+        result_lists = []
+        if mode in ('hybrid', 'lexical'):
+            with timed('lexical_search'):
+                result_lists.append(self.lexical_search(snapshot, query, fetch_k, allowed))
+        if mode in ('hybrid', 'dense'):
+            with timed('dense_search'):
+                result_lists.append(self.dense_search(snapshot, query_vector, fetch_k, masks))
+
+        if rerank:
+            fused = reciprocal_rank_fusion(result_lists, with_scores=True)[:max(RERANK_CANDIDATES, k)]
+            with timed('rerank'):
+                return self.rerank(snapshot, query_vector, fused, k) if fused else []
+        return reciprocal_rank_fusion(result_lists)[:k]
+
+    def get_relevant_context(self, query, user_id, k=3, query_vector=None):
+        """
+        Retrieve the most relevant context for a given query.
+        """
         try:
             # Search for relevant chunks
-            relevant_chunks = self.vector_store.similarity_search(query, k=k)
+            relevant_chunks = self.retrieve(query, user_id, k=k, query_vector=query_vector)
             context = "\n".join(doc.page_content for doc in relevant_chunks)
 
-            logger.debug(f"Retrieved {len(relevant_chunks)} relevant chunks for query")
+            logger.debug("Retrieved %s relevant chunks for query", len(relevant_chunks))
             return context
 
         except Exception as e:
-            logger.error(f"Error retrieving context: {str(e)}")
-            raise
\ No newline at end of file
+            logger.error("Error retrieving context: %s", e)
+            raise
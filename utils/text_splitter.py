@@ -0,0 +1,291 @@
+import os
+import re
+import logging
+from collections import namedtuple
+
+from utils.tokens import count_tokens_batch
+
+logger = logging.getLogger(__name__)
+
+# Chunk budget in tokens (the old 1000-character chunks were about 250)
+SPLIT_CHUNK_TOKENS = int(os.environ.get('SPLIT_CHUNK_TOKENS', 256))
+# Tokens repeated from the previous chunk, only when a paragraph is cut in two
+SPLIT_OVERLAP_TOKENS = int(os.environ.get('SPLIT_OVERLAP_TOKENS', 32))
+# A heading starts a new chunk once the current one holds at least this many
+# tokens; smaller sections share a chunk rather than becoming fragments
+SPLIT_MIN_TOKENS = int(os.environ.get('SPLIT_MIN_TOKENS', 64))
+
+HEADING, TABLE, TEXT = 'heading', 'table', 'text'
+
+HEADING_MAX_CHARS = 80
+# Blocks longer than chunk budget times this many characters are cut into
+# sentences or rows before counting; no English text averages more per token
+SURELY_OVER_CHARS_PER_TOKEN = 8
+
+_LINE = re.compile(r'[^\n]*\n?')
+_SENTENCE_END = re.compile(r'[.!?:;]\s+')
+# Line kinds: blank, table row (two or more column gaps: tabs, runs of
+# spaces or pipes) or heading (markdown, "2.1 Title", or upper case); any
+# other line is paragraph text
+_COLUMN_GAP = r'(?:\t| {2,}| *\| *)'
+_LINE_KIND = re.compile(
+    r'(?P<blank>[ \t]*)'
+    rf'|(?P<table>[^\n]*?\S{_COLUMN_GAP}\S(?:[^\n]*?\S)?{_COLUMN_GAP}\S[^\n]*)'
+    r'|(?P<heading>[ \t]*(?:#{1,6}[ \t]|(?:\d+\.)+\d*[ \t]+[A-Z]|(?=[^a-z\n]*[A-Z][^a-z\n]*[A-Z][^a-z\n]*[A-Z])[^a-z\n]*$)[^\n]*)'
+)
+# Markers of the few lines that can be anything but paragraph text: a
+# newline before a line that is blank or starts with "#" or a digit, a column
+# gap, or three capitals not separated by lower case. Each is scanned for
+# separately; one combined pattern would stop at every space in the text.
+def _match_start(match):
+    return -1 if match is None else match.start()
+
+
+_LINE_BREAK = re.compile(r'\n(?=[ \t]*(?:\n|$|#|\d))')
+_CAPITALS = re.compile(r'[A-Z][^a-z\n]*[A-Z][^a-z\n]*[A-Z]')
+_CANDIDATE_FINDERS = (
+    lambda text, position: _match_start(_LINE_BREAK.search(text, position)),
+    lambda text, position: _match_start(_CAPITALS.search(text, position)),
+    lambda text, position: text.find('  ', position),
+    lambda text, position: text.find('\t', position),
+    lambda text, position: text.find('|', position),
+)
+
+# A span of the page buffer: [start, end) with its token count
+Unit = namedtuple('Unit', 'start end tokens kind block')
+
+
+def _is_heading(line):
+    line = line.strip()
+    return len(line) <= HEADING_MAX_CHARS and not line.endswith(('.', ',', ';', ':'))
+
+
+def structure_spans(text):
+    """
+    Yield (start, end, kind) for the blank (kind None), table and heading
+    lines of text, in order. Unlisted lines are paragraph text.
+
+    Only lines flagged by the marker finders are classified, so paragraph
+    lines cost no Python-level work.
+    """
+    hits = [find(text, 0) for find in _CANDIDATE_FINDERS]
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        end = len(text) if end == -1 else end
+        match = _LINE_KIND.fullmatch(text, start, end)
+        span_end = min(end + 1, len(text))
+        if match is None:
+            pass
+        elif match.lastgroup == 'blank':
+            if span_end > start:
+                yield start, span_end, None
+        elif match.lastgroup == 'table':
+            yield start, span_end, TABLE
+        elif _is_heading(match.group('heading')):
+            yield start, span_end, HEADING
+        # Move every finder that has fallen behind past this line, so each
+        # finder reads the text once and each line is classified once
+        for index, hit in enumerate(hits):
+            if hit != -1 and hit < end:
+                hits[index] = _CANDIDATE_FINDERS[index](text, end)
+        live = [hit for hit in hits if hit != -1]
+        if not live:
+            return
+        position = min(live)
+        start = position + 1 if text[position] == '\n' else text.rfind('\n', 0, position) + 1
+
+
+def classify_line(line):
+    """Return HEADING, TABLE or TEXT for one line of extracted text."""
+    for _, _, kind in structure_spans(line):
+        return kind or TEXT
+    return TEXT
+
+
+class StructuredSplitter:
+    """
+    Token-budgeted splitter that follows document structure.
+
+    Each page is cut into blocks (headings, paragraphs, tables) held as
+    offsets into the page text. Blocks are packed into chunks of at most
+    chunk_tokens. Headings open a new chunk and never end one, tables stay
+    whole when they fit and otherwise break between rows, and chunks never
+    span pages. Overlap is only added where a paragraph had to be cut, so
+    chunks that end on a structural boundary repeat nothing. Token counts
+    come from one batched tokenizer call per page; text is only copied
+    out of the page buffer for the finished chunks.
+    """
+
+    def __init__(self, chunk_tokens=None, overlap_tokens=None, min_tokens=None, model='gpt-4'):
+        self.chunk_tokens = chunk_tokens or SPLIT_CHUNK_TOKENS
+        self.overlap_tokens = SPLIT_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+        self.min_tokens = SPLIT_MIN_TOKENS if min_tokens is None else min_tokens
+        self.model = model
+
+    def split_text(self, text):
+        """Split one text into chunk strings."""
+        return [text[start:end] for start, end, _ in self.split_offsets(text)]
+
+    def split_pages(self, pages):
+        """
+        Yield (page_number, chunk, tokens) for (page_number, text) pairs as
+        they arrive, so pages streamed from the extractor are never joined.
+        """
+        for page_number, text in pages:
+            for start, end, tokens in self.split_offsets(text):
+                yield page_number, text[start:end], tokens
+
+    def split_offsets(self, text):
+        """
+        Return (start, end, tokens) for the chunks of one page. Token counts
+        are the sums over the chunk's pieces, within a token or two of
+        tokenizing the chunk on its own.
+        """
+        blocks = self._blocks(text)
+        if not blocks:
+            return []
+        units = self._units(text, blocks)
+        return [self._trim(text, start, end) + (tokens,) for start, end, tokens in self._pack(units)]
+
+    def _blocks(self, text):
+        """
+        Group lines into (start, end, kind) blocks: a heading line, a run of
+        table rows, or the paragraph text between them and blank lines.
+        """
+        blocks = []
+        position = 0
+        for start, end, kind in structure_spans(text):
+            if start > position:
+                blocks.append((position, start, TEXT))
+            if kind == TABLE and blocks and blocks[-1][2] == TABLE and blocks[-1][1] == start:
+                blocks[-1] = (blocks[-1][0], end, TABLE)
+            elif kind is not None:
+                blocks.append((start, end, kind))
+            position = end
+        if position < len(text) and not text[position:].isspace():
+            blocks.append((position, len(text), TEXT))
+        return blocks
+
+    def _units(self, text, blocks):
+        """
+        Token-counted units to pack: whole blocks where they fit a chunk,
+        otherwise table rows or sentences, and word runs for anything longer.
+
+        Blocks far too long for a chunk are cut into pieces up front, so
+        usually all of a page is counted in a single batch.
+        """
+        spans = []
+        for number, (start, end, kind) in enumerate(blocks):
+            if end - start > self.chunk_tokens * SURELY_OVER_CHARS_PER_TOKEN:
+                spans.extend((a, b, kind, number) for a, b in self._pieces(text, start, end, kind))
+            else:
+                spans.append((start, end, kind, number))
+        counts = count_tokens_batch([text[start:end] for start, end, _, _ in spans], self.model)
+
+        oversized = [index for index, tokens in enumerate(counts) if tokens > self.chunk_tokens]
+        if oversized:
+            # A block that looked short enough but is not: count its pieces too
+            pieces = {}
+            for index in oversized:
+                start, end, kind, number = spans[index]
+                if blocks[number][:2] == (start, end):
+                    pieces[index] = [(a, b, kind, number) for a, b in self._pieces(text, start, end, kind)]
+            piece_counts = iter(count_tokens_batch(
+                [text[a:b] for piece_list in pieces.values() for a, b, _, _ in piece_list], self.model))
+            expanded_spans, expanded_counts = [], []
+            for index, (span, tokens) in enumerate(zip(spans, counts)):
+                if index in pieces:
+                    expanded_spans.extend(pieces[index])
+                    expanded_counts.extend(next(piece_counts) for _ in pieces[index])
+                else:
+                    expanded_spans.append(span)
+                    expanded_counts.append(tokens)
+            spans, counts = expanded_spans, expanded_counts
+
+        units = []
+        for (start, end, kind, number), tokens in zip(spans, counts):
+            if tokens <= self.chunk_tokens:
+                units.append(Unit(start, end, tokens, kind, number))
+            else:
+                units.extend(self._word_runs(text, start, end, tokens, kind, number))
+        return units
+
+    def _pieces(self, text, start, end, kind):
+        """Table rows or sentences of a block, as (start, end) offsets."""
+        pattern = _LINE if kind == TABLE else _SENTENCE_END
+        cuts = [match.end() for match in pattern.finditer(text, start, end)]
+        bounds = [start] + cuts + [end]
+        return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+    def _word_runs(self, text, start, end, tokens, kind, block):
+        """
+        Cut an over-long span at whitespace, sizing runs by its characters
+        per token. Runs are counted rather than estimated, and cut again if
+        they still exceed the budget, so packing them cannot overshoot it.
+        """
+        chars_per_run = max(1, (end - start) * self.chunk_tokens // tokens)
+        bounds = []
+        position = start
+        while position < end:
+            cut = min(end, position + chars_per_run)
+            if cut < end:
+                space = text.rfind(' ', position + 1, cut)
+                cut = space + 1 if space > position else cut
+            bounds.append((position, cut))
+            position = cut
+        runs = []
+        for (run_start, run_end), run_tokens in zip(
+                bounds, count_tokens_batch([text[a:b] for a, b in bounds], self.model)):
+            if run_tokens > self.chunk_tokens and run_end - run_start > 1:
+                runs.extend(self._word_runs(text, run_start, run_end, run_tokens, kind, block))
+            else:
+                runs.append(Unit(run_start, run_end, run_tokens, kind, block))
+        return runs
+
+    def _pack(self, units):
+        """Greedily fill chunks with units; returns (start, end, tokens) per chunk."""
+        chunks = []
+        current = []
+        current_tokens = 0
+        for unit in units:
+            full = current and current_tokens + unit.tokens > self.chunk_tokens
+            at_heading = (unit.kind == HEADING and current and current_tokens >= self.min_tokens
+                          and current[-1].kind != HEADING)
+            if full or at_heading:
+                # Headings belong with what follows them
+                carried = []
+                carried_tokens = 0
+                while (current[-1].kind == HEADING and len(current) > 1
+                       and carried_tokens + current[-1].tokens + unit.tokens <= self.chunk_tokens):
+                    carried_tokens += current[-1].tokens
+                    carried.insert(0, current.pop())
+                chunks.append((current[0].start, current[-1].end, current_tokens - carried_tokens))
+                if full and not carried and current[-1].block == unit.block and unit.kind == TEXT:
+                    carried = self._overlap(current, min(self.overlap_tokens, self.chunk_tokens - unit.tokens))
+                    carried_tokens = sum(carried_unit.tokens for carried_unit in carried)
+                current = carried
+                current_tokens = carried_tokens
+            current.append(unit)
+            current_tokens += unit.tokens
+        if current:
+            chunks.append((current[0].start, current[-1].end, current_tokens))
+        return chunks
+
+    def _overlap(self, units, budget):
+        """Trailing units of the paragraph being cut, within budget tokens."""
+        carried = []
+        tokens = 0
+        for unit in reversed(units):
+            if unit.block != units[-1].block or tokens + unit.tokens > budget:
+                break
+            carried.insert(0, unit)
+            tokens += unit.tokens
+        return carried
+
+    def _trim(self, text, start, end):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return start, end
@@ -0,0 +1,63 @@
+import functools
+import logging
+
+import tiktoken
+
+from utils.concurrency import gevent_active
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio for English prose, used when the real
+# tokenizer is unavailable (tiktoken downloads its BPE files on first use).
+CHARS_PER_TOKEN = 4
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model):
+    """
+    Return the tiktoken encoding for a model, or None if it cannot be loaded.
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        logger.warning("Tokenizer for %s unavailable, estimating token counts: %s", model, e)
+        return None
+
+
+def count_tokens(text, model='gpt-4'):
+    """
+    Count tokens the way the OpenAI API will, falling back to an estimate.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_tokens_batch(texts, model='gpt-4'):
+    """
+    Token counts for many texts, encoded in one batch by tiktoken's threads.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return [len(text) // CHARS_PER_TOKEN + 1 for text in texts]
+    if gevent_active():
+        # tiktoken's threads would be greenlets, which run one at a time anyway
+        # and must not be started from run_blocking threads
+        return [len(encoding.encode_ordinary(text)) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+
+def truncate_tokens(text, max_tokens, model='gpt-4'):
+    """
+    Cut text down to at most max_tokens tokens, falling back to an estimate.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        # The estimate rounds up, so one character less keeps it at max_tokens
+        return text[:max(max_tokens * CHARS_PER_TOKEN - 1, 0)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
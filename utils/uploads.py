@@ -0,0 +1,123 @@
+import os
+import zlib
+import uuid
+import shutil
+import logging
+import zipfile
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = {'zip'}
+# Limits on one bulk upload, counting archive members rather than archives;
+# the byte limit is on uncompressed size, so small archives can't expand without bound
+BULK_MAX_FILES = int(os.environ.get('BULK_MAX_FILES', 1000))
+BULK_MAX_BYTES = int(os.environ.get('BULK_MAX_BYTES', 1024 ** 3))
+COPY_BUFFER_BYTES = 1024 * 1024
+
+
+class UploadLimitError(ValueError):
+    """A bulk upload holds more files or bytes than allowed."""
+
+
+def extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+class BulkUpload:
+    """
+    Saves the documents of a bulk upload into the upload folder one at a
+    time: plain files as they are, and each supported member of a zip
+    archive streamed straight from the archive to its own file.
+
+    Werkzeug spools uploaded files larger than 500 KB to a temporary file,
+    and zipfile reads members from it on demand, so neither an archive nor
+    a member is ever held in memory whole. Saved is a list of (stored
+    filename, original filename); skipped lists the names that were not
+    saved with the reason.
+    """
+
+    def __init__(self, folder, allowed_extensions, max_files=None, max_bytes=None):
+        self.folder = folder
+        self.allowed_extensions = allowed_extensions
+        self.max_files = max_files or BULK_MAX_FILES
+        self.max_bytes = max_bytes or BULK_MAX_BYTES
+        self.saved = []
+        self.skipped = []
+        self.total_bytes = 0
+
+    def add(self, upload):
+        """Save one uploaded file (a werkzeug FileStorage), expanding archives."""
+        if extension(upload.filename) in ARCHIVE_EXTENSIONS:
+            self._add_archive(upload)
+        elif extension(upload.filename) in self.allowed_extensions:
+            self._save(upload.filename, upload.stream)
+        else:
+            self._skip(upload.filename, 'Invalid file type')
+
+    def discard(self):
+        """Remove every file saved so far, e.g. when the upload is rejected."""
+        for stored_filename, _ in self.saved:
+            path = os.path.join(self.folder, stored_filename)
+            if os.path.exists(path):
+                os.remove(path)
+        self.saved = []
+
+    def _add_archive(self, upload):
+        try:
+            with zipfile.ZipFile(upload.stream) as archive:
+                for info in archive.infolist():
+                    name = os.path.basename(info.filename)
+                    # Folders, and the resource forks and dotfiles macOS adds to archives
+                    if info.is_dir() or not name or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+                        continue
+                    if extension(name) not in self.allowed_extensions:
+                        self._skip(info.filename, 'Invalid file type')
+                    elif info.flag_bits & 0x1:
+                        self._skip(info.filename, 'Encrypted archive member')
+                    else:
+                        # zipfile stops reading a member at its declared size
+                        self._reserve(info.file_size)
+                        try:
+                            with archive.open(info) as member:
+                                self._save(name, member, reserved=True)
+                        except (zipfile.BadZipFile, NotImplementedError, EOFError, zlib.error) as e:
+                            logger.warning("Skipping unreadable archive member %s: %s", info.filename, e)
+                            self._skip(info.filename, f'Unreadable archive member: {e}')
+        except zipfile.BadZipFile as e:
+            self._skip(upload.filename, f'Invalid zip archive: {e}')
+
+    def _reserve(self, num_bytes):
+        if len(self.saved) >= self.max_files:
+            raise UploadLimitError(f'Too many files, at most {self.max_files} per upload')
+        if self.total_bytes + num_bytes > self.max_bytes:
+            raise UploadLimitError(f'Upload too large, at most {self.max_bytes} bytes uncompressed')
+        self.total_bytes += num_bytes
+
+    def _save(self, filename, source, reserved=False):
+        original_filename = secure_filename(filename)
+        if not original_filename or extension(original_filename) not in self.allowed_extensions:
+            self._skip(filename, 'Invalid file name')
+            return
+        if not reserved:
+            self._reserve(0)
+        stored_filename = f"{uuid.uuid4()}_{original_filename}"
+        path = os.path.join(self.folder, stored_filename)
+        try:
+            with open(path, 'wb') as target:
+                shutil.copyfileobj(source, target, COPY_BUFFER_BYTES)
+                size = target.tell()
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        if not reserved:
+            try:
+                self._reserve(size)
+            except UploadLimitError:
+                os.remove(path)
+                raise
+        self.saved.append((stored_filename, original_filename))
+
+    def _skip(self, filename, error):
+        self.skipped.append({'filename': filename, 'error': error})